@@ -0,0 +1,316 @@
+"""
+Inverted index from authors to their entries.
+
+An :class:`AuthorIndex` maps each author name to the entries it appears in,
+and its position in each, so the entries of one author can be found without
+scanning the whole bibliography. This is for generating pages or CVs for many
+people from one master bibliography: the index is built once, saved next to
+the bibliography, and reused while the bibliography is unchanged.
+
+Names are normalized for lookup (see :func:`normalize_author_name`), so
+e.g. ``Mungall CJ`` also finds ``Mungall, C.J.``. Regex queries are matched
+against the distinct author names, rather than every author of every entry.
+"""
+
+import logging
+import re
+import sqlite3
+from bisect import bisect_left
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from bibliomancer.datamodel.biblio import Entry
+from bibliomancer.entry_index import (
+    create_index_file,
+    file_source,
+    is_current_index,
+    read_index_entries,
+    read_index_meta,
+)
+from bibliomancer.utilities import AuthorMatcher, author_matcher, is_author_regex
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_SUFFIX = ".authors.sqlite"
+
+_PERIODS = re.compile(r"\.")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_author_name(name: str) -> str:
+    """
+    Normalize an author name for lookup.
+
+    >>> normalize_author_name("Mungall, C.J.")
+    'mungall cj'
+    >>> normalize_author_name(" Mungall  CJ ")
+    'mungall cj'
+
+    :param name:
+    :return:
+    """
+    return _SPACES.sub(" ", _PERIODS.sub("", name).replace(",", " ")).strip().lower()
+
+
+def default_index_path(input_file: Union[str, Path]) -> str:
+    """
+    Get the path of the author index saved alongside a bibliography.
+
+    >>> default_index_path("refs/master.bibm.jsonl")
+    'refs/master.bibm.jsonl.authors.sqlite'
+
+    :param input_file:
+    :return:
+    """
+    return f"{input_file}{DEFAULT_INDEX_SUFFIX}"
+
+
+class AuthorIndex:
+    """
+    An updatable inverted index from author names to entries and positions.
+
+    >>> ix = AuthorIndex([Entry(title="t1", authors=["Doe J", "Mungall CJ"]), Entry(title="t2", authors=["Roe R"])])
+    >>> [(e.title, position) for e, position in ix.matches("Mungall, CJ")]
+    [('t1', 2)]
+    >>> [e.title for e in ix.entries_for(["Roe R?", "Doe J"])]
+    ['t1', 't2']
+    """
+
+    def __init__(self, entries: Iterable[Entry] = ()):
+        """
+        Create an index.
+
+        :param entries: entries to add
+        """
+        self._entries: Dict[int, Entry] = {}
+        self._ids: Dict[int, int] = {}
+        # author name, as written, to entry id to position (1-based)
+        self._postings: Dict[str, Dict[int, int]] = {}
+        # normalized name to names as written
+        self._names: Dict[str, Set[str]] = {}
+        # names each entry was indexed under, as entries may be changed in place before update
+        self._entry_authors: Dict[int, List[str]] = {}
+        # sorted normalized names, for prefix queries; rebuilt when needed after the names change
+        self._sorted_names: Optional[List[str]] = None
+        self._next_id = 0
+        for entry in entries:
+            self.add(entry)
+
+    def _insert(self, entry_id: int, authors: List[str]) -> None:
+        self._entry_authors[entry_id] = authors
+        for position, author in enumerate(authors, 1):
+            postings = self._postings.get(author, None)
+            if postings is None:
+                postings = self._postings[author] = {}
+                self._add_name(author)
+            postings[entry_id] = position
+
+    def _delete(self, entry_id: int) -> None:
+        for author in set(self._entry_authors.pop(entry_id)):
+            postings = self._postings[author]
+            postings.pop(entry_id, None)
+            if not postings:
+                del self._postings[author]
+                normalized = normalize_author_name(author)
+                names = self._names[normalized]
+                names.discard(author)
+                if not names:
+                    del self._names[normalized]
+                    self._sorted_names = None
+
+    def _add_name(self, author: str) -> None:
+        normalized = normalize_author_name(author)
+        if normalized not in self._names:
+            self._names[normalized] = set()
+            self._sorted_names = None
+        self._names[normalized].add(author)
+
+    def _names_with_prefix(self, prefix: str) -> Iterator[str]:
+        if self._sorted_names is None:
+            self._sorted_names = sorted(self._names)
+        for i in range(bisect_left(self._sorted_names, prefix), len(self._sorted_names)):
+            normalized = self._sorted_names[i]
+            if not normalized.startswith(prefix):
+                break
+            yield from self._names[normalized]
+
+    def _entry_id(self, entry: Entry) -> int:
+        entry_id = self._ids.get(id(entry), None)
+        if entry_id is None:
+            raise KeyError(f"Entry is not in the index: {entry}")
+        return entry_id
+
+    def add(self, entry: Entry) -> None:
+        """
+        Add an entry.
+
+        :param entry:
+        :return:
+        """
+        if id(entry) in self._ids:
+            raise ValueError(f"Entry is already in the index: {entry}")
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = entry
+        self._ids[id(entry)] = entry_id
+        self._insert(entry_id, list(entry.authors or []))
+
+    def remove(self, entry: Entry) -> None:
+        """
+        Remove an entry.
+
+        :param entry: the entry object, as added
+        :return:
+        :raises KeyError: if the entry is not in the index
+        """
+        entry_id = self._entry_id(entry)
+        self._delete(entry_id)
+        del self._ids[id(entry)]
+        del self._entries[entry_id]
+
+    def update(self, entry: Entry) -> None:
+        """
+        Re-index an entry after its authors have changed.
+
+        :param entry: the entry object, as added
+        :return:
+        """
+        entry_id = self._entry_id(entry)
+        self._delete(entry_id)
+        self._insert(entry_id, list(entry.authors or []))
+
+    def _positions(self, query: Union[str, AuthorMatcher], partial=False) -> Dict[int, int]:
+        if isinstance(query, AuthorMatcher):
+            names = [n for n in self._postings if query.matches(n)]
+        elif not is_author_regex(query):
+            # a plain name rather than a regex
+            if partial:
+                names = list(self._names_with_prefix(normalize_author_name(query)))
+            else:
+                names = self._names.get(normalize_author_name(query), ())
+        else:
+            matcher = author_matcher((query,), partial)
+            names = [n for n in self._postings if matcher.matches(n)]
+        positions: Dict[int, int] = {}
+        for name in names:
+            for entry_id, position in self._postings[name].items():
+                positions[entry_id] = max(position, positions.get(entry_id, 0))
+        return positions
+
+    def matches(self, query: Union[str, AuthorMatcher], partial=False) -> List[Tuple[Entry, int]]:
+        """
+        Find the entries of an author, with the author's position in each.
+
+        Plain names are looked up after normalization, in time proportional to the number
+        of results. Regexes, as for :func:`bibliomancer.utilities.author_matches`, are
+        matched against each distinct author name; as there, a period is regex syntax
+        (see :func:`bibliomancer.utilities.is_author_regex`).
+
+        :param query: name or regex, or a compiled matcher
+        :param partial: if True, a query matches the start of a name
+        :return: list of (entry, position), in the order the entries were added
+        """
+        positions = self._positions(query, partial)
+        return [(self._entries[entry_id], positions[entry_id]) for entry_id in sorted(positions)]
+
+    def entries_for(self, queries: Union[str, List[str]], partial=False) -> List[Entry]:
+        """
+        Find the entries of any of several authors.
+
+        :param queries: names or regexes
+        :param partial: if True, a query matches the start of a name
+        :return: entries, in the order they were added
+        """
+        if isinstance(queries, str):
+            queries = [queries]
+        entry_ids = set()
+        for query in queries:
+            entry_ids.update(self._positions(query, partial))
+        return [self._entries[entry_id] for entry_id in sorted(entry_ids)]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[Entry]:
+        return iter(list(self._entries.values()))
+
+    def __contains__(self, entry: Entry) -> bool:
+        return id(entry) in self._ids
+
+    def save(self, path: Union[str, Path], source: Dict[str, Any] = None) -> None:
+        """
+        Save the index and its entries to a SQLite file, replacing any existing index there.
+
+        :param path:
+        :param source: description of where the entries came from, used by :meth:`from_file`
+        :return:
+        """
+        connection = create_index_file(path, {"source": source}, self._entries)
+        try:
+            connection.execute("CREATE TABLE author (name TEXT, entry_id INTEGER, position INTEGER)")
+            connection.executemany(
+                "INSERT INTO author VALUES (?, ?, ?)",
+                (
+                    (name, entry_id, position)
+                    for name, postings in self._postings.items()
+                    for entry_id, position in postings.items()
+                ),
+            )
+            connection.commit()
+        finally:
+            connection.close()
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "AuthorIndex":
+        """
+        Load an index saved with :meth:`save`.
+
+        :param path:
+        :return:
+        """
+        ix = cls()
+        connection = sqlite3.connect(str(path))
+        try:
+            read_index_meta(connection)
+            for entry_id, entry in read_index_entries(connection).items():
+                ix._entries[entry_id] = entry
+                ix._ids[id(entry)] = entry_id
+                ix._entry_authors[entry_id] = []
+                ix._next_id = entry_id + 1
+            for name, entry_id, position in connection.execute("SELECT name, entry_id, position FROM author"):
+                postings = ix._postings.get(name, None)
+                if postings is None:
+                    postings = ix._postings[name] = {}
+                    ix._add_name(name)
+                postings[entry_id] = position
+                ix._entry_authors[entry_id].append((position, name))
+            for entry_id, authors in ix._entry_authors.items():
+                ix._entry_authors[entry_id] = [name for _, name in sorted(authors)]
+        finally:
+            connection.close()
+        return ix
+
+    @classmethod
+    def from_file(cls, input_file: Union[str, Path], index_path: Union[str, Path] = None, **kwargs) -> "AuthorIndex":
+        """
+        Load the author index of a bibliography file, building and saving it if needed.
+
+        The saved index is used while the bibliography has the same size and
+        modification time as when it was built.
+
+        :param input_file: bibliography file
+        :param index_path: path of the saved index; defaults to :func:`default_index_path`
+        :param kwargs: passed to :func:`bibliomancer.io.load_file_iter`
+        :return:
+        """
+        from bibliomancer.io import load_file_iter
+
+        if index_path is None:
+            index_path = default_index_path(input_file)
+        source = file_source(input_file)
+        if is_current_index(index_path, source):
+            logger.info(f"Using saved author index {index_path} for {input_file}")
+            return cls.load(index_path)
+        ix = cls(load_file_iter(input_file, **kwargs))
+        ix.save(index_path, source=source)
+        return ix
@@ -0,0 +1,522 @@
+"""
+BibTeX loader and writer.
+
+The parser is a single-pass tokenizer over a buffered stream. It handles nested
+braces, quoted values, ``#`` concatenation, ``@string`` macros, ``@comment`` and
+``@preamble``. Entries are yielded as soon as they have been read, so memory use
+does not grow with the size of the file.
+
+LaTeX markup is not interpreted beyond removing protective braces and escapes of
+special characters.
+"""
+
+import logging
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple, Union
+
+import bibliomancer.datamodel.biblio as bibm
+from bibliomancer.utilities import construct_entry
+
+logger = logging.getLogger(__name__)
+
+BIBTEX_TYPE_MAP = {
+    "article": "JournalArticle",
+    "inproceedings": "ConferencePaper",
+    "conference": "ConferencePaper",
+    "proceedings": "ConferenceProceeding",
+    "incollection": "BookChapter",
+    "inbook": "BookChapter",
+    "book": "Book",
+    "phdthesis": "Dissertation",
+    "mastersthesis": "Dissertation",
+    "techreport": "Report",
+    "unpublished": "Preprint",
+    "dataset": "Dataset",
+    "software": "Software",
+    "misc": "Other",
+}
+
+# preferred BibTeX type for each entry type, when writing
+ENTRY_TYPE_MAP = {
+    "JournalArticle": "article",
+    "ConferencePaper": "inproceedings",
+    "ConferenceProceeding": "proceedings",
+    "BookChapter": "incollection",
+    "Book": "book",
+    "Dissertation": "phdthesis",
+    "Report": "techreport",
+    "Preprint": "unpublished",
+    "Dataset": "dataset",
+    "Software": "software",
+}
+
+# BibTeX field to Entry slot, for fields that map directly
+FIELD_MAP = {
+    "title": "title",
+    "journal": "journal",
+    "booktitle": "conference_proceedings",
+    "year": "year",
+    "volume": "volume",
+    "number": "issue",
+    "pages": "pages",
+    "doi": "doi",
+    "pmid": "pmid",
+    "pmcid": "pmcid",
+}
+
+MONTH_MACROS = {
+    m: m.capitalize() for m in ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+}
+
+_NAME = re.compile(r"[^\s=,{}()\"#]+")
+_WHITESPACE = re.compile(r"\s+")
+_BRACES = re.compile(r"[{}]")
+_BRACE_OR_QUOTE = re.compile(r'[{}"]')
+_ESCAPED = re.compile(r"\\([&%$#_])")
+_SPECIAL = re.compile(r"([&%$#_])")
+_AND = re.compile(r"\s+and\s+", re.IGNORECASE)
+_INITIALS = re.compile(r"^(.+?) ([A-Z]{1,4})$")
+
+
+class _Incomplete(Exception):
+    """Raised when the buffer ends part way through an entry."""
+
+
+class _NotAnEntry(Exception):
+    """Raised when an @ is not followed by an entry type and opening delimiter."""
+
+
+class BibTeXParseError(ValueError):
+    """Raised on malformed BibTeX."""
+
+
+class _Scanner:
+    """Cursor over a text buffer."""
+
+    def __init__(self, text: str, pos: int = 0):
+        self.text = text
+        self.pos = pos
+
+    def skip_whitespace(self) -> None:
+        text = self.text
+        n = len(text)
+        pos = self.pos
+        while pos < n and text[pos].isspace():
+            pos += 1
+        if pos >= n:
+            raise _Incomplete()
+        self.pos = pos
+
+    def peek(self) -> str:
+        self.skip_whitespace()
+        return self.text[self.pos]
+
+    def expect(self, chars: str) -> str:
+        c = self.peek()
+        if c not in chars:
+            raise BibTeXParseError(f"Expected one of {chars!r} at offset {self.pos}, found {c!r}")
+        self.pos += 1
+        return c
+
+    def name(self) -> str:
+        self.skip_whitespace()
+        m = _NAME.match(self.text, self.pos)
+        if not m:
+            raise BibTeXParseError(f"Expected a name at offset {self.pos}, found {self.text[self.pos]!r}")
+        if m.end() >= len(self.text):
+            raise _Incomplete()
+        self.pos = m.end()
+        return m.group()
+
+    def braced(self) -> str:
+        """Read a brace-delimited value, starting at the opening brace; returns the content."""
+        start = self.pos + 1
+        depth = 0
+        pos = self.pos
+        while True:
+            m = _BRACES.search(self.text, pos)
+            if not m:
+                raise _Incomplete()
+            depth += 1 if m.group() == "{" else -1
+            pos = m.end()
+            if depth == 0:
+                self.pos = pos
+                return self.text[start : pos - 1]
+
+    def quoted(self) -> str:
+        """Read a quote-delimited value, starting at the opening quote; quotes inside braces do not count."""
+        start = self.pos + 1
+        depth = 0
+        pos = start
+        while True:
+            m = _BRACE_OR_QUOTE.search(self.text, pos)
+            if not m:
+                raise _Incomplete()
+            c = m.group()
+            pos = m.end()
+            if c == "{":
+                depth += 1
+            elif c == "}":
+                depth -= 1
+            elif depth == 0:
+                self.pos = pos
+                return self.text[start : pos - 1]
+
+    def value(self, macros: Dict[str, str]) -> str:
+        """Read a value, which may be a concatenation of parts with #."""
+        parts = []
+        while True:
+            c = self.peek()
+            if c == "{":
+                parts.append(self.braced())
+            elif c == '"':
+                parts.append(self.quoted())
+            else:
+                token = self.name()
+                if token.isdigit():
+                    parts.append(token)
+                else:
+                    parts.append(macros.get(token.lower(), MONTH_MACROS.get(token.lower(), token)))
+            if self.peek() == "#":
+                self.pos += 1
+            else:
+                return "".join(parts)
+
+
+def _parse_entry(scanner: _Scanner, macros: Dict[str, str]) -> Optional[Tuple[str, Optional[str], Dict[str, str]]]:
+    """Parse an entry starting at @; returns None for @string, @comment and @preamble."""
+    scanner.pos += 1
+    if scanner.pos >= len(scanner.text):
+        raise _Incomplete()
+    m = _NAME.match(scanner.text, scanner.pos)
+    if not m:
+        raise _NotAnEntry()
+    scanner.pos = m.end()
+    entry_type = m.group().lower()
+    if scanner.peek() not in "{(":
+        # e.g. an email address in text between entries, which BibTeX ignores
+        raise _NotAnEntry()
+    if entry_type == "comment":
+        c = scanner.peek()
+        if c == "{":
+            scanner.braced()
+        return None
+    opener = scanner.expect("{(")
+    closer = "}" if opener == "{" else ")"
+    if entry_type == "preamble":
+        scanner.value(macros)
+        scanner.expect(closer)
+        return None
+    if entry_type == "string":
+        name = scanner.name()
+        scanner.expect("=")
+        macros[name.lower()] = scanner.value(macros)
+        scanner.expect(closer)
+        return None
+    key = None
+    if scanner.peek() not in ",}":
+        key = scanner.name()
+    fields = {}
+    while True:
+        c = scanner.expect("," + closer)
+        if c == closer:
+            break
+        if scanner.peek() == closer:
+            scanner.pos += 1
+            break
+        field = scanner.name().lower()
+        scanner.expect("=")
+        fields[field] = scanner.value(macros)
+    return entry_type, key, fields
+
+
+def parse_bibtex_iter(stream: TextIO, chunk_size: int = 1 << 20) -> Iterator[Tuple[str, Optional[str], Dict[str, str]]]:
+    """
+    Parse BibTeX into (type, key, fields) tuples.
+
+    Field values are returned as they appear in the file, with macros expanded and
+    concatenations joined, but with inner braces intact.
+
+    >>> import io
+    >>> text = '@string{nar = "Nucleic Acids Res."} @Article{k1, title={The {HPO}}, journal=nar # " X", year=2019}'
+    >>> list(parse_bibtex_iter(io.StringIO(text)))
+    [('article', 'k1', {'title': 'The {HPO}', 'journal': 'Nucleic Acids Res. X', 'year': '2019'})]
+
+    :param stream:
+    :param chunk_size: number of characters to read at a time
+    :return:
+    """
+    macros = {}
+    buffer = ""
+    # read offset into the buffer; the consumed prefix is dropped when the next chunk is read
+    start = 0
+    eof = False
+    while True:
+        at = buffer.find("@", start)
+        if at < 0:
+            if eof:
+                return
+            start = len(buffer)
+        else:
+            scanner = _Scanner(buffer, at)
+            try:
+                result = _parse_entry(scanner, macros)
+            except _NotAnEntry:
+                start = at + 1
+                continue
+            except _Incomplete:
+                if eof:
+                    raise BibTeXParseError(f"Unexpected end of input in entry: {buffer[at:at + 80]!r}") from None
+            else:
+                start = scanner.pos
+                if result is not None:
+                    yield result
+                continue
+            start = at
+        chunk = stream.read(chunk_size)
+        buffer = buffer[start:]
+        start = 0
+        if chunk:
+            buffer += chunk
+        else:
+            eof = True
+            # a trailing sentinel lets the scanner see the end of a final name token
+            buffer += "\n"
+
+
+def clean_value(value: str) -> str:
+    """
+    Remove protective braces and escapes, and normalize whitespace.
+
+    >>> clean_value("The {HPO}:\\n  a \\\\& b")
+    'The HPO: a & b'
+
+    :param value:
+    :return:
+    """
+    value = _BRACES.sub("", value)
+    value = _ESCAPED.sub(r"\1", value)
+    return _WHITESPACE.sub(" ", value).strip()
+
+
+def split_authors(value: str) -> List[str]:
+    """
+    Split a BibTeX name list on "and", ignoring any "and" inside braces.
+
+    >>> split_authors("Mungall, C J and {Smith and Sons} and Doe, Jane")
+    ['Mungall, C J', '{Smith and Sons}', 'Doe, Jane']
+
+    :param value:
+    :return:
+    """
+    names = []
+    depth = 0
+    start = 0
+    pos = 0
+    while True:
+        m = _AND.search(value, pos)
+        if not m:
+            break
+        depth += value.count("{", pos, m.start()) - value.count("}", pos, m.start())
+        if depth == 0:
+            names.append(value[start : m.start()])
+            start = m.end()
+        pos = m.end()
+    names.append(value[start:])
+    return [n.strip() for n in names if n.strip()]
+
+
+def _initials(given: str) -> str:
+    initials = []
+    for token in re.split(r"[\s.]+", given):
+        if not token:
+            continue
+        if token.isupper() and len(token) <= 4 and token.isalpha():
+            # already initials, e.g. "CJ"
+            initials.append(token)
+        else:
+            initials.extend(part[0].upper() for part in token.split("-") if part)
+    return "".join(initials)
+
+
+def normalize_author(name: str) -> str:
+    """
+    Convert a BibTeX name to the "Surname Initials" form used by Paperpile.
+
+    >>> normalize_author("Mungall, Christopher J.")
+    'Mungall CJ'
+    >>> normalize_author("Christopher J Mungall")
+    'Mungall CJ'
+    >>> normalize_author("Mungall, CJ")
+    'Mungall CJ'
+    >>> normalize_author("{N3C Consortium}")
+    'N3C Consortium'
+
+    :param name:
+    :return:
+    """
+    name = name.strip()
+    if name.startswith("{") and name.endswith("}"):
+        return clean_value(name[1:-1])
+    name = clean_value(name)
+    if "," in name:
+        parts = [p.strip() for p in name.split(",")]
+        surname, given = parts[0], parts[-1]
+    else:
+        tokens = name.split(" ")
+        surname, given = tokens[-1], " ".join(tokens[:-1])
+    initials = _initials(given)
+    return f"{surname} {initials}" if initials else surname
+
+
+def bibtex_to_entry(entry_type: str, fields: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Map parsed BibTeX fields to a BIBM entry dict.
+
+    >>> bibtex_to_entry("article", {"title": "{T}", "author": "Doe, J and Roe, R", "eprint": "2103.00001",
+    ...                             "archiveprefix": "arXiv", "pages": "1--2"})
+    {'type': 'JournalArticle', 'title': 'T', 'pages': '1-2', 'authors': ['Doe J', 'Roe R'], 'arxiv_id': '2103.00001'}
+
+    :param entry_type: lowercase BibTeX entry type
+    :param fields:
+    :return:
+    """
+    entry = {"type": BIBTEX_TYPE_MAP.get(entry_type, "Other")}
+    for field, slot in FIELD_MAP.items():
+        if field in fields:
+            entry[slot] = clean_value(fields[field])
+    if "pages" in entry:
+        entry["pages"] = entry["pages"].replace("--", "-")
+    if "author" in fields:
+        entry["authors"] = [normalize_author(a) for a in split_authors(fields["author"])]
+    if "url" in fields:
+        entry["urls"] = clean_value(fields["url"]).split(" ")
+    eprint = fields.get("eprint", None)
+    if eprint and clean_value(fields.get("archiveprefix", "arxiv")).lower() == "arxiv":
+        entry["arxiv_id"] = clean_value(eprint)
+    return {k: v for k, v in entry.items() if v}
+
+
+def load_bibtex_iter(stream: TextIO, trusted: bool = False) -> Iterator[bibm.Entry]:
+    """
+    Load entries from BibTeX.
+
+    >>> import io
+    >>> list(load_bibtex_iter(io.StringIO("@misc{k1, year={2020}}")))  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    ValueError: Invalid BibTeX entry 'k1': ...
+
+    :param stream:
+    :param trusted: if True, construct entries without validation
+    :return:
+    :raises ValueError: if an entry is not valid, naming its citation key
+    """
+    for entry_type, key, fields in parse_bibtex_iter(stream):
+        obj = bibtex_to_entry(entry_type, fields)
+        if trusted:
+            yield construct_entry(obj)
+            continue
+        try:
+            yield bibm.Entry(**obj)
+        except ValueError as e:
+            raise ValueError(f"Invalid BibTeX entry {key!r}: {e}") from e
+
+
+def escape_value(value: str) -> str:
+    """
+    Escape characters that are special to BibTeX.
+
+    >>> escape_value("A & B {x}")
+    'A \\\\& B x'
+
+    :param value:
+    :return:
+    """
+    return _SPECIAL.sub(r"\\\1", _BRACES.sub("", str(value)))
+
+
+def format_author(name: str) -> str:
+    """
+    Convert a "Surname Initials" name to a BibTeX name.
+
+    >>> format_author("Mungall CJ")
+    'Mungall, CJ'
+    >>> format_author("N3C Consortium")
+    '{N3C Consortium}'
+
+    :param name:
+    :return:
+    """
+    m = _INITIALS.match(name)
+    if m:
+        return f"{escape_value(m.group(1))}, {m.group(2)}"
+    return "{" + escape_value(name) + "}"
+
+
+def entry_to_bibtex(entry: Dict[str, Any]) -> Tuple[str, Dict[str, str]]:
+    """
+    Map a BIBM entry dict to a BibTeX type and fields.
+
+    :param entry:
+    :return:
+    """
+    entry_type = ENTRY_TYPE_MAP.get(entry.get("type", None), "misc")
+    fields = {}
+    if entry.get("authors", None):
+        fields["author"] = " and ".join(format_author(a) for a in entry["authors"])
+    for field, slot in FIELD_MAP.items():
+        v = entry.get(slot, None)
+        if v:
+            fields[field] = escape_value(v)
+    if "pages" in fields:
+        fields["pages"] = fields["pages"].replace("-", "--")
+    if entry.get("arxiv_id", None):
+        fields["eprint"] = escape_value(entry["arxiv_id"])
+        fields["archiveprefix"] = "arXiv"
+    if entry.get("urls", None):
+        fields["url"] = " ".join(entry["urls"])
+    return entry_type, fields
+
+
+def _citation_key(entry: Dict[str, Any], seen: Dict[str, int]) -> str:
+    authors = entry.get("authors", None) or ["anon"]
+    surname = re.sub(r"[^A-Za-z0-9]", "", authors[0].split(" ")[0]) or "anon"
+    key = f"{surname}{entry.get('year', None) or ''}"
+    n = seen.get(key, 0)
+    seen[key] = n + 1
+    return key if n == 0 else f"{key}{chr(ord('a') + n - 1) if n <= 26 else n}"
+
+
+def write_bibtex_iter(entries: Iterable[Union[bibm.Entry, Dict[str, Any]]], stream: TextIO) -> int:
+    """
+    Write entries as BibTeX, one at a time.
+
+    Citation keys are generated from the first author's surname and the year.
+
+    >>> import io
+    >>> stream = io.StringIO()
+    >>> _ = write_bibtex_iter([bibm.Entry(type="JournalArticle", title="T", authors=["Doe J"], year="2020")], stream)
+    >>> print(stream.getvalue(), end="")
+    @article{Doe2020,
+      author = {Doe, J},
+      title = {T},
+      year = {2020},
+    }
+
+    :param entries: Entry objects or dicts
+    :param stream:
+    :return: number of entries written
+    """
+    seen = {}
+    n = 0
+    for entry in entries:
+        if isinstance(entry, bibm.Entry):
+            entry = entry.model_dump(exclude_none=True)
+        entry_type, fields = entry_to_bibtex(entry)
+        stream.write(f"@{entry_type}{{{_citation_key(entry, seen)},\n")
+        for field, value in fields.items():
+            stream.write(f"  {field} = {{{value}}},\n")
+        stream.write("}\n")
+        n += 1
+    return n
@@ -1,11 +1,18 @@
 """Command line interface for bibliomancer."""
 
+import glob
 import logging
+import os
 import sys
+from contextlib import ExitStack, nullcontext
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Iterator, List, TextIO, Tuple, Union
 
 import click
+from linkml.validator.report import Severity
 
-from bibliomancer import __version__, mergeutil, eutils
+from bibliomancer import __version__, mergeutil, eutils, pmcindex
 
 __all__ = [
     "main",
@@ -13,17 +20,42 @@ __all__ = [
 
 from bibliomancer.formatter import generate_markdown
 
-from bibliomancer.enricher import repair_file, repair_all_iter, annotate_author_position
-from bibliomancer.io import load_file_iter, write_file, load_file
+from bibliomancer.enricher import repair_file, repair_all_iter, annotate_author_position, enrich_parallel_iter
+from bibliomancer.datamodel.biblio import Entry
+from bibliomancer.author_index import AuthorIndex
+from bibliomancer.entry_index import DiskEntryIndex, EntryIndex
+from bibliomancer.io import (
+    compression_suffix,
+    infer_format,
+    load_csv_parallel_iter,
+    load_file_iter,
+    load_files_iter,
+    write_file,
+    load_file,
+    open_file,
+)
 from bibliomancer.datamodel.enums import BiblioSchemaEnum, BiblioSyntaxEnum
-from bibliomancer.mapper import map_entries
+from bibliomancer.mapper import MAPPING_ENGINES, map_entries
+from bibliomancer.utilities import chunked, validate_entry_objects
 from bibliomancer.validator import validate_entries_iter
 
 logger = logging.getLogger(__name__)
 
 
-input_option = click.option("--input", "-i", type=click.File("r"), default=sys.stdin, help="Input file")
-output_option = click.option("--output", "-o", type=click.File("w"), default=sys.stdout, help="Output file")
+input_option = click.option(
+    "--input",
+    "-i",
+    multiple=True,
+    type=click.Path(allow_dash=True),
+    help="Input file, glob or directory; may be repeated to combine several inputs (default: stdin)",
+)
+output_option = click.option(
+    "--output",
+    "-o",
+    type=click.Path(dir_okay=False, allow_dash=True),
+    default="-",
+    help="Output file; compressed if the name ends in .gz, .bz2, .xz or .zst (default: stdout)",
+)
 input_format_option = click.option(
     "--input-format",
     "-f",
@@ -46,6 +78,69 @@ target_schema_option = click.option(
 )
 template_option = click.option("--template", "-T", help="Template")
 repair_option = click.option("--repair/--no-repair", default=False, show_default=True, help="Repair entries")
+mapping_engine_option = click.option(
+    "--mapping-engine",
+    type=click.Choice(MAPPING_ENGINES),
+    help="How to map source schema rows: hand-coded python mappings, or the linkml-transformer spec",
+)
+jobs_option = click.option(
+    "--jobs", "-j", type=int, help="Number of worker processes for loading multiple inputs, repair and annotation"
+)
+
+
+def resolve_inputs(input: Tuple[str, ...]) -> Union[TextIO, str, List[str]]:
+    """
+    Resolve the values of the --input option.
+
+    :param input: paths, globs or directories; empty or - for stdin
+    :return: stdin, a single file path, or a list of inputs to expand
+    :raises click.BadParameter: if a path that is not a glob does not exist
+    """
+    if not input or input == ("-",):
+        return sys.stdin
+    for path in input:
+        # checked here, rather than by click, as globs are expanded later
+        if not glob.has_magic(str(path)) and not Path(path).exists():
+            raise click.BadParameter(f"Path '{path}' does not exist.", param_hint="'--input' / '-i'")
+    if len(input) == 1 and Path(input[0]).is_file():
+        return input[0]
+    return list(input)
+
+
+def resolve_output(output: str) -> Union[TextIO, str]:
+    """
+    Resolve the value of the --output option.
+
+    :param output: path, or - for stdout
+    :return: stdout, or the path
+    """
+    return sys.stdout if output == "-" else output
+
+
+def load_inputs(input: Tuple[str, ...], jobs: int = None, **kwargs) -> Iterator[Entry]:
+    """
+    Load entries from the values of the --input option.
+
+    Entries from multiple inputs are tagged with their source file. A single uncompressed
+    CSV file is split into byte ranges that are parsed in parallel if jobs is set.
+
+    :param input:
+    :param jobs: number of worker processes for loading
+    :param kwargs: passed to the loader
+    :return:
+    """
+    resolved = resolve_inputs(input)
+    if isinstance(resolved, list):
+        return load_files_iter(resolved, jobs=jobs, **kwargs)
+    if (
+        jobs
+        and isinstance(resolved, str)
+        and not compression_suffix(resolved)
+        and (kwargs.get("format", None) or infer_format(resolved)) == "csv"
+    ):
+        kwargs.pop("format", None)
+        return load_csv_parallel_iter(resolved, jobs=jobs, **kwargs)
+    return load_file_iter(resolved, **kwargs)
 
 
 @click.group()
@@ -74,12 +169,13 @@ def main(verbose: int, quiet: bool):
 @output_option
 @input_format_option
 @output_format_option
+@jobs_option
 def repair(input, output, **kwargs):
     """Repair a biblio file.
 
     Limitations: only supports Paperpile TSVs.
     """
-    repair_file(input, output, **kwargs)
+    repair_file(resolve_inputs(input), resolve_output(output), **kwargs)
 
 
 @main.command()
@@ -91,6 +187,8 @@ def repair(input, output, **kwargs):
 @target_schema_option
 @template_option
 @repair_option
+@jobs_option
+@mapping_engine_option
 @click.option("--author", "-a", multiple=True, help="Highlight authors")
 @click.option(
     "--annotate-position/--no-annotate-position",
@@ -98,6 +196,19 @@ def repair(input, output, **kwargs):
     show_default=True,
     help="Annotate position in the list of references",
 )
+@click.option(
+    "--author-index/--no-author-index",
+    default=False,
+    show_default=True,
+    help="Export only the entries of the authors, found with an index saved alongside the input file"
+    " (built on first use, and rebuilt when the file changes)",
+)
+@click.option(
+    "--source-file/--no-source-file",
+    default=False,
+    show_default=True,
+    help="Add a source_file column naming the input file each entry was loaded from",
+)
 def export(
     input,
     output,
@@ -106,25 +217,52 @@ def export(
     source_schema,
     target_schema,
     repair,
+    jobs,
+    mapping_engine,
     template: str,
     author,
     annotate_position,
+    author_index,
+    source_file,
 ):
     """Export a biblio file.
 
     Exports to markdown or csv
     """
-    entries = load_file_iter(input, format=input_format, schema=source_schema)
-    if repair:
-        entries = repair_all_iter(entries)
-    if annotate_position:
-        if not author:
-            raise ValueError("Must provide at least one author to annotate position")
-        entries = annotate_author_position(entries, author[0])
+    if annotate_position and not author:
+        raise ValueError("Must provide at least one author to annotate position")
+    if author_index:
+        resolved = resolve_inputs(input)
+        if not isinstance(resolved, str) or not author:
+            raise ValueError("An author index needs a single input file and at least one author")
+        index = AuthorIndex.from_file(resolved, format=input_format, schema=source_schema, engine=mapping_engine)
+        if annotate_position:
+            entries = annotate_author_position(index, author[0])
+        else:
+            entries = index.entries_for(list(author), partial=True)
+        if repair:
+            entries = repair_all_iter(entries)
+    else:
+        entries = load_inputs(input, jobs=jobs, format=input_format, schema=source_schema, engine=mapping_engine)
+        if jobs and (repair or annotate_position):
+            author_query = author[0] if annotate_position else None
+            entries = enrich_parallel_iter(entries, jobs, repair=repair, author_query=author_query)
+        else:
+            if repair:
+                entries = repair_all_iter(entries)
+            if annotate_position:
+                entries = annotate_author_position(entries, author[0])
+    output = resolve_output(output)
     if output_format == "markdown":
-        generate_markdown(entries, stream=output, source_schema=source_schema, template_name=template, authors=author)
+        with open_file(output, "w") if isinstance(output, str) else nullcontext(output) as stream:
+            generate_markdown(
+                entries, stream=stream, source_schema=source_schema, template_name=template, authors=author
+            )
     else:
-        write_file(entries, output, format=output_format, schema=target_schema)
+        include_slots = ["source_file"] if source_file else None
+        write_file(
+            entries, output, format=output_format, schema=target_schema, streaming=True, include_slots=include_slots
+        )
 
 
 @main.command()
@@ -133,16 +271,33 @@ def export(
 @input_format_option
 @source_schema_option
 @target_schema_option
-def validate(input, output, input_format, source_schema, target_schema):
+@click.option(
+    "--near-duplicate-threshold",
+    type=click.FloatRange(0, 1),
+    help="Also warn about pairs of entries whose titles are at least this similar (e.g. 0.8);"
+    " warnings do not fail validation unless --fail-on-warnings is set",
+)
+@click.option(
+    "--fail-on-warnings/--no-fail-on-warnings",
+    default=False,
+    show_default=True,
+    help="Exit with an error if there are warnings, such as near-duplicate titles",
+)
+def validate(input, output, input_format, source_schema, target_schema, near_duplicate_threshold, fail_on_warnings):
     """Validate a biblio file.
 
     Limitations: only checks for duplicate entries.
+    Near-duplicate titles are reported as warnings, which do not fail validation
+    unless --fail-on-warnings is set.
     """
-    entries = load_file_iter(input, format=input_format, schema=source_schema)
+    entries = load_inputs(input, format=input_format, schema=source_schema)
     n = 0
-    for error in validate_entries_iter(entries, report_fields=["title"]):
+    for error in validate_entries_iter(
+        entries, report_fields=["title"], near_duplicate_threshold=near_duplicate_threshold
+    ):
         print(error, file=sys.stderr)
-        n += 1
+        if fail_on_warnings or error.severity != Severity.WARN:
+            n += 1
     if n:
         sys.exit(1)
 
@@ -154,31 +309,142 @@ def validate(input, output, input_format, source_schema, target_schema):
 @input_format_option
 @source_schema_option
 @target_schema_option
-@click.option("--merge-from", "-m", help="File to merge from")
+@click.option(
+    "--merge-from",
+    "-m",
+    multiple=True,
+    help="File to merge from; may be repeated, in order of priority, highest first",
+)
+@click.option(
+    "--merge-from-index",
+    type=click.Path(dir_okay=False),
+    multiple=True,
+    help="Index file for each merge-from file, built on first use and reused while that file is unchanged",
+)
 @click.option("--columns", "-c", help="comma-separated list of columns to merge")
 @click.option("--overwrite/--no-overwrite", default=True, show_default=True, help="Overwrite existing values")
-def merge(input, output, input_format, output_format, source_schema, merge_from, target_schema, columns, **kwargs):
-    """Merges columns from source into the input bibliography.
+@click.option(
+    "--trusted/--no-trusted",
+    default=False,
+    show_default=True,
+    help="Skip validation while loading and merging, and validate all entries once before writing",
+)
+@click.option(
+    "--stream/--no-stream",
+    default=False,
+    show_default=True,
+    help="Index the sources on disk, and merge and write input entries one at a time, without loading any file",
+)
+@click.option(
+    "--provenance/--no-provenance",
+    default=False,
+    show_default=True,
+    help="Record the merge-from file each merged column was taken from, in the provenance column",
+)
+def merge(
+    input,
+    output,
+    input_format,
+    output_format,
+    source_schema,
+    merge_from,
+    merge_from_index,
+    target_schema,
+    columns,
+    trusted,
+    stream,
+    provenance,
+    **kwargs,
+):
+    """Merges columns from sources into the input bibliography.
 
-    The source bibliography must be in BIBM format.
+    The source bibliographies must be in BIBM format. Several sources are merged in
+    a single pass over the input; a column taken from one source is not overwritten
+    by a source of lower priority.
     """
-    target_entries = load_file(input, format=input_format, schema=source_schema)
+    if not merge_from:
+        raise click.UsageError("Missing option '--merge-from' / '-m'")
+    if merge_from_index and len(merge_from_index) != len(merge_from):
+        raise click.UsageError("Give one --merge-from-index for each --merge-from")
+    cols = columns.split(",") if columns else None
+    if stream or provenance or len(merge_from) > 1:
+        with ExitStack() as stack:
+            source_indexes = []
+            for i, source in enumerate(merge_from):
+                index_path = merge_from_index[i] if merge_from_index else None
+                if stream:
+                    if not index_path:
+                        tmpdir = stack.enter_context(TemporaryDirectory())
+                        index_path = os.path.join(tmpdir, "merge_from.index.sqlite")
+                    ix = stack.enter_context(
+                        DiskEntryIndex.from_file(source, index_path, schema=BiblioSchemaEnum.BIBM, trusted=trusted)
+                    )
+                elif index_path:
+                    ix = EntryIndex.from_file(source, index_path, schema=BiblioSchemaEnum.BIBM, trusted=trusted)
+                else:
+                    ix = EntryIndex(load_file_iter(source, schema=BiblioSchemaEnum.BIBM, trusted=trusted))
+                source_indexes.append(ix)
+            target_entries = load_inputs(input, format=input_format, schema=source_schema, trusted=trusted)
+            target_entries = mergeutil.merge_entries_iter(
+                target_entries,
+                source_indexes,
+                cols=cols,
+                trusted=trusted,
+                source_names=merge_from if provenance else None,
+                **kwargs,
+            )
+            if trusted:
+                target_entries = (e for batch in chunked(target_entries, 1000) for e in validate_entry_objects(batch))
+            write_file(
+                target_entries,
+                resolve_output(output),
+                format=output_format,
+                schema=target_schema,
+                streaming=True,
+                include_slots=[mergeutil.PROVENANCE_SLOT] if provenance else None,
+            )
+        return
+    target_entries = list(load_inputs(input, format=input_format, schema=source_schema, trusted=trusted))
     # print(f"Loaded {len(target_entries)} entries from {input}")
-    source_entries = load_file(merge_from, schema=BiblioSchemaEnum.BIBM)
+    if merge_from_index:
+        source_entries = EntryIndex.from_file(
+            merge_from[0], merge_from_index[0], schema=BiblioSchemaEnum.BIBM, trusted=trusted
+        )
+    else:
+        source_entries = load_file(merge_from[0], schema=BiblioSchemaEnum.BIBM, trusted=trusted)
     # print(f"Loaded {len(source_entries)} entries from {merge_from}")
-    cols = columns.split(",") if columns else None
     # print(f"Merging [kw={kwargs}]")
-    mergeutil.merge_entries_from(target_entries, source_entries, cols=cols, **kwargs)
+    mergeutil.merge_entries_from(target_entries, source_entries, cols=cols, trusted=trusted, **kwargs)
+    if trusted:
+        target_entries = validate_entry_objects(target_entries)
     # print(f"Writing {len(target_entries)} entries to {output}")
-    write_file(target_entries, output, format=output_format, schema=target_schema)
+    write_file(target_entries, resolve_output(output), format=output_format, schema=target_schema)
+
+
+@main.group()
+def index():
+    """Build indexes for offline lookup."""
+
+
+@index.command("build")
+@click.argument("input_file", type=click.Path(exists=True, dir_okay=False))
+@click.option("--output", "-o", required=True, type=click.Path(file_okay=False), help="Directory for the index")
+def index_build(input_file, output):
+    """Build an offline PMCID/PMID/DOI index from the NCBI PMC-ids CSV.
+
+    The input is PMC-ids.csv(.gz) from https://ftp.ncbi.nlm.nih.gov/pub/pmc/.
+    To use the index, set the BIBLIOMANCER_PMC_INDEX environment variable to the output directory.
+    """
+    pmcindex.build_index(input_file, output)
 
 
 @main.command()
 @click.argument("pmids", nargs=-1)
 def pmid2pmcid(pmids):
     """Converts PMID to PMCID."""
+    pmcids = eutils.pmids_to_pmcs(pmids)
     for pmid in pmids:
-        print(pmid, eutils.pmid_to_pmc(pmid))
+        print(pmid, pmcids.get(pmid, None))
 
 
 if __name__ == "__main__":
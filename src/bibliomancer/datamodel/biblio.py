@@ -218,6 +218,13 @@ class Entry(ConfiguredBaseModel):
         None,
         description="""Description: \"Unique identifier assigned to an item within the context of the container.\"""",
     )
+    source_file: Optional[str] = Field(
+        None,
+        description="""The file the entry was loaded from, when entries are combined from several files.""",
+    )
+    provenance: Optional[List[str]] = Field(
+        default_factory=list, description="""The source each merged slot was taken from, as slot=source."""
+    )
 
     @field_validator("ceur_ws_url")
     def pattern_ceur_ws_url(cls, v):
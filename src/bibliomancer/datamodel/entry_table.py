@@ -0,0 +1,264 @@
+"""
+Columnar storage for large collections of entries.
+
+Each :class:`Entry` carries its own dict, two lists and around 25 slots, most of
+which are empty. An :class:`EntryTable` instead stores each slot as a column of
+integer codes:
+
+- slots with many repeated values, such as journal, year and authors, are
+  interned in a string pool shared by the whole table, so each distinct value
+  is stored once;
+- other string slots, such as title and DOI, are stored UTF-8 encoded in one
+  buffer per slot, addressed by offsets, avoiding a Python object per value;
+- list slots add an offsets array giving each row's range of codes;
+- numeric slots are typed arrays, with a sentinel for missing values.
+
+Rows are turned into :class:`Entry` objects only when accessed. These are
+copies: changing them does not change the table.
+"""
+
+import math
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union, get_args, get_origin
+
+from bibliomancer.datamodel.biblio import Entry
+
+MISSING_INT = -(2**63)
+
+# slots whose values are usually shared between many entries
+INTERNED_SLOTS = {
+    "type",
+    "authors",
+    "journal",
+    "repository",
+    "conference_proceedings",
+    "year",
+    "volume",
+    "issue",
+    "role",
+}
+
+
+def _to_number(number_type: type, name: str, value: Any) -> Any:
+    """Convert a value of a numeric slot, which may be a string in an unvalidated entry."""
+    try:
+        return number_type(value)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid value for {name}: {value!r}") from e
+
+
+def _field_kind(annotation: Any) -> str:
+    """Classify a field annotation as one of list, int, float or str."""
+    args = [a for a in get_args(annotation) if a is not type(None)] or [annotation]
+    inner = args[0]
+    if get_origin(inner) in (list, List):
+        return "list"
+    if inner is int:
+        return "int"
+    if inner is float:
+        return "float"
+    return "str"
+
+
+class _InternPool:
+    """Distinct strings, each stored once. Code 0 is None."""
+
+    def __init__(self):
+        self.strings: List[Optional[str]] = [None]
+        self.codes: Dict[str, int] = {}
+
+    def add(self, value: Optional[str]) -> int:
+        if value is None:
+            return 0
+        code = self.codes.get(value, None)
+        if code is None:
+            code = len(self.strings)
+            self.strings.append(value)
+            self.codes[value] = code
+        return code
+
+    def get(self, code: int) -> Optional[str]:
+        return self.strings[code]
+
+
+class _TextPool:
+    """Strings encoded into a single buffer, without deduplication. Code 0 is None."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.ends = array("Q", [0, 0])
+
+    def add(self, value: Optional[str]) -> int:
+        if value is None:
+            return 0
+        self.buffer += value.encode("utf-8")
+        self.ends.append(len(self.buffer))
+        return len(self.ends) - 2
+
+    def get(self, code: int) -> Optional[str]:
+        if not code:
+            return None
+        return self.buffer[self.ends[code] : self.ends[code + 1]].decode("utf-8")
+
+
+class EntryTable:
+    """
+    A column-oriented collection of entries.
+
+    >>> table = EntryTable.from_entries([
+    ...     Entry(title="t1", journal="j1", authors=["Doe J", "Roe R"], num_authors=2),
+    ...     {"title": "t2", "journal": "j1"},
+    ... ])
+    >>> len(table)
+    2
+    >>> table[1].journal, table[0].authors, table[0].num_authors
+    ('j1', ['Doe J', 'Roe R'], 2)
+    >>> table.column("journal")
+    ['j1', 'j1']
+    >>> [e.title for e in table]
+    ['t1', 't2']
+    >>> next(table.iter_dicts(exclude_none=True))
+    {'title': 't1', 'authors': ['Doe J', 'Roe R'], 'journal': 'j1', 'urls': [], 'num_authors': 2, 'provenance': []}
+    """
+
+    def __init__(self):
+        self._kinds: Dict[str, str] = {name: _field_kind(f.annotation) for name, f in Entry.model_fields.items()}
+        self._columns: Dict[str, array] = {}
+        self._offsets: Dict[str, array] = {}
+        self._pools: Dict[str, Union[_InternPool, _TextPool]] = {}
+        shared_pool = _InternPool()
+        for name, kind in self._kinds.items():
+            if kind == "int":
+                self._columns[name] = array("q")
+            elif kind == "float":
+                self._columns[name] = array("d")
+            else:
+                self._columns[name] = array("I")
+                self._pools[name] = shared_pool if name in INTERNED_SLOTS else _TextPool()
+                if kind == "list":
+                    self._offsets[name] = array("Q", [0])
+        self._length = 0
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[Union[Entry, Dict[str, Any]]]) -> "EntryTable":
+        """
+        Create a table from entries.
+
+        Entries are consumed one at a time, so a table can be loaded from a
+        stream without holding all of its entries in memory.
+
+        :param entries: Entry objects or dicts; dicts are validated
+        :return:
+        """
+        table = cls()
+        table.extend(entries)
+        return table
+
+    def append(self, entry: Union[Entry, Dict[str, Any]]) -> None:
+        """
+        Add an entry to the end of the table.
+
+        Numeric values are converted, as entries constructed without validation (see
+        :func:`bibliomancer.utilities.construct_entry`) may hold them as strings.
+
+        :param entry: an Entry, or a dict which is validated as an Entry
+        :return:
+        :raises ValueError: if a value of a numeric slot is not a number
+        """
+        if isinstance(entry, dict):
+            entry = Entry(**entry)
+        values = entry.__dict__
+        for name, kind in self._kinds.items():
+            v = values.get(name, None)
+            column = self._columns[name]
+            if kind == "int":
+                column.append(MISSING_INT if v is None else _to_number(int, name, v))
+            elif kind == "float":
+                column.append(math.nan if v is None else _to_number(float, name, v))
+            elif kind == "list":
+                add = self._pools[name].add
+                column.extend(add(str(x)) for x in v or [])
+                self._offsets[name].append(len(column))
+            else:
+                column.append(self._pools[name].add(None if v is None else str(v)))
+        self._length += 1
+
+    def extend(self, entries: Iterable[Union[Entry, Dict[str, Any]]]) -> None:
+        """
+        Add entries to the end of the table.
+
+        :param entries:
+        :return:
+        """
+        for entry in entries:
+            self.append(entry)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _value(self, name: str, i: int) -> Any:
+        column = self._columns[name]
+        kind = self._kinds[name]
+        if kind == "int":
+            v = column[i]
+            return None if v == MISSING_INT else v
+        if kind == "float":
+            v = column[i]
+            return None if math.isnan(v) else v
+        get = self._pools[name].get
+        if kind == "list":
+            offsets = self._offsets[name]
+            return [get(c) for c in column[offsets[i] : offsets[i + 1]]]
+        return get(column[i])
+
+    def _index(self, i: int) -> int:
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError(f"Entry index out of range: {i}")
+        return i
+
+    def row(self, i: int, exclude_none=False) -> Dict[str, Any]:
+        """
+        Get a row as a dict.
+
+        :param i: row index; negative values count from the end
+        :param exclude_none: if True, omit empty scalar slots
+        :return:
+        """
+        i = self._index(i)
+        row = {name: self._value(name, i) for name in self._columns}
+        if exclude_none:
+            row = {k: v for k, v in row.items() if v is not None}
+        return row
+
+    def __getitem__(self, i: int) -> Entry:
+        # values were validated when they were added
+        from bibliomancer.utilities import construct_entry
+
+        return construct_entry(self.row(i, exclude_none=True))
+
+    def __iter__(self) -> Iterator[Entry]:
+        for i in range(self._length):
+            yield self[i]
+
+    def iter_dicts(self, exclude_none=False) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over rows as dicts, without creating Entry objects.
+
+        :param exclude_none: if True, omit empty scalar slots
+        :return:
+        """
+        for i in range(self._length):
+            yield self.row(i, exclude_none=exclude_none)
+
+    def column(self, name: str) -> List[Any]:
+        """
+        Get all values of a slot.
+
+        :param name: slot name
+        :return: list with one value per row
+        """
+        if name not in self._kinds:
+            raise KeyError(f"Unknown slot: {name}")
+        return [self._value(name, i) for i in range(self._length)]
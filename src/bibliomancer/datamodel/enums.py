@@ -18,3 +18,4 @@ class BiblioSyntaxEnum(str, Enum):
     MARKDOWN = "markdown"
     YAML = "yaml"
     JSON = "json"
+    JSONL = "jsonl"
@@ -5,17 +5,22 @@ In future some of this will be replaced by LinkML rules.
 """
 
 import re
-from typing import Any, Dict, Iterator, Iterable, Union
+from functools import lru_cache
+from typing import Any, Dict, Iterator, Iterable, List, NamedTuple, Optional, TextIO, Tuple, Union
 
 from bibliomancer import eutils
-from bibliomancer.io import load_file_iter, write_file
-from bibliomancer.utilities import author_matches, metamodel_schemaview
+from bibliomancer.author_index import AuthorIndex
+from bibliomancer.io import load_file_iter, load_files_iter, write_file
+from bibliomancer.utilities import AuthorMatcher, author_matcher, chunked, imap_ordered, metamodel_schemaview
 from bibliomancer.datamodel import biblio as bibm
 
 ARXIV_DOI_PREFIX = "10.48550"
 BIORXIV_DOI_PREFIX = "10.1101"
 CHEMRXIV_DOI_PREFIX = "10.26434"
 
+# number of entries whose lookups are resolved together by repair_all_iter
+DEFAULT_BATCH_SIZE = 200
+
 RULES = [
     {
         "name": "doi_from_arxiv",
@@ -32,6 +37,10 @@ RULES = [
         "assigns": {
             "pmcid": lambda pmid: eutils.pmid_to_pmc(pmid),
         },
+        "batch_assigns": {
+            # PMIDs in failed requests are left out, and looked up again one at a time
+            "pmcid": lambda pmids: eutils.pmids_to_pmcs(pmids, skip_failed=True),
+        },
         "sources": ["pmid"],
         "tests": [
             {"input": {"pmid": "37389415"}, "output": {"pmid": "37389415", "pmcid": "PMC10336030"}},
@@ -47,34 +56,214 @@ RULES = [
 ]
 
 
-def repair_file(input_file: str, output_file: str, input_format: str = None, output_format: str = None) -> None:
+class RepairPlan(NamedTuple):
+    """
+    Everything repair needs that does not depend on the entry.
+
+    Built once per process and per selection of rules by :func:`repair_plan`.
+    """
+
+    rules: List[Dict[str, Any]]
+    """Rules with assignments, in order."""
+
+    url_classifier: Optional[re.Pattern]
+    """A single regex combining the patterns of all uri slots, one named group per slot."""
+
+    infer_urls: bool
+    infer_journal: bool
+
+
+@lru_cache
+def repair_plan(rules: Optional[Tuple[str, ...]] = None) -> RepairPlan:
+    """
+    Build a repair plan.
+
+    >>> plan = repair_plan()
+    >>> [rule["name"] for rule in plan.rules]
+    ['doi_from_arxiv', 'PMC_from_PMID']
+    >>> plan.url_classifier.match("https://ceur-ws.org/Vol-2814/paper-01.pdf").lastgroup
+    'ceur_ws_url'
+
+    Note that the plan is cached, so changes to RULES made after the first call are not seen.
+
+    :param rules: names of rules to apply - applies all rules by default
+    :return:
+    """
+    resolved_rules = [r for r in RULES if "assigns" in r and (not rules or r["name"] in rules)]
+    sv = metamodel_schemaview()
+    alternatives = [
+        f"(?P<{slot.name}>{slot.pattern})" for slot in sv.all_slots().values() if slot.range == "uri" and slot.pattern
+    ]
+    url_classifier = re.compile("|".join(alternatives)) if alternatives else None
+    return RepairPlan(
+        rules=resolved_rules,
+        url_classifier=url_classifier,
+        infer_urls=not rules or "infer_urls" in rules,
+        infer_journal=not rules or "infer_journal" in rules,
+    )
+
+
+def repair_file(
+    input_file: Union[str, TextIO, List[str]],
+    output_file: str,
+    input_format: str = None,
+    output_format: str = None,
+    jobs: int = None,
+) -> None:
     """
     Repair a file.
 
-    :param input_file:
+    :param input_file: a file, or a list of files, globs or directories to combine
     :param output_file:
+    :param jobs: number of worker processes; if not set, load and repair in this process
     :return:
     """
-    entries = load_file_iter(input_file, input_format)
-    repaired_entries = [bibm.Entry(**e) for e in repair_all_iter(entries)]
-    write_file(repaired_entries, output_file, output_format)
+    if isinstance(input_file, list):
+        entries = load_files_iter(input_file, input_format, jobs=jobs)
+    else:
+        entries = load_file_iter(input_file, input_format)
+    if jobs:
+        repaired_entries = enrich_parallel_iter(entries, jobs)
+    else:
+        repaired_entries = repair_all_iter(entries)
+    repaired_entries = (bibm.Entry(**e) for e in repaired_entries)
+    write_file(repaired_entries, output_file, output_format, streaming=True)
+
+
+def _init_worker() -> None:
+    # load the schema once per worker, rather than once per chunk
+    repair_plan()
+
+
+def _enrich_chunk(args: Tuple[List[Union[bibm.Entry, Dict[str, Any]]], bool, Optional[str], Dict[str, Any]]):
+    chunk, repair, author_query, kwargs = args
+    entries = repair_all_iter(chunk, **kwargs) if repair else chunk
+    if author_query:
+        entries = annotate_author_position(entries, author_query)
+    return list(entries)
+
+
+def enrich_parallel_iter(
+    entries: Iterable[Union[bibm.Entry, Dict[str, Any]]],
+    jobs: int,
+    repair=True,
+    author_query: Optional[str] = None,
+    chunk_size: int = DEFAULT_BATCH_SIZE,
+    **kwargs,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Repair and/or annotate entries in a pool of worker processes.
+
+    The input is split into chunks of ``chunk_size`` entries, each of which is processed
+    by :func:`repair_all_iter` and :func:`annotate_author_position` in a worker.
+    Results are yielded in the original order.
+
+    Note that each worker makes its own lookups, so rules that call external
+    services will make up to ``jobs`` concurrent requests.
+
+    >>> list(enrich_parallel_iter([{"arxiv_id": "2103.00001"}], jobs=2))
+    [{'arxiv_id': '2103.00001', 'doi': '10.48550/2103.00001', 'journal': 'arXiv'}]
+
+    :param entries: can be dicts or Entry objects
+    :param jobs: number of worker processes
+    :param repair: if True, repair entries
+    :param author_query: if set, annotate the position of this author
+    :param chunk_size: number of entries sent to a worker at a time
+    :param kwargs: passed to repair_all_iter
+    :return: iterator of entries, as dicts
+    """
+    if not repair and not author_query:
+        raise ValueError("Nothing to do: set repair or author_query")
+    chunks = ((chunk, repair, author_query, kwargs) for chunk in chunked(entries, chunk_size))
+    for results in imap_ordered(_enrich_chunk, chunks, jobs=jobs, initializer=_init_worker):
+        yield from results
 
 
-def repair_all_iter(entries: Iterable[Union[bibm.Entry, Dict[str, Any]]]) -> Iterator[bibm.Entry]:
+def repair_all_iter(
+    entries: Iterable[Union[bibm.Entry, Dict[str, Any]]], batch_size: Optional[int] = DEFAULT_BATCH_SIZE, **kwargs
+) -> Iterator[bibm.Entry]:
     """
     Repair a list of entries.
 
     Accepts dicts or Entry objects - this is because we may want to repair partial
     entries.
 
+    Entries are processed in windows of ``batch_size``. For each window, the values
+    needed by rules with a ``batch_assigns`` function are collected first and looked
+    up together (see :func:`prefetch`), then each entry is repaired using the results.
+    Entries are yielded in their original order.
+
+    >>> list(repair_all_iter([{"arxiv_id": "2103.00001"}, {"title": "t"}]))
+    [{'arxiv_id': '2103.00001', 'doi': '10.48550/2103.00001', 'journal': 'arXiv'}, {'title': 't'}]
+
     :param entries: can be dicts or Entry objects
+    :param batch_size: number of entries per window; if None, each entry is repaired individually
+    :param kwargs: passed to repair
     :return: iterator of repaired entries, as dicts
     """
+    if not batch_size:
+        for entry in entries:
+            yield repair(entry, **kwargs)
+        return
+    batch = []
     for entry in entries:
-        yield repair(entry)
+        if isinstance(entry, bibm.Entry):
+            entry = entry.model_dump(exclude_unset=True)
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            yield from _repair_batch(batch, **kwargs)
+            batch = []
+    if batch:
+        yield from _repair_batch(batch, **kwargs)
+
+
+def _repair_batch(batch: List[Dict[str, Any]], replace=False, rules=None) -> Iterator[Dict[str, Any]]:
+    prefetched = prefetch(batch, replace=replace, rules=rules)
+    for entry in batch:
+        yield repair(entry, replace=replace, rules=rules, prefetched=prefetched)
+
+
+def prefetch(entries: List[Dict[str, Any]], replace=False, rules=None) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Look up values for rules with batch assignments, across a set of entries.
+
+    Only rules with a single source slot can be batched; a batch assignment
+    function takes a list of source values and returns a dict keyed by source value.
+
+    >>> prefetch([{"arxiv_id": "2103.00001"}], rules=["doi_from_arxiv"])
+    {}
+
+    :param entries: entries, as dicts
+    :param replace: also look up values for entries that already have the assigned slots
+    :param rules: rules to apply - applies all rules by default
+    :return: mapping of rule name to assigned slot to source value to result
+    """
+    prefetched = {}
+    for rule in RULES:
+        if rules and rule["name"] not in rules:
+            continue
+        batch_assigns = rule.get("batch_assigns", {})
+        if not batch_assigns or len(rule["sources"]) != 1:
+            continue
+        source = rule["sources"][0]
+        values = []
+        for entry in entries:
+            v = entry.get(source, None)
+            if v and (replace or not any(entry.get(k, None) for k in rule["assigns"].keys())):
+                values.append(v)
+        if not values:
+            continue
+        values = list(dict.fromkeys(values))
+        prefetched[rule["name"]] = {k: fn(values) for k, fn in batch_assigns.items()}
+    return prefetched
 
 
-def repair(entry: Union[bibm.Entry, Dict[str, Any]], replace=False, rules=None) -> Dict[str, Any]:
+def repair(
+    entry: Union[bibm.Entry, Dict[str, Any]],
+    replace=False,
+    rules=None,
+    prefetched: Optional[Dict[str, Dict[str, Dict[str, Any]]]] = None,
+) -> Dict[str, Any]:
     """
     Repair an entry.
 
@@ -105,29 +294,36 @@ def repair(entry: Union[bibm.Entry, Dict[str, Any]], replace=False, rules=None)
     :param entry: dict or Entry object
     :param replace: replace existing values
     :param rules: rules to apply - applies all rules by default
+    :param prefetched: results of :func:`prefetch`, used in place of callable assignments;
+                       values missing from the results are looked up individually
     :return: repaired dict
     """
-    sv = metamodel_schemaview()
+    plan = repair_plan(tuple(rules) if rules else None)
     if isinstance(entry, bibm.Entry):
         entry = entry.model_dump(exclude_unset=True)
     entry = entry.copy()
-    for rule in RULES:
-        if rules and rule["name"] not in rules:
-            continue
+    for rule in plan.rules:
         vars = {normalize_key(k): entry.get(k, None) for k in rule["sources"]}
         if any(vars.values()):
             if replace or not any(entry.get(k, None) for k in rule["assigns"].keys()):
-                entry.update({k: apply_assignment(v, vars) for k, v in rule["assigns"].items()})
-    if not rules or "infer_urls" in rules:
-        for slot in sv.all_slots().values():
-            if slot.range == "uri":
-                pattern = slot.pattern
-                if pattern:
-                    for url in entry.get("urls", []):
-                        if re.match(pattern, url):
-                            entry[slot.name] = url
-                            break
-    if not rules or "infer_journal" in rules:
+                lookups = prefetched.get(rule["name"], {}) if prefetched else {}
+                for k, v in rule["assigns"].items():
+                    # a value that was looked up may have no result (None); one that was not is looked up now
+                    results = lookups.get(k, {})
+                    source_value = entry.get(rule["sources"][0], None)
+                    if source_value in results:
+                        entry[k] = results[source_value]
+                    else:
+                        entry[k] = apply_assignment(v, vars)
+    if plan.infer_urls and plan.url_classifier:
+        # each slot takes the first URL that matches its pattern
+        inferred = set()
+        for url in entry.get("urls", []):
+            m = plan.url_classifier.match(url)
+            if m and m.lastgroup not in inferred:
+                entry[m.lastgroup] = url
+                inferred.add(m.lastgroup)
+    if plan.infer_journal:
         if "journal" not in entry:
             if "arxiv_id" in entry or ARXIV_DOI_PREFIX in entry.get("doi", ""):
                 entry["journal"] = "arXiv"
@@ -163,42 +359,75 @@ def normalize_key(key: str) -> str:
 
 
 def annotate_author_position(
-    entries: Iterable[Dict[str, Any]], author_query: str, overwrite=False
+    entries: Union[Iterable[Union[Dict[str, Any], bibm.Entry]], AuthorIndex],
+    author_query: Union[str, AuthorMatcher],
+    overwrite=False,
 ) -> Iterator[Dict[str, Any]]:
     """
     Annotate author position.
 
-    :param entries:
-    :param author_query:
+    >>> [e["position"] for e in annotate_author_position([{"authors": ["Doe J", "Roe R"]}], "Roe R?")]
+    [2]
+
+    With an author index, only the entries of the author are yielded, without scanning the others:
+
+    >>> entries = [bibm.Entry(title="t1", authors=["Doe J", "Roe R"]), bibm.Entry(title="t2", authors=["Doe J"])]
+    >>> ix = AuthorIndex(entries)
+    >>> [(e["title"], e["role"]) for e in annotate_author_position(ix, "Roe R")]
+    [('t1', 'senior')]
+
+    :param entries: entries, or an index of the entries by author
+    :param author_query: name or regex matching the whole author name, or a compiled matcher
     :param overwrite:
     :return:
     """
+    if isinstance(entries, AuthorIndex):
+        for entry, position in entries.matches(author_query):
+            entry = entry.model_dump(exclude_unset=True)
+            _set_author_position(entry, position - 1, overwrite)
+            yield entry
+        return
+    if isinstance(author_query, AuthorMatcher):
+        matches = author_query.matches
+    else:
+        matches = author_matcher((author_query,)).matches
     for entry in entries:
-        entry = entry.copy()
+        if isinstance(entry, bibm.Entry):
+            entry = entry.model_dump(exclude_unset=True)
+        else:
+            entry = entry.copy()
         authors = entry.get("authors", [])
-        num_authors = len(authors)
-        entry["num_authors"] = num_authors
+        entry["num_authors"] = len(authors)
         for i, author in enumerate(authors):
-            if author_matches(author, author_query):
-                entry["position"] = i + 1
-                entry["rank"] = i if i + 1 < num_authors / 2 else -(num_authors - i)
-                entry["significance"] = 1 - (abs(entry["rank"]) - 1) / num_authors
-                if i == 0:
-                    if num_authors == 1:
-                        role = "sole"
-                    else:
-                        role = "lead"
-                elif i == num_authors - 1:
-                    role = "senior"
-                elif i == num_authors - 2 and num_authors >= 8:
-                    role = "co_senior"
-                elif i == num_authors - 3 and num_authors >= 20:
-                    role = "co_senior"
-                elif i == 1 and num_authors >= 8:
-                    role = "co_lead"
-                else:
-                    role = "contributor"
-                if overwrite or "role" not in entry:
-                    entry["role"] = role
+            if matches(author):
+                _set_author_position(entry, i, overwrite)
 
         yield entry
+
+
+def _set_author_position(entry: Dict[str, Any], i: int, overwrite=False) -> None:
+    """
+    Set the position, rank, significance and role of the author at index i.
+    """
+    num_authors = len(entry.get("authors", []))
+    entry["num_authors"] = num_authors
+    entry["position"] = i + 1
+    entry["rank"] = i if i + 1 < num_authors / 2 else -(num_authors - i)
+    entry["significance"] = 1 - (abs(entry["rank"]) - 1) / num_authors
+    if i == 0:
+        if num_authors == 1:
+            role = "sole"
+        else:
+            role = "lead"
+    elif i == num_authors - 1:
+        role = "senior"
+    elif i == num_authors - 2 and num_authors >= 8:
+        role = "co_senior"
+    elif i == num_authors - 3 and num_authors >= 20:
+        role = "co_senior"
+    elif i == 1 and num_authors >= 8:
+        role = "co_lead"
+    else:
+        role = "contributor"
+    if overwrite or "role" not in entry:
+        entry["role"] = role
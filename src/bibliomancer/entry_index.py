@@ -0,0 +1,606 @@
+"""
+Index of entries by their unique keys.
+
+An :class:`EntryIndex` maps each unique key of the Entry class (see
+:func:`bibliomancer.utilities.entry_unique_keys`) to the entry that has it, so
+an entry can be found by DOI, PMID, journal and local ID, and so on, in a
+single dict lookup. Values are normalized first, so that e.g. DOIs match
+regardless of case or resolver prefix.
+
+Unlike :func:`bibliomancer.utilities.index_entries`, the index can be updated
+as entries are added, removed or changed, and saved to a SQLite file, so a large
+bibliography that is merged from repeatedly only needs to be indexed once.
+A :class:`DiskEntryIndex` reads the same file without loading it, for sources
+too large to hold in memory.
+"""
+
+import json
+import logging
+import os
+import re
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from bibliomancer.datamodel.biblio import Entry
+from bibliomancer.idstore import ID_TYPES, normalize_id
+from bibliomancer.utilities import chunked, construct_entry, entry_unique_keys
+
+logger = logging.getLogger(__name__)
+
+UNIQUE_KEY = Tuple[str, ...]
+
+_DOI_PREFIX = re.compile(r"^(?:doi:\s*|https?://(?:dx\.)?doi\.org/)", re.IGNORECASE)
+_URL = re.compile(r"^https?://", re.IGNORECASE)
+
+
+def normalize_key_value(slot: str, value: Any) -> Any:
+    """
+    Normalize the value of a slot for use in a key.
+
+    >>> normalize_key_value("doi", "https://doi.org/10.1093/NAR/gky1105/")
+    '10.1093/nar/gky1105'
+    >>> normalize_key_value("pmcid", "pmc6324074")
+    'PMC6324074'
+    >>> normalize_key_value("title", " My Paper ")
+    'My Paper'
+    >>> normalize_key_value("local_id", "http://example.org/x/")
+    'http://example.org/x'
+
+    :param slot:
+    :param value:
+    :return: normalized value; None if the value is None or empty
+    """
+    if value is None:
+        return None
+    if slot in ID_TYPES:
+        value = str(value).strip()
+        if slot == "doi":
+            value = _DOI_PREFIX.sub("", value)
+        value = normalize_id(slot, value.rstrip("/"))
+    elif isinstance(value, str):
+        value = value.strip()
+        if _URL.match(value):
+            value = value.rstrip("/")
+    return None if value == "" else value
+
+
+def entry_key_values(entry: Entry, unique_key: UNIQUE_KEY) -> Optional[Tuple]:
+    """
+    Get the normalized values of a unique key for an entry.
+
+    >>> entry_key_values(Entry(title="t1", doi="doi:10.1/A"), ("doi",))
+    ('10.1/a',)
+    >>> entry_key_values(Entry(title="t1"), ("doi",)) is None
+    True
+
+    :param entry:
+    :param unique_key:
+    :return: tuple of values, or None if any is missing
+    """
+    values = tuple(normalize_key_value(slot, getattr(entry, slot, None)) for slot in unique_key)
+    if any(v is None for v in values):
+        return None
+    return values
+
+
+def _key_name(unique_key: UNIQUE_KEY) -> str:
+    return ",".join(unique_key)
+
+
+class EntryIndex:
+    """
+    An updatable index of entries by their unique keys.
+
+    >>> ix = EntryIndex([Entry(title="t1", doi="10.1/A"), Entry(title="t2", pmid="123")])
+    >>> ix.get("doi", "https://doi.org/10.1/a").title
+    't1'
+    >>> e = ix.get(("pmid",), ("123",))
+    >>> e.doi = "10.1/b"
+    >>> ix.update(e)
+    >>> ix.get("doi", "10.1/B").title
+    't2'
+    >>> ix.remove(e)
+    >>> ix.get("doi", "10.1/B") is None, len(ix)
+    (True, 1)
+    """
+
+    def __init__(self, entries: Iterable[Entry] = (), unique_keys: List[UNIQUE_KEY] = None, strict: bool = True):
+        """
+        Create an index.
+
+        :param entries: entries to add
+        :param unique_keys: keys to index on; defaults to the unique keys of the Entry class
+        :param strict: if True, adding an entry with the same key as another raises ValueError;
+                       otherwise the entry that was added first keeps the key
+        """
+        self.unique_keys: List[UNIQUE_KEY] = list(unique_keys if unique_keys is not None else entry_unique_keys())
+        self.strict = strict
+        self._entries: Dict[int, Entry] = {}
+        self._ids: Dict[int, int] = {}
+        self._index: Dict[UNIQUE_KEY, Dict[Tuple, int]] = {k: {} for k in self.unique_keys}
+        self._entry_keys: Dict[int, List[Tuple[UNIQUE_KEY, Tuple]]] = {}
+        self._next_id = 0
+        for entry in entries:
+            self.add(entry)
+
+    def key_values(self, entry: Entry, unique_key: UNIQUE_KEY) -> Optional[Tuple]:
+        """
+        Get the normalized values of a unique key for an entry.
+
+        :param entry:
+        :param unique_key:
+        :return: tuple of values, or None if any is missing
+        """
+        return entry_key_values(entry, unique_key)
+
+    def _keys_for(self, entry: Entry, entry_id: Optional[int] = None) -> List[Tuple[UNIQUE_KEY, Tuple]]:
+        keys = []
+        for unique_key in self.unique_keys:
+            values = self.key_values(entry, unique_key)
+            if values is None:
+                continue
+            existing = self._index[unique_key].get(values, None)
+            if existing is not None and existing != entry_id:
+                if self.strict:
+                    raise ValueError(
+                        f"Multiple entries with key {unique_key} = {values} found: "
+                        f"{[self._entries[existing], entry]}"
+                    )
+                continue
+            keys.append((unique_key, values))
+        return keys
+
+    def _insert_keys(self, entry_id: int, keys: List[Tuple[UNIQUE_KEY, Tuple]]) -> None:
+        for unique_key, values in keys:
+            self._index[unique_key][values] = entry_id
+        self._entry_keys[entry_id] = keys
+
+    def _remove_keys(self, entry_id: int) -> None:
+        for unique_key, values in self._entry_keys.pop(entry_id, []):
+            del self._index[unique_key][values]
+
+    def _entry_id(self, entry: Entry) -> int:
+        entry_id = self._ids.get(id(entry), None)
+        if entry_id is None:
+            raise KeyError(f"Entry is not in the index: {entry}")
+        return entry_id
+
+    def add(self, entry: Entry) -> None:
+        """
+        Add an entry.
+
+        :param entry:
+        :return:
+        :raises ValueError: if strict, and another entry has one of the same keys
+        """
+        if id(entry) in self._ids:
+            raise ValueError(f"Entry is already in the index: {entry}")
+        keys = self._keys_for(entry)
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = entry
+        self._ids[id(entry)] = entry_id
+        self._insert_keys(entry_id, keys)
+
+    def remove(self, entry: Entry) -> None:
+        """
+        Remove an entry.
+
+        :param entry: the entry object, as added
+        :return:
+        :raises KeyError: if the entry is not in the index
+        """
+        entry_id = self._entry_id(entry)
+        self._remove_keys(entry_id)
+        del self._ids[id(entry)]
+        del self._entries[entry_id]
+
+    def update(self, entry: Entry) -> None:
+        """
+        Re-index an entry after its key slots have changed.
+
+        :param entry: the entry object, as added
+        :return:
+        :raises ValueError: if strict, and another entry has one of the new keys; the old keys are kept
+        """
+        entry_id = self._entry_id(entry)
+        keys = self._keys_for(entry, entry_id)
+        self._remove_keys(entry_id)
+        self._insert_keys(entry_id, keys)
+
+    def get(self, unique_key: Union[str, UNIQUE_KEY], values: Union[Any, Tuple]) -> Optional[Entry]:
+        """
+        Look up an entry by a unique key.
+
+        :param unique_key: tuple of slot names, or a single slot name
+        :param values: tuple of values, or a single value; these are normalized before lookup
+        :return: the entry, or None if there is none with that key
+        """
+        if isinstance(unique_key, str):
+            unique_key = (unique_key,)
+        if not isinstance(values, tuple):
+            values = (values,)
+        if unique_key not in self._index:
+            raise KeyError(f"Not an indexed key: {unique_key}")
+        values = tuple(normalize_key_value(slot, v) for slot, v in zip(unique_key, values))
+        entry_id = self._index[unique_key].get(values, None)
+        return None if entry_id is None else self._entries[entry_id]
+
+    def items(self, unique_key: UNIQUE_KEY) -> Iterator[Tuple[Tuple, Entry]]:
+        """
+        Iterate over the values of a unique key, and the entry with each.
+
+        :param unique_key:
+        :return: iterator of (normalized values, entry)
+        """
+        entries = self._entries
+        for values, entry_id in self._index[unique_key].items():
+            yield values, entries[entry_id]
+
+    def find(self, entry: Entry) -> Iterator[Tuple[UNIQUE_KEY, Entry]]:
+        """
+        Find indexed entries that share a unique key with an entry.
+
+        :param entry: any entry, indexed or not
+        :return: iterator of (unique key, matching entry), in the order of the unique keys
+        """
+        for unique_key in self.unique_keys:
+            values = self.key_values(entry, unique_key)
+            if values is None:
+                continue
+            entry_id = self._index[unique_key].get(values, None)
+            if entry_id is not None:
+                yield unique_key, self._entries[entry_id]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[Entry]:
+        return iter(list(self._entries.values()))
+
+    def __contains__(self, entry: Entry) -> bool:
+        return id(entry) in self._ids
+
+    def save(self, path: Union[str, Path], source: Dict[str, Any] = None) -> None:
+        """
+        Save the index and its entries to a SQLite file, replacing any existing index there.
+
+        :param path:
+        :param source: description of where the entries came from, used by :meth:`from_file`
+        :return:
+        """
+        meta = {"unique_keys": [list(k) for k in self.unique_keys], "strict": self.strict, "source": source}
+        connection = create_index_file(path, meta, self._entries)
+        try:
+            _create_key_table(connection)
+            connection.executemany(
+                "INSERT INTO entry_key VALUES (?, ?, ?)",
+                (
+                    (_key_name(unique_key), json.dumps(values), entry_id)
+                    for entry_id, keys in self._entry_keys.items()
+                    for unique_key, values in keys
+                ),
+            )
+            connection.commit()
+        finally:
+            connection.close()
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "EntryIndex":
+        """
+        Load an index saved with :meth:`save`.
+
+        Entries are not validated again, and keys are not recomputed.
+
+        :param path:
+        :return:
+        """
+        connection = sqlite3.connect(str(path))
+        try:
+            meta = read_index_meta(connection)
+            ix = cls(unique_keys=[tuple(k) for k in meta["unique_keys"]], strict=meta["strict"])
+            for entry_id, entry in read_index_entries(connection).items():
+                ix._entries[entry_id] = entry
+                ix._ids[id(entry)] = entry_id
+                ix._entry_keys[entry_id] = []
+                ix._next_id = entry_id + 1
+            unique_keys = {_key_name(k): k for k in ix.unique_keys}
+            for name, values, entry_id in connection.execute("SELECT unique_key, key_values, entry_id FROM entry_key"):
+                unique_key = unique_keys[name]
+                values = tuple(json.loads(values))
+                ix._index[unique_key][values] = entry_id
+                ix._entry_keys[entry_id].append((unique_key, values))
+        finally:
+            connection.close()
+        return ix
+
+    @classmethod
+    def from_file(cls, input_file: Union[str, Path], index_path: Union[str, Path], **kwargs) -> "EntryIndex":
+        """
+        Load the index of a bibliography file, building and saving it if needed.
+
+        The saved index is used if it was built from the same file, with the same
+        size and modification time; otherwise the file is loaded and indexed again.
+
+        :param input_file: bibliography file
+        :param index_path: path of the saved index
+        :param kwargs: passed to :func:`bibliomancer.io.load_file_iter`
+        :return:
+        """
+        from bibliomancer.io import load_file_iter
+
+        source = file_source(input_file)
+        if is_current_index(index_path, source):
+            logger.info(f"Using saved index {index_path} for {input_file}")
+            return cls.load(index_path)
+        ix = cls(load_file_iter(input_file, **kwargs))
+        ix.save(index_path, source=source)
+        return ix
+
+
+class DiskEntryIndex:
+    """
+    A read-only index of entries by their unique keys, kept in a SQLite file.
+
+    Entries are read from the file as they are looked up, so memory use does not grow with
+    the number of entries. This is for merging from sources too large to load; the file
+    layout is the same as for :meth:`EntryIndex.save`, so either class can open it.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as d:
+    ...     with DiskEntryIndex.build(f"{d}/ix.sqlite", [Entry(title="t1", doi="10.1/A")]) as ix:
+    ...         (ix.get("doi", "https://doi.org/10.1/a").title, len(ix))
+    ('t1', 1)
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        Open an index file.
+
+        :param path: file written by :meth:`build` or :meth:`EntryIndex.save`
+        """
+        self.path = str(path)
+        self._connection = sqlite3.connect(self.path)
+        meta = read_index_meta(self._connection)
+        self.unique_keys: List[UNIQUE_KEY] = [tuple(k) for k in meta["unique_keys"]]
+        self.strict = meta["strict"]
+
+    @classmethod
+    def build(
+        cls,
+        path: Union[str, Path],
+        entries: Iterable[Entry],
+        unique_keys: List[UNIQUE_KEY] = None,
+        strict: bool = True,
+        source: Dict[str, Any] = None,
+        batch_size: int = 1000,
+    ) -> "DiskEntryIndex":
+        """
+        Write entries to an index file as they are produced, replacing any existing file.
+
+        :param path:
+        :param entries:
+        :param unique_keys: keys to index on; defaults to the unique keys of the Entry class
+        :param strict: if True, an entry with the same key as another raises ValueError;
+                       otherwise the entry that came first keeps the key
+        :param source: description of where the entries came from, used by :meth:`from_file`
+        :param batch_size: number of entries written together
+        :return: the opened index
+        """
+        unique_keys = list(unique_keys if unique_keys is not None else entry_unique_keys())
+        meta = {"unique_keys": [list(k) for k in unique_keys], "strict": strict, "source": None}
+        connection = create_index_file(path, meta, {})
+        try:
+            _create_key_table(connection)
+            insert_keys = f"INSERT {'' if strict else 'OR IGNORE '}INTO entry_key VALUES (?, ?, ?)"
+            entry_id = 0
+            for batch in chunked(entries, batch_size):
+                rows = []
+                keys = []
+                for entry in batch:
+                    rows.append((entry_id, json.dumps(entry.model_dump(exclude_none=True))))
+                    for unique_key in unique_keys:
+                        values = entry_key_values(entry, unique_key)
+                        if values is not None:
+                            keys.append((_key_name(unique_key), json.dumps(values), entry_id))
+                    entry_id += 1
+                connection.executemany("INSERT INTO entry VALUES (?, ?)", rows)
+                try:
+                    connection.executemany(insert_keys, keys)
+                except sqlite3.IntegrityError as e:
+                    raise ValueError(f"Multiple entries with the same key found, in {path}: {e}") from e
+            # the source is recorded last, so an interrupted build is never taken as current
+            connection.execute("UPDATE meta SET value = ? WHERE key = 'source'", (json.dumps(source),))
+            connection.commit()
+        except BaseException:
+            connection.close()
+            os.remove(str(path))
+            raise
+        connection.close()
+        return cls(path)
+
+    @classmethod
+    def from_file(cls, input_file: Union[str, Path], index_path: Union[str, Path], **kwargs) -> "DiskEntryIndex":
+        """
+        Open the index of a bibliography file, building it if needed.
+
+        The file is streamed into the index without being loaded. As for
+        :meth:`EntryIndex.from_file`, a saved index is used while the file is unchanged.
+
+        :param input_file: bibliography file
+        :param index_path: path of the index file
+        :param kwargs: passed to :func:`bibliomancer.io.load_file_iter`
+        :return:
+        """
+        from bibliomancer.io import load_file_iter
+
+        source = file_source(input_file)
+        if is_current_index(index_path, source):
+            logger.info(f"Using saved index {index_path} for {input_file}")
+            return cls(index_path)
+        return cls.build(index_path, load_file_iter(input_file, **kwargs), source=source)
+
+    def _entry(self, entry_id: int) -> Entry:
+        (data,) = self._connection.execute("SELECT data FROM entry WHERE id = ?", (entry_id,)).fetchone()
+        return construct_entry(json.loads(data))
+
+    def _lookup(self, unique_key: UNIQUE_KEY, values: Tuple) -> Optional[Entry]:
+        row = self._connection.execute(
+            "SELECT entry_id FROM entry_key WHERE unique_key = ? AND key_values = ?",
+            (_key_name(unique_key), json.dumps(values)),
+        ).fetchone()
+        return None if row is None else self._entry(row[0])
+
+    def key_values(self, entry: Entry, unique_key: UNIQUE_KEY) -> Optional[Tuple]:
+        """
+        Get the normalized values of a unique key for an entry.
+
+        :param entry:
+        :param unique_key:
+        :return: tuple of values, or None if any is missing
+        """
+        return entry_key_values(entry, unique_key)
+
+    def get(self, unique_key: Union[str, UNIQUE_KEY], values: Union[Any, Tuple]) -> Optional[Entry]:
+        """
+        Look up an entry by a unique key.
+
+        :param unique_key: tuple of slot names, or a single slot name
+        :param values: tuple of values, or a single value; these are normalized before lookup
+        :return: a new, unvalidated copy of the entry, or None if there is none with that key
+        """
+        if isinstance(unique_key, str):
+            unique_key = (unique_key,)
+        if not isinstance(values, tuple):
+            values = (values,)
+        if unique_key not in self.unique_keys:
+            raise KeyError(f"Not an indexed key: {unique_key}")
+        return self._lookup(unique_key, tuple(normalize_key_value(slot, v) for slot, v in zip(unique_key, values)))
+
+    def items(self, unique_key: UNIQUE_KEY) -> Iterator[Tuple[Tuple, Entry]]:
+        """
+        Iterate over the values of a unique key, and the entry with each.
+
+        :param unique_key:
+        :return: iterator of (normalized values, entry)
+        """
+        cursor = self._connection.execute(
+            "SELECT key_values, data FROM entry_key JOIN entry ON entry.id = entry_id "
+            "WHERE unique_key = ? ORDER BY entry_key.rowid",
+            (_key_name(unique_key),),
+        )
+        for values, data in cursor:
+            yield tuple(json.loads(values)), construct_entry(json.loads(data))
+
+    def find(self, entry: Entry) -> Iterator[Tuple[UNIQUE_KEY, Entry]]:
+        """
+        Find indexed entries that share a unique key with an entry.
+
+        :param entry: any entry
+        :return: iterator of (unique key, matching entry), in the order of the unique keys
+        """
+        for unique_key in self.unique_keys:
+            values = entry_key_values(entry, unique_key)
+            if values is None:
+                continue
+            match = self._lookup(unique_key, values)
+            if match is not None:
+                yield unique_key, match
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM entry").fetchone()[0]
+
+    def __iter__(self) -> Iterator[Entry]:
+        for (data,) in self._connection.execute("SELECT data FROM entry ORDER BY id"):
+            yield construct_entry(json.loads(data))
+
+    def close(self) -> None:
+        """Close the index file."""
+        self._connection.close()
+
+    def __enter__(self) -> "DiskEntryIndex":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def file_source(path: Union[str, Path]) -> Dict[str, Any]:
+    """
+    Describe a file by its path, size and modification time.
+
+    :param path:
+    :return:
+    """
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def is_current_index(index_path: Union[str, Path], source: Dict[str, Any]) -> bool:
+    """
+    Check if a saved index was built from a source, as described by :func:`file_source`.
+
+    :param index_path:
+    :param source:
+    :return: False if there is no index, or it is unreadable or out of date
+    """
+    if not os.path.exists(index_path):
+        return False
+    try:
+        connection = sqlite3.connect(str(index_path))
+        try:
+            saved = read_index_meta(connection).get("source", None)
+        finally:
+            connection.close()
+    except sqlite3.DatabaseError as e:
+        logger.warning(f"Ignoring unreadable index {index_path}: {e}")
+        return False
+    if saved != source:
+        logger.info(f"Saved index {index_path} is out of date")
+        return False
+    return True
+
+
+def create_index_file(path: Union[str, Path], meta: Dict[str, Any], entries: Dict[int, Entry]) -> sqlite3.Connection:
+    """
+    Create a SQLite index file holding metadata and entries, replacing any existing file.
+
+    :param path:
+    :param meta: JSON-serializable values, by name
+    :param entries: entries, by id
+    :return: open connection, for adding index tables
+    """
+    path = str(path)
+    if os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+    connection.execute("CREATE TABLE entry (id INTEGER PRIMARY KEY, data TEXT NOT NULL)")
+    connection.executemany("INSERT INTO meta VALUES (?, ?)", [(k, json.dumps(v)) for k, v in meta.items()])
+    connection.executemany(
+        "INSERT INTO entry VALUES (?, ?)",
+        ((entry_id, json.dumps(entry.model_dump(exclude_none=True))) for entry_id, entry in entries.items()),
+    )
+    return connection
+
+
+_KEY_INDEX_DDL = "CREATE UNIQUE INDEX IF NOT EXISTS entry_key_lookup ON entry_key (unique_key, key_values)"
+
+
+def _create_key_table(connection: sqlite3.Connection) -> None:
+    connection.execute("CREATE TABLE entry_key (unique_key TEXT, key_values TEXT, entry_id INTEGER)")
+    connection.execute(_KEY_INDEX_DDL)
+
+
+def read_index_meta(connection: sqlite3.Connection) -> Dict[str, Any]:
+    """Read the metadata of an index file created with :func:`create_index_file`."""
+    return {k: json.loads(v) for k, v in connection.execute("SELECT key, value FROM meta")}
+
+
+def read_index_entries(connection: sqlite3.Connection) -> Dict[int, Entry]:
+    """Read the entries of an index file created with :func:`create_index_file`, without validating them."""
+    return {
+        entry_id: construct_entry(json.loads(data))
+        for entry_id, data in connection.execute("SELECT id, data FROM entry ORDER BY id")
+    }
@@ -1,8 +1,32 @@
+import asyncio
+import logging
 import os
+import random
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional
 
+import requests
 import requests_cache
 
+from bibliomancer.idstore import IdentifierStore, get_identifier_store
+from bibliomancer.pmcindex import get_pmc_index
+from bibliomancer.utilities import chunked
+
+logger = logging.getLogger(__name__)
+
 url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/elink.fcgi"
+idconv_url = "https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/"
+
+# the ID converter API accepts at most 200 IDs per request
+IDCONV_CHUNK_SIZE = 200
+
+# NCBI usage policy: requests per second, without and with an API key
+RATE_LIMIT = 3
+RATE_LIMIT_WITH_KEY = 10
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
 
 
 def get_api_key():
@@ -13,6 +37,18 @@ def get_api_key():
     return os.environ.get("NCBI_API_KEY", None)
 
 
+@lru_cache
+def get_session() -> requests_cache.CachedSession:
+    """
+    Get the shared cached session.
+
+    A single session is reused so that connections are pooled across calls.
+
+    :return:
+    """
+    return requests_cache.CachedSession("eutils_cache")
+
+
 def pmid_to_pmc(pmid, api_key=None):
     """
     Convert a PMID to a PMCID.
@@ -22,19 +58,279 @@ def pmid_to_pmc(pmid, api_key=None):
 
     :param pmid:
     :param api_key:
-    :return:
+    :return: the PMCID, or None if the PMID has no PMC entry
+    :raises requests.RequestException: if the lookup fails
+    """
+    return pmids_to_pmcs([pmid], api_key=api_key).get(str(pmid), None)
+
+
+def pmids_to_pmcs(
+    pmids: Iterable[str], api_key=None, chunk_size=IDCONV_CHUNK_SIZE, skip_failed=False
+) -> Dict[str, Optional[str]]:
+    """
+    Convert a collection of PMIDs to PMCIDs.
+
+    PMIDs are sent to the NCBI ID converter in chunks of up to ``chunk_size`` IDs,
+    reusing a single session.
+
+    >>> pmids_to_pmcs(["37389415"])
+    {'37389415': 'PMC10336030'}
+
+    PMIDs with no PMC entry map to None. If a chunk fails, the error is raised, unless
+    ``skip_failed`` is set, in which case the failure is logged and the PMIDs in that
+    chunk are omitted from the results, so that callers can tell them apart from PMIDs
+    with no PMC entry.
+
+    PMIDs are first looked up in the local identifier store (see :mod:`bibliomancer.idstore`),
+    and only those not found there are sent to NCBI; results, including PMIDs with no
+    PMC entry, are added to the store.
+
+    If an offline PMC-ids index is configured (see :mod:`bibliomancer.pmcindex`), it is used
+    instead, and no network requests are made.
+
+    :param pmids:
+    :param api_key:
+    :param chunk_size: maximum number of IDs per request
+    :param skip_failed: if True, omit the PMIDs of failed requests rather than raising
+    :return: mapping between PMIDs and PMCIDs
     """
-    session = requests_cache.CachedSession("eutils_cache")
     if api_key is None:
         api_key = get_api_key()
+    # dedupe, preserving order
+    pmids = list(dict.fromkeys(str(pmid) for pmid in pmids))
+    pmc_index = get_pmc_index()
+    if pmc_index:
+        return pmc_index.pmids_to_pmcs(pmids)
+    store = get_identifier_store()
+    results = store.get_many("pmid", pmids, "pmcid") if store else {}
+    session = get_session()
+    for chunk in chunked([pmid for pmid in pmids if pmid not in results], chunk_size):
+        params = idconv_params(chunk, api_key)
+        try:
+            response = session.get(idconv_url, params=params)
+            response.raise_for_status()
+            data = response.json()
+        except Exception as e:
+            if not skip_failed:
+                raise
+            logger.error(f"Failed to convert {len(chunk)} PMIDs starting at {chunk[0]}: {e}")
+            continue
+        results.update(parse_idconv_records(data, chunk, store=store))
+    return {pmid: results[pmid] for pmid in pmids if pmid in results}
+
+
+def idconv_params(pmids: List[str], api_key=None) -> Dict[str, str]:
+    """
+    Build request parameters for the ID converter.
+
+    >>> idconv_params(["1", "2"])
+    {'ids': '1,2', 'idtype': 'pmid', 'format': 'json'}
+
+    :param pmids:
+    :param api_key:
+    :return:
+    """
+    params = {"ids": ",".join(pmids), "idtype": "pmid", "format": "json"}
+    if api_key:
+        params["api_key"] = api_key
+    return params
+
+
+def parse_idconv_records(
+    data: Dict, pmids: List[str], store: Optional[IdentifierStore] = None
+) -> Dict[str, Optional[str]]:
+    """
+    Parse a response from the ID converter.
+
+    >>> data = {"records": [{"pmid": "1", "pmcid": "PMC2"}, {"pmid": "3", "status": "error"}]}
+    >>> parse_idconv_records(data, ["1", "3"])
+    {'1': 'PMC2', '3': None}
+
+    :param data: JSON response
+    :param pmids: PMIDs that were requested
+    :param store: if set, add the cross-mappings in each record to this store
+    :return:
+    """
+    records = {pmid: {"pmid": pmid} for pmid in pmids}
+    for record in data.get("records", []):
+        pmid = record.get("pmid", None)
+        if pmid is not None and str(pmid) in records:
+            records[str(pmid)] = {k: record.get(k, None) for k in ("pmid", "pmcid", "doi")}
+    if store is not None:
+        store.put_records(records.values(), negative_types=["pmcid"])
+    return {pmid: record.get("pmcid", None) for pmid, record in records.items()}
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter for use with asyncio.
+
+    Tokens are refilled continuously at ``rate`` per second, up to ``capacity``.
+    Each request consumes one token. The default capacity of 1 spaces requests
+    evenly, so the rate is never exceeded over any one-second window.
+
+    The bucket holds no loop-bound state, so a single instance can be shared by
+    clients running in different event loops; a lock guards the refill and take,
+    as those loops may run in different threads.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        """
+        Wait until a token is available, then consume it.
+
+        :return:
+        """
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+
+
+@lru_cache
+def get_rate_limiter(with_api_key: bool) -> TokenBucket:
+    """
+    Get the process-wide rate limiter.
+
+    All clients share the same bucket, so that together they stay within the NCBI limits.
+
+    :param with_api_key: True if requests are made with an API key
+    :return:
+    """
+    return TokenBucket(RATE_LIMIT_WITH_KEY if with_api_key else RATE_LIMIT)
+
+
+class AsyncEutilsClient:
+    """
+    Asyncio client for NCBI E-utilities.
+
+    Blocking HTTP calls run in worker threads, so they do not stall the event loop.
+    Requests are limited by the shared token bucket and by a semaphore bounding the
+    number in flight. Responses with status 429 or 5xx are retried with jittered
+    exponential backoff.
+
+    Example usage, from within a coroutine:
+
+        client = AsyncEutilsClient(max_concurrency=8)
+        pmcids = await client.pmids_to_pmcs(pmids)
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        max_concurrency: int = 4,
+        max_retries: int = 5,
+        backoff: float = 0.5,
+        limiter: Optional[TokenBucket] = None,
+        session: Optional[requests.Session] = None,
+    ):
+        if api_key is None:
+            api_key = get_api_key()
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.limiter = limiter if limiter is not None else get_rate_limiter(bool(api_key))
+        self.session = session if session is not None else get_session()
+        self._semaphore = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # created lazily, so that it is bound to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _retry_delay(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        if response is not None:
+            retry_after = response.headers.get("Retry-After", None)
+            if retry_after and retry_after.isdigit():
+                return float(retry_after)
+        return random.uniform(0, self.backoff * 2**attempt)  # noqa: S311
+
+    async def get_json(self, url: str, params: Dict[str, Any]) -> Any:
+        """
+        Get a URL and decode the JSON response, retrying on transient failures.
+
+        :param url:
+        :param params:
+        :return: decoded JSON
+        """
+        async with self.semaphore:
+            for attempt in range(self.max_retries + 1):
+                await self.limiter.acquire()
+                try:
+                    response = await asyncio.to_thread(self.session.get, url, params=params)
+                except requests.ConnectionError:
+                    if attempt == self.max_retries:
+                        raise
+                    response = None
+                else:
+                    if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                        response.raise_for_status()
+                        return response.json()
+                delay = self._retry_delay(attempt, response)
+                logger.info(f"Retrying {url} in {delay:.2f}s (attempt {attempt + 1})")
+                await asyncio.sleep(delay)
+
+    async def pmid_to_pmc(self, pmid: str) -> Optional[str]:
+        """
+        Convert a PMID to a PMCID.
+
+        :param pmid:
+        :return:
+        """
+        results = await self.pmids_to_pmcs([pmid])
+        return results.get(str(pmid), None)
 
-    params = {"dbfrom": "pubmed", "db": "pmc", "id": pmid, "api_key": api_key, "retmode": "json"}
+    async def pmids_to_pmcs(
+        self, pmids: Iterable[str], chunk_size=IDCONV_CHUNK_SIZE, skip_failed=False
+    ) -> Dict[str, Optional[str]]:
+        """
+        Convert a collection of PMIDs to PMCIDs, requesting chunks concurrently.
 
-    response = session.get(url, params=params)
-    data = response.json()
+        As with :func:`pmids_to_pmcs`, the offline index or the local identifier store
+        is consulted first, and the first error of any failed chunk is raised, unless
+        ``skip_failed`` is set, in which case the PMIDs in that chunk are omitted.
 
-    try:
-        pmc_id = data["linksets"][0]["linksetdbs"][0]["links"][0]
-        return f"PMC{pmc_id}"
-    except (IndexError, KeyError):
-        return None
+        :param pmids:
+        :param chunk_size: maximum number of IDs per request
+        :param skip_failed: if True, omit the PMIDs of failed requests rather than raising
+        :return: mapping between PMIDs and PMCIDs
+        """
+        pmids = list(dict.fromkeys(str(pmid) for pmid in pmids))
+        pmc_index = get_pmc_index()
+        if pmc_index:
+            return pmc_index.pmids_to_pmcs(pmids)
+        store = get_identifier_store()
+        # the store is SQLite, so keep its reads and writes off the event loop
+        results = await asyncio.to_thread(store.get_many, "pmid", pmids, "pmcid") if store else {}
+        chunks = list(chunked([pmid for pmid in pmids if pmid not in results], chunk_size))
+        responses = await asyncio.gather(
+            *[self.get_json(idconv_url, idconv_params(chunk, self.api_key)) for chunk in chunks],
+            return_exceptions=True,
+        )
+        # gather returns one result per chunk; zip(strict=True) would need Python 3.10
+        for chunk, data in zip(chunks, responses):  # noqa: B905
+            if isinstance(data, Exception):
+                if not skip_failed:
+                    raise data
+                logger.error(f"Failed to convert {len(chunk)} PMIDs starting at {chunk[0]}: {data}")
+                continue
+            results.update(await asyncio.to_thread(parse_idconv_records, data, chunk, store=store))
+        return {pmid: results[pmid] for pmid in pmids if pmid in results}
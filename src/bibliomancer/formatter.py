@@ -6,18 +6,20 @@ Currently only a single jinja2 template is supported, for generating markdown.
 This can later be converted to HTML using pandoc.
 """
 
-import re
 from pathlib import Path
 from typing import Iterable, Any, Dict, TextIO, List, Optional, Union
 
 from jinja2 import Environment, FileSystemLoader
 
+from bibliomancer.author_index import AuthorIndex
+from bibliomancer.datamodel.entry_table import EntryTable
 from bibliomancer.datamodel.enums import BiblioSchemaEnum
 from bibliomancer.templates import TEMPLATE_DIR
 import bibliomancer.datamodel.biblio as bibm
+from bibliomancer.utilities import AuthorMatcher, author_matcher
 
 
-def highlight_authors(entry: bibm.Entry, authors: List[str]) -> bibm.Entry:
+def highlight_authors(entry: bibm.Entry, authors: Union[List[str], AuthorMatcher]) -> bibm.Entry:
     """
     Highlight authors in a list of authors.
 
@@ -29,25 +31,19 @@ def highlight_authors(entry: bibm.Entry, authors: List[str]) -> bibm.Entry:
     ['**Me M**']
 
     :param entry:
-    :param authors:
-    :return:
+    :param authors: names or regexes, matched at the start of each author; or a compiled matcher
+    :return: a copy of the entry
     """
-    entry = bibm.Entry(**entry.model_dump())
-
-    def matches(author: str) -> bool:
-        for author_to_match in authors:
-            if author_to_match == author:
-                return True
-            if re.match(author_to_match, author):
-                return True
-        return False
-
-    entry.authors = [f"**{author}**" if matches(author) else author for author in entry.authors]
-    return entry
+    if not isinstance(authors, AuthorMatcher):
+        authors = author_matcher(tuple(authors), partial=True)
+    matches = authors.matches
+    return entry.model_copy(
+        update={"authors": [f"**{author}**" if matches(author) else author for author in entry.authors]}
+    )
 
 
 def generate_markdown(
-    entries: Union[Iterable[bibm.Entry], Dict],
+    entries: Union[Iterable[bibm.Entry], EntryTable, Dict, AuthorIndex],
     stream: TextIO,
     template_name: str = None,
     authors: Optional[List] = None,
@@ -62,16 +58,19 @@ def generate_markdown(
     >>> text_stream = io.StringIO()
     >>> generate_markdown(entries, text_stream)
 
-    :param entries:
+    :param entries: entries; or an index of entries by author, from which only those of the authors are used
     :param stream:
     :return:
     """
+    if isinstance(entries, AuthorIndex):
+        entries = entries.entries_for(list(authors), partial=True) if authors else list(entries)
     entries = [bibm.Entry(**e) if isinstance(e, dict) else e for e in entries]
     if template_name is None:
         template_name = "default.markdown"
 
     if authors:
-        entries = [highlight_authors(entry, authors) for entry in entries]
+        matcher = author_matcher(tuple(authors), partial=True)
+        entries = [highlight_authors(entry, matcher) for entry in entries]
 
     entries = sorted(
         entries, reverse=True, key=lambda x: (str(x.year), float(x.significance) if x.significance else 0.0)
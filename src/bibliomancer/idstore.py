@@ -0,0 +1,239 @@
+"""
+Local store of identifier cross-mappings.
+
+Maps between PMIDs, PMCIDs and DOIs, keyed on (source ID type, source ID, target ID type).
+Each mapping has its own expiry time. A mapping to None is a negative entry, recording
+that the source is known to have no identifier of the target type, e.g. a PMID with no
+PMC entry.
+
+Unlike the HTTP cache used by :mod:`bibliomancer.eutils`, lookups do not depend on
+the request URL (including the API key), and negative results are explicit.
+
+The default store is kept in the user's cache directory, ``$XDG_CACHE_HOME/bibliomancer``
+(or ``~/.cache/bibliomancer``), rather than the working directory.
+"""
+
+import logging
+import os
+import sqlite3
+import time
+from functools import lru_cache
+from itertools import permutations
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ID_TYPES = ["pmid", "pmcid", "doi"]
+
+DEFAULT_STORE_NAME = "ids.sqlite"
+DEFAULT_TTL = 90 * 24 * 60 * 60
+DEFAULT_NEGATIVE_TTL = 7 * 24 * 60 * 60
+
+MAPPING = Tuple[str, str, str, Optional[str]]
+
+
+def default_store_path() -> str:
+    """
+    Get the path of the default identifier store, in the user's cache directory.
+
+    :return:
+    """
+    cache_dir = os.environ.get("XDG_CACHE_HOME", None) or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_dir, "bibliomancer", DEFAULT_STORE_NAME)
+
+
+def normalize_id(id_type: str, id: str) -> str:
+    """
+    Normalize an identifier for use as a key.
+
+    >>> normalize_id("doi", "10.1093/NAR/gky1105")
+    '10.1093/nar/gky1105'
+    >>> normalize_id("pmcid", "6324074")
+    'PMC6324074'
+    >>> normalize_id("pmid", " 30476213 ")
+    '30476213'
+
+    :param id_type: one of ID_TYPES
+    :param id:
+    :return:
+    """
+    id = str(id).strip()
+    if id_type == "doi":
+        return id.lower()
+    if id_type == "pmcid":
+        id = id.upper()
+        return id if id.startswith("PMC") else f"PMC{id}"
+    return id
+
+
+class IdentifierStore:
+    """
+    SQLite-backed store of identifier mappings.
+
+    >>> store = IdentifierStore(":memory:")
+    >>> store.put("pmid", "30476213", "pmcid", "PMC6324074")
+    >>> store.put("pmid", "1", "pmcid", None)
+    >>> store.get_many("pmid", ["30476213", "1", "2"], "pmcid")
+    {'30476213': 'PMC6324074', '1': None}
+    """
+
+    def __init__(self, path: str, ttl: float = DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        """
+        Open or create a store.
+
+        :param path: path to the SQLite database, or ``:memory:``
+        :param ttl: time to live of mappings, in seconds
+        :param negative_ttl: time to live of negative entries, in seconds
+        """
+        self.path = str(path)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS mapping ("
+            "source_type TEXT NOT NULL, source_id TEXT NOT NULL, target_type TEXT NOT NULL, target_id TEXT, "
+            "expires REAL NOT NULL, PRIMARY KEY (source_type, source_id, target_type))"
+        )
+        self.connection.commit()
+
+    def get(self, source_type: str, source_id: str, target_type: str) -> Tuple[bool, Optional[str]]:
+        """
+        Look up a single mapping.
+
+        :param source_type:
+        :param source_id:
+        :param target_type:
+        :return: tuple of (found, target ID); the target ID is None for negative entries
+        """
+        results = self.get_many(source_type, [source_id], target_type)
+        if results:
+            return True, list(results.values())[0]
+        return False, None
+
+    def get_many(self, source_type: str, source_ids: Iterable[str], target_type: str) -> Dict[str, Optional[str]]:
+        """
+        Look up mappings for a collection of IDs.
+
+        IDs with no unexpired mapping are omitted; IDs with a negative entry map to None.
+
+        :param source_type:
+        :param source_ids:
+        :param target_type:
+        :return: mapping from source ID (as passed in) to target ID
+        """
+        keys = {normalize_id(source_type, id): id for id in source_ids}
+        results = {}
+        now = time.time()
+        key_list = list(keys)
+        # stay well within the SQLite limit on host parameters
+        for i in range(0, len(key_list), 500):
+            chunk = key_list[i : i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            query = (
+                "SELECT source_id, target_id FROM mapping "  # noqa: S608
+                f"WHERE source_type = ? AND target_type = ? AND expires > ? AND source_id IN ({placeholders})"
+            )
+            rows = self.connection.execute(query, [source_type, target_type, now] + chunk)
+            for source_id, target_id in rows:
+                results[source_id] = target_id
+        return {id: results[key] for key, id in keys.items() if key in results}
+
+    def put(self, source_type: str, source_id: str, target_type: str, target_id: Optional[str]) -> None:
+        """
+        Add or replace a single mapping.
+
+        :param source_type:
+        :param source_id:
+        :param target_type:
+        :param target_id: None for a negative entry
+        :return:
+        """
+        self.put_many([(source_type, source_id, target_type, target_id)])
+
+    def put_many(self, mappings: Iterable[MAPPING]) -> None:
+        """
+        Add or replace mappings.
+
+        :param mappings: tuples of (source_type, source_id, target_type, target_id)
+        :return:
+        """
+        now = time.time()
+        rows = [
+            (
+                st,
+                normalize_id(st, sid),
+                tt,
+                normalize_id(tt, tid) if tid is not None else None,
+                now + (self.ttl if tid is not None else self.negative_ttl),
+            )
+            for st, sid, tt, tid in mappings
+        ]
+        self.connection.executemany("INSERT OR REPLACE INTO mapping VALUES (?, ?, ?, ?, ?)", rows)
+        self.connection.commit()
+
+    def put_record(self, record: Dict[str, Optional[str]], negative_types: Iterable[str] = ()) -> None:
+        """
+        Add all cross-mappings between the identifiers of a single work.
+
+        >>> store = IdentifierStore(":memory:")
+        >>> store.put_record({"pmid": "30476213", "pmcid": "PMC6324074", "doi": "10.1093/nar/gky1105"})
+        >>> store.get("doi", "10.1093/NAR/GKY1105", "pmcid")
+        (True, 'PMC6324074')
+        >>> store.put_record({"pmid": "1"}, negative_types=["pmcid"])
+        >>> store.get("pmid", "1", "pmcid")
+        (True, None)
+
+        :param record: mapping from ID type to ID
+        :param negative_types: ID types that the work is known not to have
+        :return:
+        """
+        self.put_records([record], negative_types=negative_types)
+
+    def put_records(self, records: Iterable[Dict[str, Optional[str]]], negative_types: Iterable[str] = ()) -> None:
+        """
+        Add all cross-mappings for a collection of works.
+
+        See :meth:`put_record`.
+
+        :param records: mappings from ID type to ID, one per work
+        :param negative_types: ID types that the works are known not to have, if absent from the record
+        :return:
+        """
+        mappings = []
+        for record in records:
+            ids = {k: v for k, v in record.items() if k in ID_TYPES and v}
+            mappings.extend((st, ids[st], tt, ids[tt]) for st, tt in permutations(ids, 2))
+            for tt in negative_types:
+                if tt not in ids:
+                    mappings.extend((st, ids[st], tt, None) for st in ids)
+        self.put_many(mappings)
+
+    def purge_expired(self) -> int:
+        """
+        Remove expired mappings.
+
+        :return: number of mappings removed
+        """
+        cursor = self.connection.execute("DELETE FROM mapping WHERE expires <= ?", [time.time()])
+        self.connection.commit()
+        return cursor.rowcount
+
+
+@lru_cache
+def get_identifier_store() -> Optional[IdentifierStore]:
+    """
+    Get the default identifier store.
+
+    The location defaults to :func:`default_store_path`, and can be set with the
+    BIBLIOMANCER_IDSTORE environment variable; setting it to an empty string disables the store.
+
+    :return: the store, or None if disabled
+    """
+    path = os.environ.get("BIBLIOMANCER_IDSTORE", None)
+    if path is None:
+        path = default_store_path()
+    if not path:
+        return None
+    if path != ":memory:":
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return IdentifierStore(path)
@@ -6,15 +6,29 @@ By default loaders will map to the BIBM schema, and writers assume the BIBM sche
 TODO: reuse more core linkml features
 """
 
+import bz2
 import csv
+import gzip
 import logging
+import lzma
+from functools import partial
+from io import StringIO
 from pathlib import Path
-from typing import Dict, Any, Union, TextIO, Iterator, Optional, Iterable, List
+from typing import Dict, Any, Union, TextIO, Iterator, Optional, Iterable, List, Tuple
 
 import bibliomancer.datamodel.biblio as bibm
+from bibliomancer.datamodel.entry_table import EntryTable
 from bibliomancer.datamodel.enums import BiblioSchemaEnum, BiblioSyntaxEnum
-from bibliomancer.mapper import map_entry
-from bibliomancer.utilities import as_entry_objects
+from bibliomancer.lazy import LazyEntry
+from bibliomancer.mapper import DEFAULT_MAPPING_BATCH_SIZE, PYTHON_ENGINE, map_columns, map_entry
+from bibliomancer.utilities import (
+    chunked,
+    as_entry_objects,
+    construct_entry,
+    imap_ordered,
+    imap_unordered,
+    set_entry_value,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -27,11 +41,39 @@ PAPERPILE_MULTIVALUED_SEPARATOR_MAP = {
     "URLs": ";",
 }
 
+# file name suffixes that differ from the format name
+FORMAT_SUFFIXES = {
+    "bib": BiblioSyntaxEnum.BIBTEX,
+    "yml": BiblioSyntaxEnum.YAML,
+    "md": BiblioSyntaxEnum.MARKDOWN,
+}
+
+# formats that can be both read and written
+DATA_FORMATS = {f.value for f in BiblioSyntaxEnum if f != BiblioSyntaxEnum.MARKDOWN}
+
+# file name suffixes for compressed files, and how to open them; zst is handled by _open_zstd
+COMPRESSION_SUFFIXES = {
+    "gz": gzip.open,
+    "bz2": bz2.open,
+    "xz": lzma.open,
+    "zst": None,
+}
+
+# approximate size of the byte ranges parsed by each worker in load_csv_parallel_iter
+DEFAULT_CSV_CHUNK_BYTES = 16 * 1024 * 1024
+
 BIBM_MULTIVALUED_SEPARATOR_MAP = {
     "authors": "|",
     "urls": "|",
+    "provenance": "|",
 }
 
+# multivalued slots without a <slot>_verbatim slot for the unsplit value
+NO_VERBATIM_SLOTS = {"provenance"}
+
+# slots recording where an entry came from; left out of CSV output unless requested
+TRACKING_SLOTS = ["source_file", "provenance"]
+
 
 def inject_multivalued(entry: Dict[str, Any], separator_map: Dict[str, str] = None) -> Dict[str, Any]:
     """
@@ -52,7 +94,8 @@ def inject_multivalued(entry: Dict[str, Any], separator_map: Dict[str, str] = No
     entry = entry.copy()
     for key, sep in separator_map.items():
         if key in entry and entry.get(key, None) is not None and isinstance(entry.get(key), str):
-            entry[f"{key}_verbatim"] = entry[key]
+            if key not in NO_VERBATIM_SLOTS:
+                entry[f"{key}_verbatim"] = entry[key]
             vals = entry[key].split(sep)
             if vals == [""]:
                 vals = []
@@ -74,86 +117,518 @@ def load_file(*args, **kwargs) -> List[bibm.Entry]:
 
 
 def load_file_iter(
-    input_file: Union[str, Path, TextIO], format: str = None, schema: Union[str, BiblioSchemaEnum] = None
+    input_file: Union[str, Path, TextIO],
+    format: str = None,
+    schema: Union[str, BiblioSchemaEnum] = None,
+    trusted: bool = False,
+    lazy: bool = False,
+    engine: str = None,
 ) -> Iterator[bibm.Entry]:
     """
     Load a file.
 
     :param input_file:
     :param format:
+    :param trusted: if True, construct entries without validation, for input that is validated later
+                    (see :func:`bibliomancer.utilities.validate_entry_objects`)
+    :param lazy: if True, yield :class:`bibliomancer.lazy.LazyEntry` proxies that map and validate
+                 each field of the raw row when it is first read (CSV only)
+    :param engine: mapping engine for paperpile CSV, one of :data:`bibliomancer.mapper.MAPPING_ENGINES`
     :return:
     """
     if isinstance(input_file, Path):
         input_file = str(input_file)
     if format is None:
         file_name = input_file if isinstance(input_file, str) else input_file.name
-        format = file_name.split(".")[-1]
+        format = infer_format(file_name)
         logger.info(f"Inferring format {format} from file name {file_name}")
     if schema is None:
         schema = BiblioSchemaEnum.PAPERPILE
     if not isinstance(schema, BiblioSchemaEnum):
         schema = BiblioSchemaEnum(schema)
     if isinstance(input_file, str):
-        with open(input_file, "r") as stream:
-            yield from load_file_iter(stream, format=format, schema=schema)
+        with open_file(input_file, "r") as stream:
+            yield from load_file_iter(stream, format=format, schema=schema, trusted=trusted, lazy=lazy, engine=engine)
             return
+    if lazy and format != "csv":
+        raise ValueError(f"Lazy loading is not supported for format: {format}")
     if format == "csv":
+        if not lazy and _maps_by_column(schema, engine):
+            yield from load_paperpile_csv_iter(input_file, trusted=trusted)
+            return
         reader = csv.DictReader(input_file)
         if schema == BiblioSchemaEnum.PAPERPILE:
             mvmap = PAPERPILE_MULTIVALUED_SEPARATOR_MAP
         else:
             mvmap = BIBM_MULTIVALUED_SEPARATOR_MAP
-        for row in reader:
-            row = inject_multivalued(row, mvmap)
-            row = {k: v for k, v in row.items() if v is not None and v != ""}
-            if schema == BiblioSchemaEnum.PAPERPILE:
-                yield bibm.Entry(**map_entry(row, source_schema=schema))
-            else:
-                yield bibm.Entry(**row)
+        if lazy:
+            materialize = partial(csv_row_to_entry, schema=schema, trusted=trusted, engine=engine)
+            for row in reader:
+                yield LazyEntry(row, schema, mvmap, materialize)
+        else:
+            for row in reader:
+                yield csv_row_to_entry(row, schema, trusted, engine)
     elif format == "json":
         import json
 
         entries = json.load(input_file)
-        yield from as_entry_objects(entries)
+        yield from as_entry_objects(entries, trusted=trusted)
+    elif format == "jsonl":
+        yield from load_jsonl_iter(input_file, trusted=trusted)
     elif format == "yaml":
         import yaml
 
         entries = yaml.safe_load(input_file)
-        yield from as_entry_objects(entries)
+        yield from as_entry_objects(entries, trusted=trusted)
+    elif format == "bibtex":
+        from bibliomancer.bibtex import load_bibtex_iter
+
+        yield from load_bibtex_iter(input_file, trusted=trusted)
+    elif format == "ris":
+        from bibliomancer.ris import load_ris_iter
+
+        yield from load_ris_iter(input_file, trusted=trusted)
     else:
         raise ValueError(f"Unsupported format: {format}")
 
 
+def compression_suffix(file_name: str) -> Optional[str]:
+    """
+    Get the compression suffix of a file name, if any.
+
+    >>> compression_suffix("refs.csv.gz")
+    'gz'
+    >>> compression_suffix("refs.csv") is None
+    True
+
+    :param file_name:
+    :return: one of COMPRESSION_SUFFIXES, or None
+    """
+    suffix = str(file_name).split(".")[-1].lower()
+    return suffix if suffix in COMPRESSION_SUFFIXES else None
+
+
+def _open_zstd(path: str, mode: str):
+    try:
+        from compression import zstd  # Python 3.14+
+
+        return zstd.open(path, mode)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError("Reading or writing .zst files requires the zstandard package") from e
+    return zstandard.open(path, mode)
+
+
+def open_file(path: Union[str, Path], mode: str = "r") -> TextIO:
+    """
+    Open a file in text mode, compressing or decompressing according to its suffix.
+
+    Compressed files are streamed, without decompressing to a temporary file.
+
+    >>> import tempfile
+    >>> path = Path(tempfile.mkdtemp()) / "refs.jsonl.gz"
+    >>> with open_file(path, "w") as stream:
+    ...     _ = stream.write("{}")
+    >>> with open_file(path) as stream:
+    ...     stream.read()
+    '{}'
+
+    :param path:
+    :param mode: "r" or "w"
+    :return: text stream
+    """
+    compression = compression_suffix(path)
+    if compression is None:
+        return open(path, mode)
+    if compression == "zst":
+        return _open_zstd(str(path), f"{mode}t")
+    return COMPRESSION_SUFFIXES[compression](path, f"{mode}t")
+
+
+def infer_format(file_name: str) -> str:
+    """
+    Infer the format of a file from its name.
+
+    Compression suffixes are skipped.
+
+    >>> infer_format("refs.bib")
+    'bibtex'
+    >>> infer_format("refs.paperpile.csv")
+    'csv'
+    >>> infer_format("refs.jsonl.zst")
+    'jsonl'
+
+    :param file_name:
+    :return: format name
+    """
+    file_name = str(file_name)
+    if compression_suffix(file_name):
+        file_name = file_name.rsplit(".", 1)[0]
+    format = file_name.split(".")[-1]
+    format = FORMAT_SUFFIXES.get(format, format)
+    return format.value if isinstance(format, BiblioSyntaxEnum) else format
+
+
+def expand_input_paths(inputs: Union[str, Path, Iterable[Union[str, Path]]]) -> List[str]:
+    """
+    Expand a list of files, glob patterns and directories into a list of files.
+
+    Directories are expanded to the files directly within them whose format can be
+    inferred from the name. Globs and directories are expanded in sorted order.
+
+    :param inputs: a path, glob or directory, or a list of these
+    :return: list of file paths
+    """
+    import glob
+
+    if isinstance(inputs, (str, Path)):
+        inputs = [inputs]
+    paths = []
+    for input in inputs:
+        input = str(input)
+        if Path(input).is_dir():
+            paths.extend(
+                str(p) for p in sorted(Path(input).iterdir()) if p.is_file() and infer_format(p.name) in DATA_FORMATS
+            )
+        elif glob.has_magic(input):
+            matches = sorted(glob.glob(input))
+            if not matches:
+                logger.warning(f"No files match {input}")
+            paths.extend(matches)
+        else:
+            paths.append(input)
+    return paths
+
+
+def _load_tagged_file(args) -> List[bibm.Entry]:
+    path, format, schema, trusted, engine = args
+    entries = list(load_file_iter(path, format=format, schema=schema, trusted=trusted, engine=engine))
+    for entry in entries:
+        set_entry_value(entry, "source_file", path, trusted=trusted)
+    return entries
+
+
+def load_files_iter(
+    inputs: Union[str, Path, Iterable[Union[str, Path]]],
+    format: str = None,
+    schema: Union[str, BiblioSchemaEnum] = None,
+    jobs: int = None,
+    ordered: bool = True,
+    trusted: bool = False,
+    engine: str = None,
+) -> Iterator[bibm.Entry]:
+    """
+    Load entries from several files, tagging each with its source file.
+
+    Each file is parsed whole in a worker process, so memory use grows with the
+    size of the largest files being parsed at once, rather than the total.
+
+    :param inputs: files, glob patterns or directories (see :func:`expand_input_paths`)
+    :param format: format of all files; if not set, inferred from each file name
+    :param schema:
+    :param jobs: number of worker processes; if not set, files are loaded one after another in this process
+    :param ordered: if True, yield entries in file order; otherwise yield each file's entries as it finishes
+    :param trusted: if True, construct entries without validation
+    :param engine: mapping engine for paperpile CSV
+    :return:
+    """
+    paths = expand_input_paths(inputs)
+    tasks = ((path, format, schema, trusted, engine) for path in paths)
+    if not jobs:
+        results = map(_load_tagged_file, tasks)
+    elif ordered:
+        results = imap_ordered(_load_tagged_file, tasks, jobs)
+    else:
+        results = imap_unordered(_load_tagged_file, tasks, jobs)
+    for entries in results:
+        yield from entries
+
+
+def csv_row_to_entry(
+    row: Dict[str, str], schema: BiblioSchemaEnum, trusted: bool = False, engine: str = None
+) -> bibm.Entry:
+    """
+    Convert a raw CSV row to an Entry.
+
+    >>> csv_row_to_entry({"Title": "t1", "Item type": "Journal Article", "Authors": "Me M,You Y", "DOI": ""},
+    ...                  BiblioSchemaEnum.PAPERPILE).authors
+    ['Me M', 'You Y']
+
+    :param row: row from a DictReader
+    :param schema: schema of the CSV
+    :param trusted: if True, construct the entry without validation
+    :param engine: mapping engine for paperpile rows
+    :return:
+    """
+    if schema == BiblioSchemaEnum.PAPERPILE:
+        mvmap = PAPERPILE_MULTIVALUED_SEPARATOR_MAP
+    else:
+        mvmap = BIBM_MULTIVALUED_SEPARATOR_MAP
+    row = inject_multivalued(row, mvmap)
+    row = {k: v for k, v in row.items() if v is not None and v != ""}
+    if schema == BiblioSchemaEnum.PAPERPILE:
+        row = map_entry(row, source_schema=schema, engine=engine)
+    return construct_entry(row) if trusted else bibm.Entry(**row)
+
+
+def _maps_by_column(schema: BiblioSchemaEnum, engine: Optional[str]) -> bool:
+    return schema == BiblioSchemaEnum.PAPERPILE and engine in (None, PYTHON_ENGINE)
+
+
+def load_paperpile_csv_iter(
+    stream: TextIO,
+    trusted: bool = False,
+    fieldnames: List[str] = None,
+    block_size: int = DEFAULT_MAPPING_BATCH_SIZE,
+) -> Iterator[bibm.Entry]:
+    """
+    Load entries from a paperpile CSV, mapping blocks of rows a column at a time.
+
+    :param stream:
+    :param trusted: if True, construct entries without validation
+    :param fieldnames: column names; if not set, read from the first row
+    :param block_size: number of rows mapped together
+    :return:
+    """
+    reader = csv.reader(stream)
+    if fieldnames is None:
+        fieldnames = next(reader, None)
+        if fieldnames is None:
+            return
+    for block in chunked(reader, block_size):
+        yield from csv_block_to_entries(fieldnames, block, trusted)
+
+
+def csv_block_to_entries(fieldnames: List[str], rows: List[List[str]], trusted: bool = False) -> List[bibm.Entry]:
+    """
+    Convert a block of raw paperpile CSV rows to entries.
+
+    Multivalued columns are split and mapped with :func:`bibliomancer.mapper.map_columns`,
+    giving the same entries as :func:`csv_row_to_entry` on each row.
+
+    >>> block = [["Journal Article", "t1", "Me M,You Y"], ["Review", "t2", ""]]
+    >>> [e.authors for e in csv_block_to_entries(["Item type", "Title", "Authors"], block)]
+    [['Me M', 'You Y'], []]
+
+    :param fieldnames: column names
+    :param rows: rows from a csv reader; blank rows are skipped, and short rows are padded
+    :param trusted: if True, construct entries without validation
+    :return:
+    """
+    width = len(fieldnames)
+    rows = [row if len(row) == width else (row + [None] * width)[:width] for row in rows if row]
+    columns = dict(zip(fieldnames, zip(*rows)))
+    mapped = map_columns(columns, len(rows), BiblioSchemaEnum.PAPERPILE, PAPERPILE_MULTIVALUED_SEPARATOR_MAP)
+    slots = list(mapped)
+    make_entry = construct_entry if trusted else lambda obj: bibm.Entry(**obj)
+    return [make_entry({k: v for k, v in zip(slots, values) if v is not None}) for values in zip(*mapped.values())]
+
+
+def _next_record_boundary(data: bytes, pos: int, in_quotes: bool) -> int:
+    """
+    Find the start of the next CSV record at or after pos.
+
+    A newline ends a record only if it is outside quotes. Quote state is tracked by
+    parity: an escaped quote is written as two quotes, so does not change it.
+
+    >>> data = b'a,b\\n"x\\ny",z\\nc,d\\n'
+    >>> _next_record_boundary(data, 5, True)
+    12
+    >>> _next_record_boundary(data, 5, False)
+    7
+
+    :param data:
+    :param pos:
+    :param in_quotes: whether pos is inside a quoted field
+    :return: offset of the next record, or len(data) if there is none
+    """
+    while True:
+        newline = data.find(b"\n", pos)
+        if newline < 0:
+            return len(data)
+        # slices, as mmap has no count method; each slice is at most one record long
+        in_quotes ^= data[pos:newline].count(b'"') % 2 == 1
+        if not in_quotes:
+            return newline + 1
+        pos = newline + 1
+
+
+def csv_byte_ranges(data: bytes, start: int = 0, chunk_bytes: int = DEFAULT_CSV_CHUNK_BYTES) -> List[Tuple[int, int]]:
+    """
+    Split CSV data into byte ranges that each hold whole records.
+
+    Finding the boundaries only counts quotes and newlines, which is much faster than parsing.
+
+    >>> data = b'a,b\\n"x\\ny",z\\nc,d\\n'
+    >>> csv_byte_ranges(data, start=4, chunk_bytes=2)
+    [(4, 12), (12, 16)]
+
+    :param data: file contents, e.g. a memory map
+    :param start: offset of the first record
+    :param chunk_bytes: approximate size of each range
+    :return: list of (start, end) offsets
+    """
+    ranges = []
+    n = len(data)
+    while start < n:
+        target = min(start + chunk_bytes, n)
+        in_quotes = data[start:target].count(b'"') % 2 == 1
+        end = _next_record_boundary(data, target, in_quotes) if target < n else n
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def _parse_csv_range(args) -> List[bibm.Entry]:
+    import mmap
+
+    path, start, end, fieldnames, schema, trusted, engine = args
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        text = data[start:end].decode("utf-8")
+    if _maps_by_column(schema, engine):
+        return list(load_paperpile_csv_iter(StringIO(text, newline=""), trusted=trusted, fieldnames=fieldnames))
+    reader = csv.DictReader(StringIO(text, newline=""), fieldnames=fieldnames)
+    return [csv_row_to_entry(row, schema, trusted, engine) for row in reader]
+
+
+def load_csv_parallel_iter(
+    input_file: Union[str, Path],
+    schema: Union[str, BiblioSchemaEnum] = None,
+    jobs: int = None,
+    chunk_bytes: int = DEFAULT_CSV_CHUNK_BYTES,
+    trusted: bool = False,
+    engine: str = None,
+) -> Iterator[bibm.Entry]:
+    """
+    Load a single large CSV file, parsing byte ranges of it in parallel.
+
+    The file is memory-mapped and split into ranges on record boundaries,
+    taking account of newlines within quoted fields. Each range is parsed and
+    mapped in a worker process, and entries are yielded in file order.
+
+    :param input_file: path to a UTF-8 CSV file
+    :param schema:
+    :param jobs: number of worker processes; defaults to the number of CPUs
+    :param chunk_bytes: approximate size of the range parsed by each task
+    :param trusted: if True, construct entries without validation
+    :param engine: mapping engine for paperpile CSV
+    :return:
+    """
+    import mmap
+    import os
+
+    if schema is None:
+        schema = BiblioSchemaEnum.PAPERPILE
+    if not isinstance(schema, BiblioSchemaEnum):
+        schema = BiblioSchemaEnum(schema)
+    if jobs is None:
+        jobs = os.cpu_count()
+    input_file = str(input_file)
+    if compression_suffix(input_file):
+        raise ValueError(f"Cannot split a compressed file into byte ranges: {input_file}")
+    with open(input_file, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            header_end = _next_record_boundary(data, 0, False)
+            fieldnames = next(csv.reader(StringIO(data[:header_end].decode("utf-8-sig"), newline="")))
+            ranges = csv_byte_ranges(data, header_end, chunk_bytes)
+    tasks = ((input_file, start, end, fieldnames, schema, trusted, engine) for start, end in ranges)
+    for entries in imap_ordered(_parse_csv_range, tasks, jobs):
+        yield from entries
+
+
+def load_jsonl_iter(stream: TextIO, trusted: bool = False) -> Iterator[bibm.Entry]:
+    """
+    Load entries from JSON Lines, one line at a time.
+
+    >>> import io
+    >>> stream = io.StringIO('{"title": "t1"}\\n\\n{"title": "t2", "authors": ["A"]}\\n')
+    >>> [e.title for e in load_jsonl_iter(stream)]
+    ['t1', 't2']
+
+    :param stream:
+    :param trusted: if True, construct entries without validation
+    :return:
+    """
+    import json
+
+    make_entry = construct_entry if trusted else lambda obj: bibm.Entry(**obj)
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            obj = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON on line {line_number}: {e}") from e
+        yield make_entry(obj)
+
+
 def write_file(
-    entries: Union[Iterable[bibm.Entry], Dict],
+    entries: Union[Iterable[bibm.Entry], EntryTable, Dict],
     output_file: Union[str, TextIO, Path],
     format: Optional[FORMAT] = None,
     schema: Optional[BiblioSchemaEnum] = None,
+    streaming: bool = False,
+    include_slots: Optional[Iterable[str]] = None,
 ) -> None:
     """
     Write a set of entries to a file.
 
     :param entries:
-    :param output_file:
-    :param format:
+    :param output_file: stream or path; paths ending in a compression suffix are compressed
+    :param format: if not set, inferred from the file name, defaulting to CSV
+    :param streaming: if True, write CSV rows as entries are produced, with columns in Entry schema order
+    :param include_slots: slots in TRACKING_SLOTS to write as CSV columns; other formats always include them
     :return:
     """
     if isinstance(output_file, Path):
         output_file = str(output_file)
     if isinstance(output_file, str):
-        with open(output_file, "w") as stream:
-            write_file(entries, stream, format)
+        if format is None:
+            inferred = infer_format(output_file)
+            if inferred in DATA_FORMATS:
+                format = inferred
+        with open_file(output_file, "w") as stream:
+            write_file(entries, stream, format, streaming=streaming, include_slots=include_slots)
             return
     if format is None:
         format = BiblioSyntaxEnum.CSV
     if not isinstance(format, BiblioSyntaxEnum):
         format = BiblioSyntaxEnum(format)
+    if isinstance(entries, EntryTable):
+        # read rows directly from the columns, without creating Entry objects
+        exclude_none = format in [BiblioSyntaxEnum.JSONL, BiblioSyntaxEnum.BIBTEX, BiblioSyntaxEnum.RIS]
+        entries = entries.iter_dicts(exclude_none=exclude_none)
+    else:
+        entries = (e.to_entry() if isinstance(e, LazyEntry) else e for e in entries)
+    excluded = set(TRACKING_SLOTS) - set(include_slots or [])
+    if streaming and format == BiblioSyntaxEnum.CSV:
+        write_csv_iter(entries, output_file, fieldnames=[k for k in bibm.Entry.model_fields if k not in excluded])
+        return
+    if format == BiblioSyntaxEnum.JSONL:
+        write_jsonl_iter(entries, output_file)
+        return
+    if format == BiblioSyntaxEnum.BIBTEX:
+        from bibliomancer.bibtex import write_bibtex_iter
+
+        write_bibtex_iter(entries, output_file)
+        return
+    if format == BiblioSyntaxEnum.RIS:
+        from bibliomancer.ris import write_ris_iter
+
+        write_ris_iter(entries, output_file)
+        return
     entries = [e.model_dump() if isinstance(e, bibm.Entry) else e for e in entries]
     if format == BiblioSyntaxEnum.CSV:
         fieldnames = []
         for entry in entries:
-            fieldnames.extend([k for k in entry.keys() if k not in fieldnames])
-        writer = csv.DictWriter(output_file, fieldnames=fieldnames)
+            fieldnames.extend([k for k in entry.keys() if k not in fieldnames and k not in excluded])
+        writer = csv.DictWriter(output_file, fieldnames=fieldnames, extrasaction="ignore")
         writer.writeheader()
         for entry in entries:
             flatten_list(entry)
@@ -172,6 +647,80 @@ def write_file(
         raise Exception(f"Unsupported format: {format}")
 
 
+def write_csv_iter(
+    entries: Iterable[Union[bibm.Entry, Dict[str, Any]]],
+    stream: TextIO,
+    fieldnames: Optional[List[str]] = None,
+    list_delimiter="|",
+) -> int:
+    """
+    Write entries to CSV one row at a time.
+
+    Unlike the default CSV writer, columns are not collected from the entries
+    up front, so memory use does not grow with the number of entries.
+
+    >>> import io
+    >>> stream = io.StringIO()
+    >>> write_csv_iter([{"title": "t1", "authors": ["A", "B"]}], stream, fieldnames=["title", "authors", "doi"])
+    1
+    >>> stream.getvalue().splitlines()
+    ['title,authors,doi', 't1,A|B,']
+
+    Keys that are not in ``fieldnames`` are left out, as the header has already been
+    written by the time they are seen.
+
+    :param entries: Entry objects or dicts
+    :param stream:
+    :param fieldnames: columns to write; defaults to all slots of Entry, in schema order
+    :param list_delimiter:
+    :return: number of rows written
+    """
+    if fieldnames is None:
+        fieldnames = list(bibm.Entry.model_fields)
+    writer = csv.DictWriter(stream, fieldnames=fieldnames, extrasaction="ignore")
+    writer.writeheader()
+    n = 0
+    for entry in entries:
+        row = entry.model_dump() if isinstance(entry, bibm.Entry) else dict(entry)
+        flatten_list(row, list_delimiter)
+        writer.writerow(row)
+        n += 1
+    return n
+
+
+def write_jsonl_iter(entries: Iterable[Union[bibm.Entry, Dict[str, Any]]], stream: TextIO) -> int:
+    """
+    Write entries as JSON Lines, one line per entry as it is produced.
+
+    Slots set to None are omitted, for Entry objects and dicts alike. The output can be
+    appended to, and concatenated with other JSON Lines files.
+
+    >>> import io
+    >>> stream = io.StringIO()
+    >>> write_jsonl_iter([bibm.Entry(title="t1"), {"title": "t2", "doi": None}], stream)
+    2
+    >>> print(stream.getvalue(), end="")
+    {"title": "t1", "authors": [], "urls": [], "provenance": []}
+    {"title": "t2"}
+
+    :param entries: Entry objects or dicts
+    :param stream:
+    :return: number of entries written
+    """
+    import json
+
+    n = 0
+    for entry in entries:
+        if isinstance(entry, bibm.Entry):
+            obj = entry.model_dump(exclude_none=True)
+        else:
+            obj = {k: v for k, v in entry.items() if v is not None}
+        stream.write(json.dumps(obj))
+        stream.write("\n")
+        n += 1
+    return n
+
+
 def flatten_list(entry: dict, list_delimiter="|"):
     for key, value in entry.items():
         if isinstance(value, list):
@@ -0,0 +1,172 @@
+"""
+Lazy entries over raw CSV rows.
+
+A :class:`LazyEntry` wraps a row as read from a CSV file. Each slot is mapped
+from the row and validated the first time it is read, so a job that only looks
+at a few slots, such as deduplicating on ``doi`` or filtering on ``year``, does
+not pay for mapping and validating the others.
+
+Anything else, such as ``model_dump``, or assigning to a slot, converts the
+proxy to a full :class:`Entry`, which it then delegates to.
+"""
+
+import threading
+from typing import Any, Callable, Dict, Optional
+
+import bibliomancer.datamodel.biblio as bibm
+from bibliomancer.datamodel.enums import BiblioSchemaEnum
+from bibliomancer.mapper import MAPPINGS_FROM, make_local_id, normalize_type
+from bibliomancer.utilities import ENTRY_FIELDS, construct_entry
+
+_scratch = threading.local()
+
+
+def validate_field(name: str, value: Any) -> Any:
+    """
+    Validate a single slot value, as it would be validated on an Entry.
+
+    >>> validate_field("num_authors", "2")
+    2
+    >>> validate_field("type", "JournalArticle")
+    'JournalArticle'
+
+    :param name: slot name
+    :param value:
+    :return: the validated value
+    :raises pydantic.ValidationError:
+    """
+    entry = getattr(_scratch, "entry", None)
+    if entry is None:
+        entry = _scratch.entry = construct_entry({})
+    # validate_assignment checks just this slot, with the same validators and coercion as construction
+    setattr(entry, name, value)
+    return entry.__dict__[name]
+
+
+class LazyEntry:
+    """
+    A proxy for an Entry that maps and validates slots on demand.
+
+    >>> from bibliomancer.io import csv_row_to_entry
+    >>> from functools import partial
+    >>> row = {"Title": "My Paper", "Item type": "Journal Article", "Authors": "Me M,You Y", "Volume": "",
+    ...        "Issue": "1", "Pages": "1-2", "Publication year": "2020", "DOI": "10.1/x"}
+    >>> materialize = partial(csv_row_to_entry, schema=BiblioSchemaEnum.PAPERPILE)
+    >>> entry = LazyEntry(row, BiblioSchemaEnum.PAPERPILE, {"Authors": ","}, materialize)
+    >>> entry.doi, entry.authors, entry.local_id
+    ('10.1/x', ['Me M', 'You Y'], '2020(1):1-2')
+    >>> entry.is_materialized
+    False
+    >>> entry.to_entry() == materialize(row)
+    True
+    """
+
+    __slots__ = ("_row", "_schema", "_separators", "_materialize", "_values", "_entry")
+
+    def __init__(
+        self,
+        row: Dict[str, Optional[str]],
+        schema: BiblioSchemaEnum,
+        separator_map: Dict[str, str],
+        materialize: Callable[[Dict[str, Optional[str]]], bibm.Entry],
+    ):
+        """
+        Wrap a raw row.
+
+        :param row: row as read from the file
+        :param schema: schema of the row
+        :param separator_map: separators for multivalued columns
+        :param materialize: converts the row to a full Entry; must be picklable to use the proxy with a process pool
+        """
+        self._row = row
+        self._schema = schema
+        self._separators = separator_map
+        self._materialize = materialize
+        self._values = {}
+        self._entry = None
+
+    @property
+    def is_materialized(self) -> bool:
+        """True if the proxy has been converted to a full Entry."""
+        return self._entry is not None
+
+    def to_entry(self) -> bibm.Entry:
+        """
+        Convert to a full Entry, mapping and validating all slots.
+
+        The Entry is cached, and all further access goes to it.
+
+        :return:
+        """
+        if self._entry is None:
+            self._entry = self._materialize(self._row)
+            self._values = {}
+        return self._entry
+
+    def _raw(self, column: str) -> Any:
+        v = self._row.get(column, None)
+        if v is None or v == "":
+            return None
+        sep = self._separators.get(column, None)
+        if sep is not None:
+            return v.split(sep)
+        return v
+
+    def _map(self, name: str) -> Any:
+        """Map a single slot from the row, following :func:`bibliomancer.mapper.map_entry`."""
+        if self._schema != BiblioSchemaEnum.PAPERPILE:
+            return self._raw(name)
+        if name == "local_id":
+            return make_local_id(self.volume, self.issue, self.pages, self.year)
+        column = MAPPINGS_FROM[self._schema].get(name, None)
+        if column is None:
+            return None
+        if isinstance(column, list):
+            toks = [self._row.get(c, None) or None for c in column]
+            return " ".join([t for t in toks if t is not None]) or None
+        v = self._raw(column)
+        if name == "type":
+            if v is None:
+                raise ValueError(f"Missing type in entry: {self._row}")
+            return normalize_type(v)
+        return v
+
+    def __getattr__(self, name: str) -> Any:
+        # only called for names that are not slots of the proxy itself
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if self._entry is not None:
+            return getattr(self._entry, name)
+        if name in ENTRY_FIELDS:
+            values = self._values
+            if name not in values:
+                v = self._map(name)
+                field = bibm.Entry.model_fields[name]
+                if v is None and not field.is_required():
+                    v = field.get_default(call_default_factory=True)
+                values[name] = validate_field(name, v)
+            return values[name]
+        return getattr(self.to_entry(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name in LazyEntry.__slots__:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.to_entry(), name, value)
+
+    def __getstate__(self):
+        return {k: getattr(self, k) for k in LazyEntry.__slots__}
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            object.__setattr__(self, k, v)
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, LazyEntry):
+            other = other.to_entry()
+        return self.to_entry() == other
+
+    def __repr__(self) -> str:
+        if self._entry is not None:
+            return repr(self._entry)
+        return f"LazyEntry({self._row!r})"
@@ -5,22 +5,31 @@ TODO: Reuse more core LinkML features.
 """
 
 import logging
-from typing import Iterable, Iterator
+from typing import Iterable, Iterator, List, Sequence, Union
 
-from linkml_runtime import SchemaView
-
-from bibliomancer.datamodel import SCHEMA_PATH
 from bibliomancer.datamodel.biblio import Entry
-from bibliomancer.utilities import entry_unique_keys, index_entries
-
+from bibliomancer.entry_index import DiskEntryIndex, EntryIndex
+from bibliomancer.io import TRACKING_SLOTS
+from bibliomancer.utilities import set_entry_value
 
 logger = logging.getLogger(__name__)
 
+PROVENANCE_SLOT = "provenance"
+
 
-def merge_entries_from(target_entries: Iterable[Entry], source_entries: Iterable[Entry], cols=None, overwrite=True):
+def merge_entries_from(
+    target_entries: Iterable[Entry],
+    source_entries: Union[Iterable[Entry], EntryIndex, DiskEntryIndex],
+    cols=None,
+    overwrite=True,
+    trusted=False,
+):
     """
     Merge two lists of entries.
 
+    Entries are matched on any of their unique keys, after normalization (see
+    :func:`bibliomancer.entry_index.normalize_key_value`).
+
     >>> doi = "10.48550/2103.00001"
     >>> src = Entry(title="t1", doi=doi, journal="j1")
     >>> tgt = Entry(title="t1", doi=doi)
@@ -29,40 +38,115 @@ def merge_entries_from(target_entries: Iterable[Entry], source_entries: Iterable
     ('j1', '10.48550/2103.00001', 't1')
 
     :param target_entries:
-    :param source_entries:
+    :param source_entries: entries, or an index of them, e.g. one saved with :meth:`EntryIndex.from_file`
+    :param overwrite: if False, keep existing values in the target
+    :param trusted: if True, copy values without validating them on assignment
     :return:
     """
-    target_entries = list(target_entries)
-    source_entries = list(source_entries)
-    target_index = index_entries(target_entries)
-    source_index = index_entries(source_entries)
-    for unique_key, source_inner_index in source_index.items():
-        target_inner_index = target_index.get(unique_key, {})
-        if not target_inner_index:
-            # logger.warning(f"Key {unique_key} not found in target")
+    target_index = EntryIndex(target_entries)
+    if isinstance(source_entries, (EntryIndex, DiskEntryIndex)):
+        source_index = source_entries
+    else:
+        source_index = EntryIndex(source_entries)
+    for unique_key in source_index.unique_keys:
+        if unique_key not in target_index.unique_keys:
             continue
-        for tpl, source_entries in source_index.get(unique_key, {}).items():
-            if len(source_entries) > 1:
-                raise ValueError(
-                    f"Multiple entries with key {unique_key} = {tpl}" f"found in source: {len(source_entries)}"
+        for tpl, source_entry in source_index.items(unique_key):
+            target_entry = target_index.get(unique_key, tpl)
+            if target_entry is None:
+                continue
+            _merge_entry(target_entry, source_entry, unique_key, cols=cols, overwrite=overwrite, trusted=trusted)
+
+
+def merge_entries_iter(
+    target_entries: Iterable[Entry],
+    source_index: Union[EntryIndex, DiskEntryIndex, Sequence[Union[EntryIndex, DiskEntryIndex]]],
+    cols=None,
+    overwrite=True,
+    trusted=False,
+    source_names: Sequence[str] = None,
+) -> Iterator[Entry]:
+    """
+    Merge into entries as they are produced, yielding each once it is merged.
+
+    Each target entry is looked up in the source index by its unique keys, so only
+    the index needs to be held, e.g. in a file with :class:`DiskEntryIndex`. Unlike
+    :func:`merge_entries_from`, targets are not checked for duplicate keys.
+
+    >>> doi = "10.48550/2103.00001"
+    >>> source_index = EntryIndex([Entry(title="t1", doi=doi, journal="j1")])
+    >>> [e.journal for e in merge_entries_iter([Entry(title="t1", doi=doi), Entry(title="t2")], source_index)]
+    ['j1', None]
+
+    Several sources are merged in one pass, in order of priority, highest first. A slot
+    taken from one source is not overwritten by a later one. With source names, the source
+    of each slot is recorded in the provenance slot:
+
+    >>> curated = EntryIndex([Entry(title="t1", doi=doi, journal="j2")])
+    >>> [(e.journal, e.provenance) for e in merge_entries_iter(
+    ...     [Entry(title="t1", doi=doi)], [curated, source_index], source_names=["curated", "pp"])]
+    [('j2', ['journal=curated', 'title=curated'])]
+
+    :param target_entries:
+    :param source_index: an index, or several in order of priority
+    :param overwrite: if False, keep existing values in the target
+    :param trusted: if True, copy values without validating them on assignment
+    :param source_names: name of each source, for provenance
+    :return: iterator of the target entries, merged in place
+    """
+    source_indexes = [source_index] if isinstance(source_index, (EntryIndex, DiskEntryIndex)) else source_index
+    if source_names is not None and len(source_names) != len(source_indexes):
+        raise ValueError(f"Expected {len(source_indexes)} source names, got {len(source_names)}")
+    for target_entry in target_entries:
+        taken = set()
+        for i, ix in enumerate(source_indexes):
+            merged = set()
+            # match on the keys the target has before this source is merged into it
+            for unique_key, source_entry in list(ix.find(target_entry)):
+                merged.update(
+                    _merge_entry(
+                        target_entry,
+                        source_entry,
+                        unique_key,
+                        cols=cols,
+                        overwrite=overwrite,
+                        trusted=trusted,
+                        exclude=taken,
+                    )
                 )
-            source_entry = source_entries[0]
-            target_entries = target_inner_index.get(tpl, [])
-            if len(target_entries) > 1:
-                raise ValueError(f"Multiple entries with key {unique_key} found in target")
-            if target_entries:
-                target_entry = target_entries[0]
-                if cols:
-                    cols_to_copy = cols
-                else:
-                    cols_to_copy = [k for k in source_entry.model_fields if k not in unique_key]
-                for col in cols_to_copy:
-                    v = getattr(source_entry, col, None)
-                    if v is not None:
-                        curr_v = getattr(target_entry, col, None)
-                        if curr_v is not None:
-                            if curr_v != v:
-                                if not overwrite:
-                                    continue
-                                logger.info(f"Overwriting {col} in {target_entry} with {v}")
-                        setattr(target_entry, col, v)
+            if merged and source_names is not None:
+                _set_provenance(target_entry, merged, source_names[i], trusted=trusted)
+            taken.update(merged)
+        yield target_entry
+
+
+def _merge_entry(
+    target_entry: Entry, source_entry: Entry, unique_key, cols=None, overwrite=True, trusted=False, exclude=()
+) -> List[str]:
+    if cols:
+        cols_to_copy = cols
+    else:
+        # slots recording where each entry came from belong to the target, not the source
+        cols_to_copy = [k for k in type(source_entry).model_fields if k not in unique_key and k not in TRACKING_SLOTS]
+    merged = []
+    for col in cols_to_copy:
+        if col in exclude:
+            continue
+        v = getattr(source_entry, col, None)
+        # empty lists are the defaults of multivalued slots, not values
+        if v is not None and v != []:
+            curr_v = getattr(target_entry, col, None)
+            if curr_v is not None and curr_v != []:
+                if curr_v != v:
+                    if not overwrite:
+                        continue
+                    logger.info(f"Overwriting {col} in {target_entry} with {v}")
+            set_entry_value(target_entry, col, v, trusted=trusted)
+            merged.append(col)
+    return merged
+
+
+def _set_provenance(entry: Entry, cols: Iterable[str], source_name: str, trusted=False) -> None:
+    provenance = [p for p in entry.provenance or [] if p.split("=", 1)[0] not in cols]
+    provenance.extend(f"{col}={source_name}" for col in cols)
+    set_entry_value(entry, PROVENANCE_SLOT, sorted(provenance), trusted=trusted)
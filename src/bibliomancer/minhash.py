@@ -0,0 +1,205 @@
+"""
+Near-duplicate detection with MinHash and locality-sensitive hashing.
+
+Each text is normalized and split into overlapping character k-grams
+(shingles). A MinHash signature keeps, for each of ``num_perm`` hash
+functions, the smallest hash of any shingle; the fraction of positions where
+two signatures agree estimates the Jaccard similarity of their shingle sets.
+
+Comparing all pairs of signatures would be quadratic. Instead the signature
+is cut into bands of rows, and texts whose signatures agree on every row of
+any one band land in the same bucket and become candidate pairs (LSH). Only
+candidates are compared, so the work grows with the number of texts plus the
+number of candidates. Bands and rows are chosen so that a pair at the
+similarity threshold becomes a candidate with high probability.
+
+All hashing is vectorized with numpy, in blocks of texts.
+"""
+
+import logging
+import re
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NUM_PERM = 64
+DEFAULT_SHINGLE_SIZE = 5
+DEFAULT_THRESHOLD = 0.8
+
+# maximum number of members of an LSH bucket that are compared pairwise
+MAX_BUCKET_SIZE = 100
+
+_NON_ALNUM = re.compile(r"[\W_]+")
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize text for shingling: lowercase, with runs of punctuation and whitespace as a single space.
+
+    >>> normalize_text("  Billion-scale Detection of {Isomorphic} Nodes. ")
+    'billion scale detection of isomorphic nodes'
+
+    :param text:
+    :return:
+    """
+    return _NON_ALNUM.sub(" ", text.lower()).strip()
+
+
+def _shingle_values(texts: Sequence[str], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the k-gram values of each text, concatenated.
+
+    :return: tuple of (values, index of each text's first value)
+    """
+    if not 0 < k <= 8:
+        raise ValueError(f"Shingle size must be between 1 and 8 bytes: {k}")
+    # texts shorter than k are padded, so every text has at least one shingle
+    encoded = [t.encode("utf-8").ljust(k) for t in texts]
+    lengths = np.array([len(e) for e in encoded], dtype=np.int64)
+    counts = lengths - k + 1
+    text_starts = np.cumsum(lengths) - lengths
+    shingle_starts = np.cumsum(counts) - counts
+    positions = np.arange(counts.sum()) + np.repeat(text_starts - shingle_starts, counts)
+    buf = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint64)
+    values = np.zeros(len(positions), dtype=np.uint64)
+    for j in range(k):
+        values |= buf[positions + j] << np.uint64(8 * j)
+    return values * _MIX, shingle_starts
+
+
+def minhash_signatures(
+    texts: Sequence[str],
+    num_perm: int = DEFAULT_NUM_PERM,
+    k: int = DEFAULT_SHINGLE_SIZE,
+    seed: int = 1,
+    block_size: int = 1000,
+) -> np.ndarray:
+    """
+    Compute MinHash signatures of normalized texts.
+
+    >>> sigs = minhash_signatures(["the quick brown fox", "the quick brown fox!", "something else"], num_perm=32)
+    >>> sigs.shape
+    (32, 3)
+    >>> float((sigs[:, 0] == sigs[:, 1]).mean()), float((sigs[:, 0] == sigs[:, 2]).mean()) < 0.2
+    (1.0, True)
+
+    :param texts: texts to compare; these are normalized with :func:`normalize_text`
+    :param num_perm: number of hash functions
+    :param k: shingle size in bytes
+    :param seed: seed for the hash functions
+    :param block_size: number of texts hashed together
+    :return: array of shape (num_perm, number of texts)
+    """
+    rng = np.random.default_rng(seed)
+    # multiply-shift hashing, with odd multipliers
+    a = rng.integers(0, 2**63, size=(num_perm, 1), dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 2**63, size=(num_perm, 1), dtype=np.uint64)
+    signatures = np.empty((num_perm, len(texts)), dtype=np.uint32)
+    for i in range(0, len(texts), block_size):
+        block = [normalize_text(t) for t in texts[i : i + block_size]]
+        values, starts = _shingle_values(block, k)
+        hashes = ((a * values[np.newaxis, :] + b) >> np.uint64(32)).astype(np.uint32)
+        signatures[:, i : i + len(block)] = np.minimum.reduceat(hashes, starts, axis=1)
+    return signatures
+
+
+def lsh_parameters(threshold: float, num_perm: int = DEFAULT_NUM_PERM, recall: float = 0.95) -> Tuple[int, int]:
+    """
+    Choose the number of bands and rows per band for a similarity threshold.
+
+    This uses the most rows per band (the fewest candidates) for which a pair
+    with exactly the threshold similarity is still a candidate with the given probability.
+
+    >>> lsh_parameters(0.8, 64)
+    (10, 6)
+
+    :param threshold: Jaccard similarity
+    :param num_perm: signature length
+    :param recall: minimum probability that a pair at the threshold is a candidate
+    :return: tuple of (bands, rows)
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        if 1 - (1 - threshold**rows) ** bands >= recall:
+            best = (bands, rows)
+    return best
+
+
+def candidate_pairs(
+    signatures: np.ndarray, bands: int, rows: int, max_bucket_size: int = MAX_BUCKET_SIZE
+) -> np.ndarray:
+    """
+    Find pairs of signatures that agree on all rows of at least one band.
+
+    Buckets with more than ``max_bucket_size`` members (usually many copies of
+    the same text) are not compared pairwise; instead each member is paired
+    with the first, so the number of pairs stays linear.
+
+    :param signatures: array of shape (num_perm, n)
+    :param bands:
+    :param rows:
+    :param max_bucket_size:
+    :return: array of shape (number of pairs, 2), each pair (i, j) with i < j, without repeats
+    """
+    n = signatures.shape[1]
+    pairs: List[np.ndarray] = []
+    for band in range(bands):
+        keys = np.zeros(n, dtype=np.uint64)
+        for row in signatures[band * rows : (band + 1) * rows]:
+            keys = (keys ^ row.astype(np.uint64)) * _MIX
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        boundaries = np.flatnonzero(np.diff(sorted_keys)) + 1
+        group_starts = np.concatenate([[0], boundaries])
+        group_sizes = np.diff(np.concatenate([group_starts, [n]]))
+        for start, size in zip(group_starts[group_sizes > 1], group_sizes[group_sizes > 1]):
+            members = np.sort(order[start : start + size])
+            if size > max_bucket_size:
+                logger.info(f"Comparing {size} members of an LSH bucket to the first only")
+                pairs.append(np.stack([np.full(size - 1, members[0]), members[1:]], axis=1))
+            else:
+                i, j = np.triu_indices(size, 1)
+                pairs.append(np.stack([members[i], members[j]], axis=1))
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.unique(np.concatenate(pairs), axis=0)
+
+
+def near_duplicate_pairs(
+    texts: Sequence[Optional[str]],
+    threshold: float = DEFAULT_THRESHOLD,
+    num_perm: int = DEFAULT_NUM_PERM,
+    k: int = DEFAULT_SHINGLE_SIZE,
+) -> Iterator[Tuple[int, int, float]]:
+    """
+    Find pairs of texts whose estimated Jaccard similarity is at least the threshold.
+
+    >>> titles = ["Structured prompt interrogation and recursive extraction of semantics (SPIRES)",
+    ...           "Structured Prompt Interrogation and Recursive Extraction of Semantics (SPIRES): a method",
+    ...           "The FlyBase database", None, "?", "..."]
+    >>> [(i, j) for i, j, _ in near_duplicate_pairs(titles, threshold=0.7)]
+    [(0, 1)]
+
+    :param texts: texts, such as titles; None, and texts that are empty once normalized, are skipped
+    :param threshold: minimum estimated Jaccard similarity of the shingle sets
+    :param num_perm: signature length; longer signatures give more accurate estimates
+    :param k: shingle size
+    :return: iterator of (index, index, estimated similarity), ordered by the first index
+    """
+    # texts without any letters or digits would all be padded to the same shingle
+    indexes = np.array([i for i, t in enumerate(texts) if t and normalize_text(t)], dtype=np.int64)
+    if len(indexes) < 2:
+        return
+    signatures = minhash_signatures([texts[i] for i in indexes], num_perm=num_perm, k=k)
+    bands, rows = lsh_parameters(threshold, num_perm)
+    pairs = candidate_pairs(signatures, bands, rows)
+    logger.info(f"Comparing {len(pairs)} candidate pairs of {len(indexes)} texts")
+    for start in range(0, len(pairs), 100000):
+        chunk = pairs[start : start + 100000]
+        similarities = (signatures[:, chunk[:, 0]] == signatures[:, chunk[:, 1]]).mean(axis=0)
+        for (i, j), similarity in zip(chunk[similarities >= threshold], similarities[similarities >= threshold]):
+            yield int(indexes[i]), int(indexes[j]), float(similarity)
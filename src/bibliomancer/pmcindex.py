@@ -0,0 +1,206 @@
+"""
+Offline index over the NCBI PMC-ids mapping file.
+
+NCBI publishes the mapping between PMCIDs, PMIDs and DOIs for every article in PMC
+as a single CSV (https://ftp.ncbi.nlm.nih.gov/pub/pmc/PMC-ids.csv.gz). :func:`build_index`
+converts this into sorted fixed-width arrays, which are memory-mapped by :class:`PMCIndex`
+and searched with binary search. This allows identifiers to be resolved without any
+network access.
+
+DOIs are stored as 64-bit hashes of their lowercased form, so a DOI that is not in the
+index has a very small chance of matching another DOI's entry.
+"""
+
+import csv
+import gzip
+import hashlib
+import json
+import logging
+import os
+from array import array
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PMID_INDEX = "pmid.npy"
+PMID_TO_PMCID = "pmid_pmcid.npy"
+PMCID_INDEX = "pmcid.npy"
+PMCID_TO_PMID = "pmcid_pmid.npy"
+DOI_INDEX = "doi.npy"
+DOI_TO_PMID = "doi_pmid.npy"
+DOI_TO_PMCID = "doi_pmcid.npy"
+METADATA = "index.json"
+
+
+def doi_hash(doi: str) -> int:
+    """
+    Hash a DOI to a 64-bit integer, ignoring case.
+
+    >>> doi_hash("10.1093/nar/gky1105") == doi_hash("10.1093/NAR/GKY1105")
+    True
+
+    :param doi:
+    :return:
+    """
+    return int.from_bytes(hashlib.blake2b(doi.strip().lower().encode(), digest_size=8).digest(), "little")
+
+
+def _as_int(id: Optional[Union[str, int]], prefix: str = "") -> int:
+    if id is None:
+        return 0
+    id = str(id).strip()
+    if prefix and id.upper().startswith(prefix):
+        id = id[len(prefix) :]
+    return int(id) if id.isdigit() else 0
+
+
+def _save_sorted(directory: Path, keys: np.ndarray, values: Dict[str, np.ndarray], key_file: str) -> None:
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    np.save(directory / key_file, keys)
+    for file_name, vals in values.items():
+        np.save(directory / file_name, vals[order])
+
+
+def build_index(input_file: Union[str, Path], directory: Union[str, Path]) -> "PMCIndex":
+    """
+    Build an index from the PMC-ids CSV.
+
+    :param input_file: path to PMC-ids.csv, optionally gzipped
+    :param directory: directory in which to write the index
+    :return: the new index
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    pmids = array("Q")
+    pmcids = array("Q")
+    dois = array("Q")
+    opener = gzip.open if str(input_file).endswith(".gz") else open
+    with opener(input_file, "rt", newline="") as stream:
+        for row in csv.DictReader(stream):
+            pmcid = _as_int(row.get("PMCID", None), "PMC")
+            if not pmcid:
+                continue
+            pmids.append(_as_int(row.get("PMID", None)))
+            pmcids.append(pmcid)
+            doi = row.get("DOI", None)
+            dois.append(doi_hash(doi) if doi else 0)
+    pmids = np.frombuffer(pmids, dtype=np.uint64)
+    pmcids = np.frombuffer(pmcids, dtype=np.uint64)
+    dois = np.frombuffer(dois, dtype=np.uint64)
+    has_pmid = pmids > 0
+    _save_sorted(directory, pmids[has_pmid], {PMID_TO_PMCID: pmcids[has_pmid]}, PMID_INDEX)
+    _save_sorted(directory, pmcids, {PMCID_TO_PMID: pmids}, PMCID_INDEX)
+    has_doi = dois > 0
+    _save_sorted(directory, dois[has_doi], {DOI_TO_PMID: pmids[has_doi], DOI_TO_PMCID: pmcids[has_doi]}, DOI_INDEX)
+    with open(directory / METADATA, "w") as stream:
+        json.dump({"source": str(input_file), "num_records": len(pmcids)}, stream)
+    logger.info(f"Indexed {len(pmcids)} records from {input_file} in {directory}")
+    return PMCIndex(directory)
+
+
+class PMCIndex:
+    """
+    Memory-mapped lookup over an index built by :func:`build_index`.
+
+    >>> import tempfile
+    >>> from pathlib import Path
+    >>> tmp = Path(tempfile.mkdtemp())
+    >>> _ = (tmp / "PMC-ids.csv").write_text("PMCID,PMID,DOI\\nPMC6324074,30476213,10.1093/nar/gky1105\\n")
+    >>> index = build_index(tmp / "PMC-ids.csv", tmp / "index")
+    >>> index.pmid_to_pmc("30476213")
+    'PMC6324074'
+    >>> index.pmc_to_pmid("PMC6324074")
+    '30476213'
+    >>> index.doi_to_ids("10.1093/NAR/GKY1105")
+    {'pmid': '30476213', 'pmcid': 'PMC6324074'}
+    >>> index.pmid_to_pmc("1") is None
+    True
+    """
+
+    def __init__(self, directory: Union[str, Path]):
+        directory = Path(directory)
+        self.directory = directory
+
+        def _load(file_name):
+            return np.load(directory / file_name, mmap_mode="r")
+
+        self.pmids = _load(PMID_INDEX)
+        self.pmid_pmcids = _load(PMID_TO_PMCID)
+        self.pmcids = _load(PMCID_INDEX)
+        self.pmcid_pmids = _load(PMCID_TO_PMID)
+        self.dois = _load(DOI_INDEX)
+        self.doi_pmids = _load(DOI_TO_PMID)
+        self.doi_pmcids = _load(DOI_TO_PMCID)
+
+    @staticmethod
+    def _find(keys: np.ndarray, key: int) -> Optional[int]:
+        if not key:
+            return None
+        i = int(np.searchsorted(keys, np.uint64(key)))
+        if i < len(keys) and keys[i] == key:
+            return i
+        return None
+
+    def pmid_to_pmc(self, pmid: Union[str, int]) -> Optional[str]:
+        """
+        Convert a PMID to a PMCID.
+
+        :param pmid:
+        :return: PMCID, or None if the PMID is not in PMC
+        """
+        i = self._find(self.pmids, _as_int(pmid))
+        return None if i is None else f"PMC{self.pmid_pmcids[i]}"
+
+    def pmids_to_pmcs(self, pmids: Iterable[str]) -> Dict[str, Optional[str]]:
+        """
+        Convert a collection of PMIDs to PMCIDs.
+
+        Every PMID is included in the result; those not in PMC map to None.
+
+        :param pmids:
+        :return:
+        """
+        return {str(pmid): self.pmid_to_pmc(pmid) for pmid in pmids}
+
+    def pmc_to_pmid(self, pmcid: str) -> Optional[str]:
+        """
+        Convert a PMCID to a PMID.
+
+        :param pmcid:
+        :return: PMID, or None if unknown or the article has no PMID
+        """
+        i = self._find(self.pmcids, _as_int(pmcid, "PMC"))
+        if i is None or not self.pmcid_pmids[i]:
+            return None
+        return str(self.pmcid_pmids[i])
+
+    def doi_to_ids(self, doi: str) -> Optional[Dict[str, Optional[str]]]:
+        """
+        Look up the PMID and PMCID for a DOI.
+
+        :param doi:
+        :return: dict with pmid and pmcid keys, or None if the DOI is not in PMC
+        """
+        i = self._find(self.dois, doi_hash(doi))
+        if i is None:
+            return None
+        pmid = self.doi_pmids[i]
+        return {"pmid": str(pmid) if pmid else None, "pmcid": f"PMC{self.doi_pmcids[i]}"}
+
+
+@lru_cache
+def get_pmc_index() -> Optional[PMCIndex]:
+    """
+    Get the offline index configured with the BIBLIOMANCER_PMC_INDEX environment variable.
+
+    :return: the index, or None if not configured
+    """
+    directory = os.environ.get("BIBLIOMANCER_PMC_INDEX", None)
+    if not directory:
+        return None
+    return PMCIndex(directory)
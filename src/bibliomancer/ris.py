@@ -0,0 +1,216 @@
+"""
+RIS loader and writer.
+
+RIS is line-oriented, so records are parsed one line at a time and yielded
+as soon as their ER tag is read.
+"""
+
+import logging
+import re
+from typing import Any, Dict, Iterable, Iterator, List, TextIO, Union
+
+import bibliomancer.datamodel.biblio as bibm
+from bibliomancer.bibtex import normalize_author
+from bibliomancer.utilities import construct_entry
+
+logger = logging.getLogger(__name__)
+
+RIS_TYPE_MAP = {
+    "JOUR": "JournalArticle",
+    "JFULL": "Journal",
+    "CONF": "ConferencePaper",
+    "CPAPER": "ConferencePaper",
+    "CHAP": "BookChapter",
+    "BOOK": "Book",
+    "THES": "Dissertation",
+    "RPRT": "Report",
+    "UNPB": "Preprint",
+    "DATA": "Dataset",
+    "COMP": "Software",
+    "VIDEO": "Audiovisual",
+    "STAND": "Standard",
+    "NEWS": "News",
+    "GEN": "Other",
+}
+
+ENTRY_TYPE_MAP = {v: k for k, v in reversed(list(RIS_TYPE_MAP.items()))}
+
+# RIS tags that map directly to single-valued Entry slots; where several tags map to a slot, the first is used
+TAG_MAP = {
+    "TI": "title",
+    "T1": "title",
+    "JO": "journal",
+    "JF": "journal",
+    "VL": "volume",
+    "IS": "issue",
+    "DO": "doi",
+}
+
+_TAG_LINE = re.compile(r"^([A-Z][A-Z0-9])  -(?: (.*))?$")
+_YEAR = re.compile(r"\d{4}")
+# RIS has no tag for arXiv IDs, so they are written as accession numbers with this prefix
+_ARXIV_ACCESSION = re.compile(r"^arxiv:\s*(\S+)$", re.IGNORECASE)
+
+
+def parse_ris_iter(stream: TextIO) -> Iterator[Dict[str, List[str]]]:
+    """
+    Parse RIS into records, mapping each tag to its list of values.
+
+    Lines without a tag are treated as continuations of the previous value.
+
+    >>> import io
+    >>> text = "TY  - JOUR\\nAU  - Doe, J\\nAU  - Roe, R\\nTI  - A long\\n  title\\nER  - \\n"
+    >>> list(parse_ris_iter(io.StringIO(text)))
+    [{'TY': ['JOUR'], 'AU': ['Doe, J', 'Roe, R'], 'TI': ['A long title']}]
+
+    :param stream:
+    :return:
+    """
+    record = None
+    last_tag = None
+    for line in stream:
+        line = line.rstrip("\r\n").lstrip("\ufeff")
+        m = _TAG_LINE.match(line)
+        if not m:
+            if record is not None and last_tag and line.strip():
+                record[last_tag][-1] = f"{record[last_tag][-1]} {line.strip()}"
+            continue
+        tag, value = m.group(1), (m.group(2) or "").strip()
+        if tag == "TY":
+            record = {}
+        elif record is None:
+            logger.warning(f"Ignoring {tag} outside of a record")
+            continue
+        if tag == "ER":
+            yield record
+            record = None
+            last_tag = None
+            continue
+        record.setdefault(tag, []).append(value)
+        last_tag = tag
+    if record is not None:
+        raise ValueError(f"Unterminated RIS record: {record}")
+
+
+def ris_to_entry(record: Dict[str, List[str]]) -> Dict[str, Any]:
+    """
+    Map a parsed RIS record to a BIBM entry dict.
+
+    >>> ris_to_entry({"TY": ["CONF"], "T1": ["T"], "T2": ["Proc"], "PY": ["2020/01/02"], "SP": ["1"], "EP": ["2"]})
+    {'type': 'ConferencePaper', 'title': 'T', 'year': '2020', 'pages': '1-2', 'conference_proceedings': 'Proc'}
+    >>> ris_to_entry({"TY": ["UNPB"], "TI": ["T"], "AN": ["PMC123", "arXiv:2304.02711"]})
+    {'type': 'Preprint', 'title': 'T', 'arxiv_id': '2304.02711'}
+
+    :param record:
+    :return:
+    """
+    entry = {"type": RIS_TYPE_MAP.get(record.get("TY", [""])[0], "Other")}
+    for tag, slot in TAG_MAP.items():
+        if tag in record and slot not in entry:
+            entry[slot] = record[tag][0]
+    for tag in ["PY", "Y1", "DA"]:
+        if tag in record:
+            m = _YEAR.search(record[tag][0])
+            if m:
+                entry["year"] = m.group()
+                break
+    if "SP" in record:
+        entry["pages"] = "-".join([record["SP"][0]] + record.get("EP", [])[:1])
+    if "T2" in record:
+        slot = "conference_proceedings" if entry["type"] == "ConferencePaper" else "journal"
+        entry.setdefault(slot, record["T2"][0])
+    authors = [a for tag in ["AU", "A1"] for a in record.get(tag, [])]
+    if authors:
+        entry["authors"] = [normalize_author(a) for a in authors]
+    if "UR" in record:
+        entry["urls"] = record["UR"]
+    for accession in record.get("AN", []):
+        m = _ARXIV_ACCESSION.match(accession)
+        if m:
+            entry["arxiv_id"] = m.group(1)
+            break
+    return {k: v for k, v in entry.items() if v}
+
+
+def load_ris_iter(stream: TextIO, trusted: bool = False) -> Iterator[bibm.Entry]:
+    """
+    Load entries from RIS.
+
+    >>> import io
+    >>> list(load_ris_iter(io.StringIO("TY  - JOUR\\nID  - r1\\nPY  - 2020\\nER  - \\n")))  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    ValueError: Invalid RIS record 1 (ID r1): ...
+
+    :param stream:
+    :param trusted: if True, construct entries without validation
+    :return:
+    :raises ValueError: if a record is not valid, naming its position and any ID
+    """
+    for n, record in enumerate(parse_ris_iter(stream), start=1):
+        obj = ris_to_entry(record)
+        if trusted:
+            yield construct_entry(obj)
+            continue
+        try:
+            yield bibm.Entry(**obj)
+        except ValueError as e:
+            record_id = f" (ID {record['ID'][0]})" if record.get("ID", None) else ""
+            raise ValueError(f"Invalid RIS record {n}{record_id}: {e}") from e
+
+
+def _format_author(name: str) -> str:
+    parts = name.rsplit(" ", 1)
+    if len(parts) == 2 and parts[1].isupper():
+        return f"{parts[0]}, {parts[1]}"
+    return name
+
+
+def write_ris_iter(entries: Iterable[Union[bibm.Entry, Dict[str, Any]]], stream: TextIO) -> int:
+    """
+    Write entries as RIS, one record at a time.
+
+    >>> import io
+    >>> stream = io.StringIO()
+    >>> _ = write_ris_iter([bibm.Entry(type="JournalArticle", title="T", authors=["Doe J"], pages="1-2")], stream)
+    >>> print(stream.getvalue(), end="")  # doctest: +NORMALIZE_WHITESPACE
+    TY  - JOUR
+    AU  - Doe, J
+    TI  - T
+    SP  - 1
+    EP  - 2
+    ER  -
+
+    :param entries: Entry objects or dicts
+    :param stream:
+    :return: number of entries written
+    """
+    n = 0
+    for entry in entries:
+        if isinstance(entry, bibm.Entry):
+            entry = entry.model_dump(exclude_none=True)
+        lines = [("TY", ENTRY_TYPE_MAP.get(entry.get("type", None), "GEN"))]
+        lines.extend(("AU", _format_author(a)) for a in entry.get("authors", None) or [])
+        lines.append(("TI", entry["title"]))
+        if entry.get("journal", None):
+            lines.append(("JO", entry["journal"]))
+        if entry.get("conference_proceedings", None):
+            lines.append(("T2", entry["conference_proceedings"]))
+        for tag, slot in [("PY", "year"), ("VL", "volume"), ("IS", "issue")]:
+            if entry.get(slot, None):
+                lines.append((tag, entry[slot]))
+        if entry.get("pages", None):
+            pages = entry["pages"].split("-", 1)
+            lines.append(("SP", pages[0]))
+            if len(pages) > 1:
+                lines.append(("EP", pages[1]))
+        if entry.get("doi", None):
+            lines.append(("DO", entry["doi"]))
+        if entry.get("arxiv_id", None):
+            lines.append(("AN", f"arXiv:{entry['arxiv_id']}"))
+        lines.extend(("UR", url) for url in entry.get("urls", None) or [])
+        for tag, value in lines:
+            stream.write(f"{tag}  - {value}\n")
+        stream.write("ER  - \n")
+        n += 1
+    return n
@@ -3,16 +3,201 @@ General utilities for bibliomancer.
 """
 
 import re
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from functools import lru_cache
-from typing import Tuple, List, Dict, Union, Iterable
+from typing import Any, Callable, Tuple, List, Dict, Union, Iterable, Iterator, Optional
 
 from linkml_runtime import SchemaView
+from pydantic import TypeAdapter
 
 from bibliomancer.datamodel import SCHEMA_PATH
 from bibliomancer.datamodel.biblio import Entry
 
 
+def chunked(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """
+    Split an iterable into lists of at most ``size`` items.
+
+    >>> list(chunked(["1", "2", "3"], 2))
+    [['1', '2'], ['3']]
+
+    :param items:
+    :param size: maximum number of items per chunk
+    :return:
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def imap_ordered(
+    func: Callable, items: Iterable[Any], jobs: int, initializer: Optional[Callable] = None, window: int = None
+) -> Iterator[Any]:
+    """
+    Map a function over items in a process pool, yielding results in input order.
+
+    Unlike ``Executor.map``, items are submitted lazily: at most ``window`` items are
+    in flight at once, so memory stays bounded for long input streams.
+
+    >>> list(imap_ordered(abs, [-1, 2, -3], jobs=2))
+    [1, 2, 3]
+
+    :param func: picklable function of one argument
+    :param items:
+    :param jobs: number of worker processes
+    :param initializer: called once in each worker on startup
+    :param window: maximum number of items in flight; defaults to twice the number of jobs
+    :return: iterator over results
+    """
+    if window is None:
+        window = 2 * jobs
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initializer) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def imap_unordered(
+    func: Callable, items: Iterable[Any], jobs: int, initializer: Optional[Callable] = None, window: int = None
+) -> Iterator[Any]:
+    """
+    Map a function over items in a process pool, yielding results as they complete.
+
+    Like :func:`imap_ordered`, at most ``window`` items are in flight at once.
+
+    >>> sorted(imap_unordered(abs, [-1, 2, -3], jobs=2))
+    [1, 2, 3]
+
+    :param func: picklable function of one argument
+    :param items:
+    :param jobs: number of worker processes
+    :param initializer: called once in each worker on startup
+    :param window: maximum number of items in flight; defaults to twice the number of jobs
+    :return: iterator over results
+    """
+    if window is None:
+        window = 2 * jobs
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initializer) as executor:
+        pending = set()
+        for item in items:
+            pending.add(executor.submit(func, item))
+            if len(pending) >= window:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+# characters with a special meaning in a regex; a query with none of these matches only itself
+_REGEX_SYNTAX = re.compile(r"[.\\^$|?*+()\[\]{}]")
+
+
+def is_author_regex(query: str) -> bool:
+    """
+    Check if an author query uses regex syntax, rather than being a plain name.
+
+    A period is regex syntax, so ``Reese J.`` matches ``Reese JT``.
+
+    >>> is_author_regex("Mungall CJ")
+    False
+    >>> is_author_regex("Caufield JH?")
+    True
+    >>> is_author_regex("Reese J.")
+    True
+
+    :param query:
+    :return:
+    """
+    return _REGEX_SYNTAX.search(query) is not None
+
+
+class AuthorMatcher:
+    """
+    Match author names against many queries at once.
+
+    Each query is an exact name or a regex, as for :func:`author_matches`.
+    Plain names (see :func:`is_author_regex`) are kept in a set (or, for partial
+    matches, a tuple of prefixes); regexes without groups are combined into a
+    single compiled regex. Matching an author is then a set lookup plus one regex
+    match, however many queries there are. Regexes with groups are compiled
+    separately, so that their backreferences keep their numbering.
+
+    >>> matcher = AuthorMatcher(["Mungall CJ", "Caufield JH?", "Reese J."])
+    >>> [matcher.matches(a) for a in ["Mungall CJ", "Caufield J", "Reese JT", "Mungall C"]]
+    [True, True, True, False]
+    >>> AuthorMatcher(["Mungall C"], partial=True).matches("Mungall CJ")
+    True
+    """
+
+    def __init__(self, queries: Iterable[str], partial=False):
+        """
+        Compile queries.
+
+        :param queries: author names, or regexes
+        :param partial: if True, queries match the start of an author name; otherwise the whole name
+        :raises re.error: if a query is not a valid regex
+        """
+        self.queries = tuple(queries)
+        self.partial = partial
+        self.exact = frozenset(self.queries)
+        self.prefixes = tuple(q for q in self.queries if not is_author_regex(q)) if partial else ()
+        combined = []
+        compiled = []
+        for q in self.queries:
+            if is_author_regex(q):
+                pattern = re.compile(q)
+                if pattern.groups:
+                    compiled.append(pattern)
+                else:
+                    combined.append(q)
+        if combined:
+            compiled.insert(0, re.compile("|".join(f"(?:{q})" for q in combined)))
+        self.patterns = tuple(p.match if partial else p.fullmatch for p in compiled)
+
+    def matches(self, author: str) -> bool:
+        """
+        Check if an author matches any query.
+
+        :param author:
+        :return:
+        """
+        if author in self.exact:
+            return True
+        if self.prefixes and author.startswith(self.prefixes):
+            return True
+        return any(pattern(author) is not None for pattern in self.patterns)
+
+    __call__ = matches
+
+    def __reduce__(self):
+        return AuthorMatcher, (self.queries, self.partial)
+
+
+@lru_cache(maxsize=256)
+def author_matcher(queries: Tuple[str, ...], partial=False) -> AuthorMatcher:
+    """
+    Get a compiled matcher for a tuple of author queries, reusing it for the same queries.
+
+    :param queries:
+    :param partial:
+    :return:
+    """
+    return AuthorMatcher(queries, partial=partial)
+
+
 def author_matches(author: str, query: str, partial=False) -> bool:
     """
     Check if an author matches a query.
@@ -33,13 +218,7 @@ def author_matches(author: str, query: str, partial=False) -> bool:
     :param partial: If True, allow partial matches.
     :return:
     """
-    if query == author:
-        return True
-    if not partial:
-        query = "^" + query + "$"
-    if re.match(query, author):
-        return True
-    return False
+    return author_matcher((query,), partial).matches(author)
 
 
 @lru_cache
@@ -67,16 +246,123 @@ def entry_unique_keys() -> List[Tuple[str]]:
     return keys
 
 
-def as_entry_objects(entries: Iterable[Union[dict, Entry]]) -> List[Entry]:
+def as_entry_objects(entries: Iterable[Union[dict, Entry]], trusted=False) -> List[Entry]:
     """
     Convert a list of dicts to Entry objects.
 
     :param entries:
+    :param trusted: if True, construct entries without validation (see :func:`construct_entry`)
     :return:
     """
+    if trusted:
+        return [construct_entry(e) if isinstance(e, dict) else e for e in entries]
     return [Entry(**e) if isinstance(e, dict) else e for e in entries]
 
 
+ENTRY_FIELDS = frozenset(Entry.model_fields)
+
+
+@lru_cache
+def _entry_defaults() -> Tuple[Dict[str, Any], Dict[str, Callable]]:
+    """Default values and default factories of the optional Entry fields."""
+    defaults = {}
+    factories = {}
+    for name, field in Entry.model_fields.items():
+        if field.default_factory is not None:
+            factories[name] = field.default_factory
+        elif not field.is_required():
+            defaults[name] = field.default
+    return defaults, factories
+
+
+def construct_entry(obj: Dict[str, Any]) -> Entry:
+    """
+    Construct an Entry from trusted data, without validation.
+
+    This is much faster than ``Entry(**obj)``, but values are stored as given, e.g.
+    a CSV value for an integer slot stays a string, and a missing title is not
+    reported. Use :func:`validate_entry_objects` to validate the entries afterwards.
+    Unknown fields are still rejected, as model construction would silently drop them.
+
+    Defaults are filled in before calling ``Entry.model_construct``, as it would
+    otherwise inspect each default factory on every call.
+
+    >>> e = construct_entry({"title": "t1", "num_authors": "2"})
+    >>> e.num_authors, e.authors
+    ('2', [])
+    >>> validate_entry_objects([e])[0].num_authors
+    2
+
+    :param obj:
+    :return:
+    """
+    if not ENTRY_FIELDS.issuperset(obj):
+        raise ValueError(f"Unknown fields for Entry: {sorted(set(obj) - ENTRY_FIELDS)}")
+    defaults, factories = _entry_defaults()
+    values = defaults.copy()
+    for name, factory in factories.items():
+        if name not in obj:
+            values[name] = factory()
+    values.update(obj)
+    return Entry.model_construct(_fields_set=set(obj), **values)
+
+
+def set_entry_value(entry: Entry, field: str, value: Any, trusted=False) -> None:
+    """
+    Set a value on an entry.
+
+    Entry validates on assignment; with ``trusted``, the value is stored as given, as
+    in :func:`construct_entry`, and is left to :func:`validate_entry_objects`.
+
+    >>> e = Entry(title="t1")
+    >>> set_entry_value(e, "num_authors", "2", trusted=True)
+    >>> e.num_authors, "num_authors" in e.model_fields_set
+    ('2', True)
+
+    :param entry:
+    :param field:
+    :param value:
+    :param trusted: if True, bypass validation on assignment
+    :return:
+    """
+    if trusted:
+        if field not in ENTRY_FIELDS:
+            raise ValueError(f"Unknown field for Entry: {field}")
+        entry.__dict__[field] = value
+        entry.__pydantic_fields_set__.add(field)
+    else:
+        setattr(entry, field, value)
+
+
+@lru_cache
+def _entry_list_adapter() -> TypeAdapter:
+    return TypeAdapter(List[Entry])
+
+
+def validate_entry_objects(entries: Iterable[Union[dict, Entry]]) -> List[Entry]:
+    """
+    Validate a collection of entries in a single batch.
+
+    This is the counterpart to :func:`construct_entry`; entries are validated in one
+    call rather than one at a time. Unlike :func:`bibliomancer.validator.validate_entries_iter`,
+    this checks only the pydantic model, and does not look for duplicates.
+
+    >>> validate_entry_objects([{"title": "t1"}, construct_entry({"title": "t2"})])[1].title
+    't2'
+    >>> validate_entry_objects([construct_entry({"num_authors": "x"})])
+    Traceback (most recent call last):
+    ...
+    pydantic_core._pydantic_core.ValidationError: 2 validation errors for list[Entry]
+    ...
+
+    :param entries: Entry objects or dicts
+    :return: new, validated Entry objects, in the same order
+    :raises pydantic.ValidationError: listing the errors for all invalid entries, by position
+    """
+    data = [{k: getattr(e, k) for k in e.model_fields_set} if isinstance(e, Entry) else e for e in entries]
+    return _entry_list_adapter().validate_python(data)
+
+
 def index_entries(entries: List[Union[dict, Entry]], strict=True) -> Dict[Tuple, Dict[Tuple, List[Entry]]]:
     """
     Index entries by keys.
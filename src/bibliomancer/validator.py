@@ -4,12 +4,14 @@ Validator for bibliomancer entries.
 TODO: make this a LinkML plugin
 """
 
-from typing import Iterable, Dict, Any, Iterator, Union
+from typing import Iterable, Dict, Any, Iterator, Optional, Union
 
 from linkml.validator import Validator, JsonschemaValidationPlugin
 from linkml.validator.report import ValidationResult, Severity
 
 from bibliomancer.datamodel import biblio as bibm, SCHEMA_PATH
+from bibliomancer.datamodel.entry_table import EntryTable
+from bibliomancer.lazy import LazyEntry
 from bibliomancer.utilities import entry_unique_keys
 
 UNIQUE_KEYS = [
@@ -24,7 +26,11 @@ UNIQUE_KEYS = [
 
 
 def validate_entries_iter(
-    entries: Iterable[Union[bibm.Entry, Dict[str, Any]]], report_fields=None, partial=False, make_title_unique=True
+    entries: Union[Iterable[Union[bibm.Entry, Dict[str, Any]]], EntryTable],
+    report_fields=None,
+    partial=False,
+    make_title_unique=True,
+    near_duplicate_threshold: Optional[float] = None,
 ) -> Iterator[ValidationResult]:
     """
     Validate a list of entries.
@@ -43,17 +49,33 @@ def validate_entries_iter(
     ...  print(err.message)
     'title' is a required property...
 
+    Titles that differ slightly, e.g. between preprint and published versions, are only
+    reported if a near-duplicate threshold is set:
+
+    >>> entries = [{'title': 'The FlyBase database'}, {'title': 'The FlyBase Database.'}]
+    >>> for err in validate_entries_iter(entries, partial=True, near_duplicate_threshold=0.8):
+    ...  print(err.severity.value, err.message)
+    WARN Near-duplicate titles (similarity 1.00): 'The FlyBase database', 'The FlyBase Database.'
+
 
     :param entries:
     :param report_fields:
     :param partial:
     :param make_title_unique:
+    :param near_duplicate_threshold: if set, also report pairs of entries whose titles have at least this
+                                     estimated Jaccard similarity, found with MinHash/LSH
+                                     (see :mod:`bibliomancer.minhash`)
     :return:
     """
     validation_plugins = [JsonschemaValidationPlugin(closed=True)]
     validator = Validator(SCHEMA_PATH, validation_plugins=validation_plugins)
     # convert to dicts
-    entries = [entry.model_dump(exclude_none=True) if isinstance(entry, bibm.Entry) else entry for entry in entries]
+    if isinstance(entries, EntryTable):
+        entries = entries.iter_dicts(exclude_none=True)
+    entries = [
+        entry.model_dump(exclude_none=True) if isinstance(entry, (bibm.Entry, LazyEntry)) else entry
+        for entry in entries
+    ]
     if not partial:
         for entry in entries:
             for error in validator.iter_results(entry, target_class="Entry"):
@@ -63,7 +85,8 @@ def validate_entries_iter(
     def _err(msg: str):
         yield ValidationResult(message=msg, type="bespoke", severity=Severity.ERROR)
 
-    unique_keys = entry_unique_keys()
+    # copy, as the cached list is shared
+    unique_keys = list(entry_unique_keys())
     if make_title_unique:
         unique_keys.append(("title",))
     for key_tuple in unique_keys:
@@ -89,6 +112,19 @@ def validate_entries_iter(
                     msg += f" ({', '.join(entry.get(field, '') for field in report_fields)})"
                 yield from _err(msg)
             values.add(value)
+    if near_duplicate_threshold is not None:
+        from bibliomancer.minhash import near_duplicate_pairs
+
+        titles = [entry.get("title", None) for entry in entries]
+        for i, j, similarity in near_duplicate_pairs(titles, threshold=near_duplicate_threshold):
+            if make_title_unique and titles[i] == titles[j]:
+                # already reported as a duplicate
+                continue
+            msg = f"Near-duplicate titles (similarity {similarity:.2f}): {titles[i]!r}, {titles[j]!r}"
+            if report_fields:
+                details = [", ".join(str(entries[n].get(field, "")) for field in report_fields) for n in (i, j)]
+                msg += f" ({'; '.join(details)})"
+            yield ValidationResult(message=msg, type="bespoke", severity=Severity.WARN)
     for entry in entries:
         # TODO: replace with a rule
         if entry.get("type", None) == "JournalArticle":
@@ -1,8 +1,94 @@
 import pytest
 from click.testing import CliRunner
 
+from bibliomancer import eutils
+from bibliomancer.idstore import IdentifierStore, get_identifier_store
+
 
 @pytest.fixture
 def runner() -> CliRunner:
     runner = CliRunner()
     return runner
+
+
+@pytest.fixture(autouse=True)
+def identifier_store_path(tmp_path, monkeypatch):
+    """Keep the identifier store of each test in its own temporary directory."""
+    path = tmp_path / "ids.sqlite"
+    monkeypatch.setenv("BIBLIOMANCER_IDSTORE", str(path))
+    get_identifier_store.cache_clear()
+    yield path
+    get_identifier_store.cache_clear()
+
+
+@pytest.fixture
+def store(identifier_store_path) -> IdentifierStore:
+    """The identifier store used by eutils in this test."""
+    return get_identifier_store()
+
+
+class MockResponse:
+    """Minimal stand-in for a requests response."""
+
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+        self.headers = {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError(f"HTTP {self.status_code}")
+
+    def json(self):
+        return self.data
+
+
+class MockSession:
+    """Mimics the ID converter; even PMIDs have a PMCID, and any request containing PMID 13 fails."""
+
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url, params=None):
+        ids = params["ids"].split(",")
+        self.requests.append(ids)
+        if "13" in ids:
+            return MockResponse({}, status_code=500)
+        records = [{"pmid": id, "pmcid": f"PMC{id}"} if int(id) % 2 == 0 else {"pmid": id} for id in ids]
+        return MockResponse({"records": records})
+
+
+class FlakySession(MockSession):
+    """Answers 429 to the first request for each chunk."""
+
+    def __init__(self):
+        super().__init__()
+        self.seen = set()
+
+    def get(self, url, params=None):
+        if params["ids"] not in self.seen:
+            self.seen.add(params["ids"])
+            self.requests.append(params["ids"].split(","))
+            return MockResponse({}, status_code=429)
+        return super().get(url, params=params)
+
+
+@pytest.fixture
+def session(monkeypatch) -> MockSession:
+    """A mock ID converter session, used by the synchronous eutils functions."""
+    session = MockSession()
+    monkeypatch.setattr(eutils, "get_session", lambda: session)
+    return session
+
+
+@pytest.fixture
+def flaky_session() -> FlakySession:
+    """A mock ID converter session that throttles the first request for each chunk."""
+    return FlakySession()
+
+
+@pytest.fixture
+def async_client(flaky_session) -> eutils.AsyncEutilsClient:
+    """An async client over the flaky session, with a fast rate limit and backoff."""
+    limiter = eutils.TokenBucket(rate=1000)
+    return eutils.AsyncEutilsClient(session=flaky_session, limiter=limiter, backoff=0.001, max_retries=2)
@@ -0,0 +1,171 @@
+"""Tests for the author index."""
+
+import io
+import os
+
+import pytest
+
+from bibliomancer.author_index import AuthorIndex, default_index_path
+from bibliomancer.cli import main
+from bibliomancer.datamodel.enums import BiblioSchemaEnum
+from bibliomancer.enricher import annotate_author_position
+from bibliomancer.formatter import generate_markdown
+from bibliomancer.io import load_file_iter, write_file
+from bibliomancer.utilities import as_entry_objects, author_matches
+from tests import INPUT_DIR
+
+ENTRIES = [
+    {"title": "t1", "authors": ["Reese JT", "Doe J", "Mungall, C.J."]},
+    {"title": "t2", "authors": ["Reese J"]},
+    {"title": "t3"},
+]
+
+
+@pytest.mark.parametrize(
+    "query,partial,expected",
+    [
+        ("Mungall CJ", False, [("t1", 3)]),
+        ("mungall, cj", False, [("t1", 3)]),
+        ("Mungall, C.J.", False, [("t1", 3)]),
+        ("Reese J.", False, [("t1", 1)]),
+        ("Mungall C", False, []),
+        ("Mungall C", True, [("t1", 3)]),
+        ("Reese J", False, [("t2", 1)]),
+        ("Reese J", True, [("t1", 1), ("t2", 1)]),
+        ("Reese JT?", False, [("t1", 1), ("t2", 1)]),
+        ("Nobody N", True, []),
+    ],
+)
+def test_matches(query, partial, expected):
+    """
+    Tests finding the entries and positions of an author.
+
+    :param query:
+    :param partial:
+    :param expected: list of (title, position)
+    :return:
+    """
+    ix = AuthorIndex(as_entry_objects(ENTRIES))
+    assert [(e.title, position) for e, position in ix.matches(query, partial=partial)] == expected
+
+
+@pytest.mark.parametrize("query", ["Reese J.", "Reese J\\.", "Mungall, C.J.", "Mungall, C.", "Doe J.?", "R.*"])
+@pytest.mark.parametrize("partial", [False, True])
+def test_matches_scan_parity(query, partial):
+    """
+    Tests that the index and a scan with author_matches agree on queries with periods.
+
+    :param query:
+    :param partial:
+    :return:
+    """
+    entries = as_entry_objects(ENTRIES)
+    scanned = []
+    for e in entries:
+        positions = [i for i, a in enumerate(e.authors or [], 1) if author_matches(a, query, partial=partial)]
+        if positions:
+            scanned.append((e.title, max(positions)))
+    assert [(e.title, position) for e, position in AuthorIndex(entries).matches(query, partial=partial)] == scanned
+
+
+def test_add_remove_update():
+    """
+    Tests that adding, removing and updating entries keeps the index consistent.
+
+    :return:
+    """
+    e1, e2 = as_entry_objects([{"title": "t1", "authors": ["Doe J", "Roe R"]}, {"title": "t2", "authors": ["Roe R"]}])
+    ix = AuthorIndex([e1])
+    ix.add(e2)
+    assert len(ix) == 2 and e2 in ix
+    with pytest.raises(ValueError):
+        ix.add(e2)
+    assert ix.entries_for("Roe R") == [e1, e2]
+    e1.authors = ["Roe R", "Moe M"]
+    ix.update(e1)
+    assert ix.matches("Roe R") == [(e1, 1), (e2, 1)]
+    assert ix.entries_for("Doe J") == []
+    ix.remove(e2)
+    assert ix.entries_for("Roe R") == [e1]
+    with pytest.raises(KeyError):
+        ix.remove(e2)
+    # names that are no longer used are not found by prefix
+    ix.remove(e1)
+    assert ix.entries_for("R", partial=True) == []
+
+
+@pytest.mark.parametrize("query", ["Mungall CJ", "Reese JT?", "Reese J.", "Bader"])
+def test_annotate_parity(query):
+    """
+    Tests that annotating through the index gives the same results as a scan, for the matching entries.
+
+    :param query:
+    :return:
+    """
+    entries = list(load_file_iter(INPUT_DIR / "test.paperpile.csv"))
+    scanned = [e for e in annotate_author_position(entries, query) if "position" in e]
+    assert list(annotate_author_position(AuthorIndex(entries), query)) == scanned
+
+
+def test_save_load_from_file(tmp_path):
+    """
+    Tests that an index saved next to a bibliography is reused until the bibliography changes.
+
+    :param tmp_path:
+    :return:
+    """
+    master = tmp_path / "master.bibm.jsonl"
+    entries = list(load_file_iter(INPUT_DIR / "test.paperpile.csv"))
+    write_file(entries, master)
+    ix = AuthorIndex.from_file(master, schema=BiblioSchemaEnum.BIBM)
+    index_path = default_index_path(master)
+    mtime = os.stat(index_path).st_mtime_ns
+    # an unchanged file reuses the saved index
+    ix2 = AuthorIndex.from_file(master, schema=BiblioSchemaEnum.BIBM)
+    assert os.stat(index_path).st_mtime_ns == mtime
+    assert list(ix2) == list(ix)
+    assert [(e.title, p) for e, p in ix2.matches("Mungall CJ")] == [(e.title, p) for e, p in ix.matches("Mungall CJ")]
+    # a loaded index can be updated like any other
+    e = ix2.entries_for("Mungall CJ")[0]
+    e.authors = e.authors[:-1]
+    ix2.update(e)
+    assert ix2.entries_for("Mungall CJ") == []
+    # a changed file is indexed again
+    write_file(entries[:1], master)
+    os.utime(master, ns=(mtime + 10**9, mtime + 10**9))
+    ix3 = AuthorIndex.from_file(master, schema=BiblioSchemaEnum.BIBM)
+    assert len(ix3) == 1
+
+
+def test_generate_markdown():
+    """
+    Tests generating markdown for an author from an index.
+
+    :return:
+    """
+    ix = AuthorIndex(load_file_iter(INPUT_DIR / "test.paperpile.csv"))
+    stream = io.StringIO()
+    generate_markdown(ix, stream, authors=["Mungall C"])
+    text = stream.getvalue()
+    assert "**Mungall CJ**" in text
+    assert "Billion-scale" not in text
+
+
+def test_cli_export(runner, tmp_path):
+    """
+    Tests exporting the entries of an author with --author-index.
+
+    :param runner:
+    :param tmp_path:
+    :return:
+    """
+    master = tmp_path / "master.bibm.jsonl"
+    write_file(list(load_file_iter(INPUT_DIR / "test.paperpile.csv")), master)
+    output = tmp_path / "cv.csv"
+    args = ["export", "-i", str(master), "-s", "BIBM", "-o", output, "-a", "Mungall CJ"]
+    result = runner.invoke(main, args + ["--annotate-position", "--author-index"])
+    assert result.exit_code == 0, result.output
+    assert os.path.exists(default_index_path(master))
+    text = output.read_text()
+    assert "SPIRES" in text and "senior" in text
+    assert "Billion-scale" not in text
@@ -16,6 +16,21 @@ def test_help(runner):
     assert "repair" in result.output
 
 
+def test_missing_input(runner, tmp_path):
+    """
+    Tests that a missing input is rejected before the output is opened.
+
+    :param runner:
+    :param tmp_path:
+    :return:
+    """
+    output_file = tmp_path / "out.csv"
+    result = runner.invoke(main, ["export", "-i", str(tmp_path / "nonexistent.csv"), "-o", str(output_file)])
+    assert result.exit_code == 2
+    assert "does not exist" in result.output
+    assert not output_file.exists()
+
+
 def test_cli_repair(runner):
     """
     Tests repair command
@@ -47,8 +62,42 @@ TEST_OUT_MD = OUTPUT_DIR / "test.md"
     [
         ("repair", ["--help"], [], True, None, "repair"),
         ("repair", ["-i", TEST_PAPERPILE_INPUT, "-o", TEST_OUT_CSV], [], True, TEST_OUT_CSV, "10.48550/2304.02711"),
+        (
+            "repair",
+            ["-i", TEST_PAPERPILE_INPUT, "-o", TEST_OUT_CSV, "--jobs", "2"],
+            [],
+            True,
+            TEST_OUT_CSV,
+            "10.48550/2304.02711",
+        ),
         ("export", ["-i", TEST_PAPERPILE_INPUT, "-o", TEST_OUT_CSV], [], True, TEST_OUT_CSV, "Fontana T|Reese J"),
+        (
+            "export",
+            ["-i", TEST_PAPERPILE_INPUT, "-o", TEST_OUT_CSV, "--repair", "--jobs", "2"],
+            [],
+            True,
+            TEST_OUT_CSV,
+            "10.48550/2304.02711",
+        ),
         ("export", ["-i", TEST_PAPERPILE_INPUT, "-o", TEST_OUT_JSON, "-O", "json"], [], True, TEST_OUT_JSON, "SPIRES"),
+        (
+            "export",
+            [
+                "-i",
+                TEST_PAPERPILE_INPUT,
+                "-i",
+                INPUT_DIR / "hpo.paperpile.csv",
+                "-o",
+                TEST_OUT_CSV,
+                "--jobs",
+                "2",
+                "--source-file",
+            ],
+            [],
+            True,
+            TEST_OUT_CSV,
+            "hpo.paperpile.csv",
+        ),
         (
             "export",
             ["-i", TEST_PAPERPILE_INPUT, "-o", TEST_OUT_MD, "-O", "markdown"],
@@ -0,0 +1,240 @@
+"""Tests for the entry index."""
+
+import os
+
+import pytest
+
+from bibliomancer.cli import main
+from bibliomancer.datamodel.enums import BiblioSchemaEnum
+from bibliomancer.entry_index import DiskEntryIndex, EntryIndex
+from bibliomancer.io import load_file_iter, write_file
+from bibliomancer.mergeutil import merge_entries_from, merge_entries_iter
+from bibliomancer.utilities import as_entry_objects
+from tests import INPUT_DIR
+
+DOI1 = "10.48550/arXiv.2103.00001"
+DOI2 = "10.48550/arXiv.2103.00002"
+
+
+@pytest.mark.parametrize(
+    "unique_key,value,expected",
+    [
+        ("doi", DOI1, "t1"),
+        ("doi", DOI1.upper(), "t1"),
+        ("doi", f"https://doi.org/{DOI1}/", "t1"),
+        ("doi", f"doi:{DOI2}", "t2"),
+        ("pmcid", "123", "t2"),
+        ("pmcid", "pmc123", "t2"),
+        ("pmid", "123", None),
+        (("type", "title"), ("JournalArticle", " t1 "), "t1"),
+    ],
+)
+def test_lookup(unique_key, value, expected):
+    """
+    Tests looking up entries by unique key, with normalized values.
+
+    :param unique_key:
+    :param value:
+    :param expected: title of the entry found, or None
+    :return:
+    """
+    entries = as_entry_objects(
+        [
+            {"title": "t1", "doi": DOI1, "type": "JournalArticle"},
+            {"title": "t2", "doi": DOI2, "pmcid": "PMC123"},
+        ]
+    )
+    ix = EntryIndex(entries)
+    entry = ix.get(unique_key, value)
+    assert (entry.title if entry else None) == expected
+
+
+def test_add_remove_update():
+    """
+    Tests that adding, removing and updating entries keeps the keys consistent.
+
+    :return:
+    """
+    e1, e2 = as_entry_objects([{"title": "t1", "doi": DOI1}, {"title": "t2", "pmid": "1"}])
+    ix = EntryIndex([e1])
+    ix.add(e2)
+    assert len(ix) == 2 and e2 in ix
+    with pytest.raises(ValueError):
+        ix.add(as_entry_objects([{"title": "t3", "doi": DOI1.lower()}])[0])
+    e2.doi = DOI1
+    with pytest.raises(ValueError):
+        ix.update(e2)
+    # the old keys are kept when an update fails
+    assert ix.get("pmid", "1") is e2
+    e2.doi = DOI2
+    e2.pmid = None
+    ix.update(e2)
+    assert ix.get("doi", DOI2) is e2
+    assert ix.get("pmid", "1") is None
+    assert [m for _, m in ix.find(as_entry_objects([{"title": "x", "doi": DOI2}])[0])] == [e2]
+    ix.remove(e1)
+    assert ix.get("doi", DOI1) is None
+    assert list(ix) == [e2]
+    with pytest.raises(KeyError):
+        ix.remove(e1)
+    # an entry with a freed key can be added again
+    ix.add(e1)
+    assert ix.get("doi", DOI1) is e1
+
+
+def test_save_load(tmp_path):
+    """
+    Tests that a saved index loads with the same entries and keys.
+
+    :param tmp_path:
+    :return:
+    """
+    entries = list(load_file_iter(INPUT_DIR / "test.paperpile.csv"))
+    ix = EntryIndex(entries)
+    path = tmp_path / "index.sqlite"
+    ix.save(path)
+    ix2 = EntryIndex.load(path)
+    assert list(ix2) == entries
+    for unique_key in ix.unique_keys:
+        assert [(v, e.title) for v, e in ix.items(unique_key)] == [(v, e.title) for v, e in ix2.items(unique_key)]
+    e = entries[0]
+    assert ix2.get("doi", e.doi.upper()) == e
+    # a loaded index can be updated like any other
+    ix2.remove(ix2.get("doi", e.doi))
+    assert len(ix2) == len(entries) - 1
+
+
+def test_from_file_and_merge(tmp_path):
+    """
+    Tests that an index saved for a file is reused while the file is unchanged, and merged from.
+
+    :param tmp_path:
+    :return:
+    """
+    master = tmp_path / "master.bibm.jsonl"
+    entries = list(load_file_iter(INPUT_DIR / "test.paperpile.csv"))
+    write_file([e.model_copy(update={"journal": "J"}) for e in entries], master)
+    index_path = tmp_path / "master.index.sqlite"
+    ix = EntryIndex.from_file(master, index_path, schema=BiblioSchemaEnum.BIBM)
+    mtime = os.stat(index_path).st_mtime_ns
+    # an unchanged master file reuses the saved index
+    ix2 = EntryIndex.from_file(master, index_path, schema=BiblioSchemaEnum.BIBM)
+    assert os.stat(index_path).st_mtime_ns == mtime
+    assert list(ix2) == list(ix)
+    targets = as_entry_objects([{"title": e.title, "doi": e.doi.upper()} for e in entries if e.doi])
+    assert targets
+    merge_entries_from(targets, ix2, cols=["journal"])
+    assert [t.journal for t in targets] == ["J"] * len(targets)
+    # a changed master file is indexed again
+    write_file(entries[:1], master)
+    os.utime(master, ns=(mtime + 10**9, mtime + 10**9))
+    ix3 = EntryIndex.from_file(master, index_path, schema=BiblioSchemaEnum.BIBM)
+    assert len(ix3) == 1
+
+
+def test_disk_index(tmp_path):
+    """
+    Tests that an on-disk index gives the same results as an in-memory one.
+
+    :param tmp_path:
+    :return:
+    """
+    entries = list(load_file_iter(INPUT_DIR / "test.paperpile.csv"))
+    path = tmp_path / "index.sqlite"
+    ix = EntryIndex(entries)
+    with DiskEntryIndex.build(path, entries) as disk_ix:
+        assert len(disk_ix) == len(entries)
+        assert list(disk_ix) == entries
+        for unique_key in ix.unique_keys:
+            assert list(disk_ix.items(unique_key)) == list(ix.items(unique_key))
+        e = entries[0]
+        assert disk_ix.get("doi", e.doi.upper()) == e
+        assert disk_ix.get("doi", "10.1/none") is None
+        assert list(disk_ix.find(e)) == list(ix.find(e))
+    # files saved by either class can be opened by the other
+    ix.save(path)
+    with DiskEntryIndex(path) as disk_ix:
+        assert disk_ix.get(("type", "title"), (entries[1].type, entries[1].title)) == entries[1]
+    with pytest.raises(ValueError):
+        DiskEntryIndex.build(path, entries + entries[:1])
+    assert not os.path.exists(path)
+    with DiskEntryIndex.build(path, entries + entries[:1], strict=False) as disk_ix:
+        assert len(disk_ix) == len(entries) + 1
+
+
+@pytest.mark.parametrize("trusted", [False, True])
+def test_merge_stream(runner, tmp_path, trusted):
+    """
+    Tests that a streaming merge gives the same results as merging in memory.
+
+    :param runner:
+    :param tmp_path:
+    :param trusted:
+    :return:
+    """
+    entries = list(load_file_iter(INPUT_DIR / "test.paperpile.csv"))
+    source = tmp_path / "source.bibm.jsonl"
+    write_file([e.model_copy(update={"journal": "J"}) for e in entries], source)
+    target = tmp_path / "target.bibm.jsonl"
+    write_file(entries + as_entry_objects([{"title": "other"}]), target)
+    expected = list(load_file_iter(target, schema=BiblioSchemaEnum.BIBM))
+    merge_entries_from(expected, load_file_iter(source, schema=BiblioSchemaEnum.BIBM), cols=["journal"])
+    with DiskEntryIndex.from_file(source, tmp_path / "source.index.sqlite", schema=BiblioSchemaEnum.BIBM) as ix:
+        merged = list(merge_entries_iter(load_file_iter(target, schema=BiblioSchemaEnum.BIBM), ix, cols=["journal"]))
+    assert merged == expected
+    assert [e.journal for e in merged] == ["J", "J", None]
+    output = tmp_path / "merged.bibm.jsonl"
+    args = ["merge", "-i", str(target), "-s", "BIBM", "-m", str(source), "-o", str(output), "--stream"]
+    result = runner.invoke(main, args + ["--trusted" if trusted else "--no-trusted", "--columns", "journal"])
+    assert result.exit_code == 0, result.output
+    assert list(load_file_iter(output, schema=BiblioSchemaEnum.BIBM)) == expected
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_merge_sources(runner, tmp_path, stream):
+    """
+    Tests merging from several prioritized sources, recording provenance.
+
+    :param runner:
+    :param tmp_path:
+    :param stream:
+    :return:
+    """
+    entries = list(load_file_iter(INPUT_DIR / "test.paperpile.csv"))
+    curated = tmp_path / "curated.bibm.jsonl"
+    write_file([entries[0].model_copy(update={"journal": "Curated J"})], curated)
+    overlay = tmp_path / "overlay.bibm.jsonl"
+    write_file([e.model_copy(update={"journal": "J", "volume": "1"}) for e in entries], overlay)
+    target = tmp_path / "target.bibm.jsonl"
+    write_file(entries, target)
+    output = tmp_path / "merged.bibm.csv"
+    args = ["merge", "-i", str(target), "-s", "BIBM", "-o", str(output), "-c", "journal,volume", "--provenance"]
+    args += ["-m", str(curated), "-m", str(overlay), "--stream" if stream else "--no-stream"]
+    result = runner.invoke(main, args)
+    assert result.exit_code == 0, result.output
+    merged = list(load_file_iter(output, schema=BiblioSchemaEnum.BIBM))
+    assert [(e.journal, e.volume) for e in merged] == [("Curated J", "1"), ("J", "1")]
+    assert merged[0].provenance == [f"journal={curated}", f"volume={overlay}"]
+    assert merged[1].provenance == [f"journal={overlay}", f"volume={overlay}"]
+    # without --provenance, there is no provenance column
+    result = runner.invoke(main, [a for a in args if a != "--provenance"])
+    assert result.exit_code == 0, result.output
+    assert "provenance" not in output.read_text().splitlines()[0].split(",")
+    # provenance from an earlier merge is replaced for the columns merged again
+    target_entries = list(merged)
+    source_index = EntryIndex([entries[0].model_copy(update={"volume": "2"})])
+    list(merge_entries_iter(target_entries, source_index, cols=["volume"], source_names=["new"]))
+    assert (target_entries[0].volume, target_entries[0].provenance) == ("2", [f"journal={curated}", "volume=new"])
+
+
+def test_merge_keeps_tracking_slots():
+    """
+    Tests that merging all columns does not copy the source's tracking slots into the target.
+
+    :return:
+    """
+    source = as_entry_objects([{"title": "t1", "doi": DOI1, "journal": "j1", "source_file": "sources/a.jsonl"}])
+    target = as_entry_objects([{"title": "t1", "doi": DOI1, "source_file": "mine/b.csv"}])[0]
+    merged = list(merge_entries_iter([target], EntryIndex(source), source_names=["s"]))
+    assert (merged[0].journal, merged[0].source_file) == ("j1", "mine/b.csv")
+    assert merged[0].provenance == ["journal=s", "title=s"]
@@ -0,0 +1,171 @@
+"""Tests for eutils."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from bibliomancer import eutils
+from bibliomancer.idstore import IdentifierStore
+
+
+def test_pmids_to_pmcs_chunks(session):
+    """
+    Tests that PMIDs are chunked, and that failed chunks raise or are omitted.
+
+    :param session:
+    :return:
+    """
+    pmids = [str(i) for i in range(1, 21)]
+    results = eutils.pmids_to_pmcs(pmids + ["2"], chunk_size=5, skip_failed=True)
+    assert len(session.requests) == 4
+    assert results["2"] == "PMC2"
+    assert results["3"] is None
+    # 11-15 were in the failing chunk
+    assert all(str(i) not in results for i in range(11, 16))
+    assert len(results) == 15
+    with pytest.raises(IOError):
+        eutils.pmids_to_pmcs(pmids, chunk_size=5)
+
+
+def test_pmid_to_pmc(session):
+    """
+    Tests the single-PMID wrapper.
+
+    :param session:
+    :return:
+    """
+    assert eutils.pmid_to_pmc("4") == "PMC4"
+    assert eutils.pmid_to_pmc("5") is None
+    # a failed request is not reported as a PMID with no PMC entry
+    with pytest.raises(IOError):
+        eutils.pmid_to_pmc("13")
+
+
+def test_identifier_store(session, store):
+    """
+    Tests that mappings, including negative entries, are read from the store.
+
+    :param session:
+    :param store:
+    :return:
+    """
+    assert eutils.pmids_to_pmcs(["2", "3"]) == {"2": "PMC2", "3": None}
+    assert store.get("pmcid", "PMC2", "pmid") == (True, "2")
+    assert store.get("pmid", "3", "pmcid") == (True, None)
+    assert eutils.pmids_to_pmcs(["3", "2", "4"]) == {"3": None, "2": "PMC2", "4": "PMC4"}
+    assert session.requests == [["2", "3"], ["4"]]
+    # failed lookups are not stored
+    assert eutils.pmids_to_pmcs(["13"], skip_failed=True) == {}
+    assert store.get("pmid", "13", "pmcid") == (False, None)
+
+
+def test_identifier_store_expiry():
+    """
+    Tests that expired mappings are ignored and purged.
+
+    :return:
+    """
+    store = IdentifierStore(":memory:", negative_ttl=-1)
+    store.put_record({"pmid": "1", "doi": "10.1/X"}, negative_types=["pmcid"])
+    assert store.get("doi", "10.1/x", "pmid") == (True, "1")
+    assert store.get("pmid", "1", "pmcid") == (False, None)
+    assert store.purge_expired() == 2
+
+
+def test_async_client(async_client, flaky_session):
+    """
+    Tests the async client retries throttled requests and returns partial results.
+
+    :param async_client:
+    :param flaky_session:
+    :return:
+    """
+    pmids = [str(i) for i in range(1, 21)]
+    results = asyncio.run(async_client.pmids_to_pmcs(pmids, chunk_size=5, skip_failed=True))
+    # 4 throttled, 3 retried successfully, and 2 retries of the chunk containing 13
+    assert len(flaky_session.requests) == 9
+    assert results["2"] == "PMC2"
+    assert results["3"] is None
+    assert len(results) == 15
+    assert asyncio.run(async_client.pmid_to_pmc("4")) == "PMC4"
+    with pytest.raises(IOError):
+        asyncio.run(async_client.pmid_to_pmc("13"))
+
+
+def test_token_bucket():
+    """
+    Tests the token bucket spaces out requests.
+
+    :return:
+    """
+    bucket = eutils.TokenBucket(rate=50)
+
+    async def consume(n):
+        for _ in range(n):
+            await bucket.acquire()
+
+    start = time.monotonic()
+    asyncio.run(consume(11))
+    # the first token is available immediately, the remaining 10 take 1/50s each
+    assert time.monotonic() - start >= 0.19
+
+
+def test_token_bucket_threads():
+    """
+    Tests a token bucket shared by event loops in different threads never hands out more tokens than it holds.
+
+    :return:
+    """
+    bucket = eutils.TokenBucket(rate=50)
+
+    async def consume(n):
+        for _ in range(n):
+            await bucket.acquire()
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=asyncio.run, args=(consume(3),)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 12 tokens in total, the first immediately and the remaining 11 at 1/50s each
+    assert time.monotonic() - start >= 0.21
+
+
+PMC_IDS = """Journal Title,ISSN,eISSN,Year,Volume,Issue,Page,DOI,PMCID,PMID,Manuscript Id,Release Date
+Nucleic Acids Res,0305-1048,1362-4962,2019,47,D1,D1018,10.1093/nar/gky1105,PMC6324074,30476213,,live
+Bioinformatics,1367-4803,1367-4811,2017,33,21,3502,10.1093/bioinformatics/btx424,PMC5860113,28541415,,live
+Some Journal,,,2020,1,1,1,,PMC9999999,,,live
+"""
+
+
+def test_pmc_index(tmp_path, monkeypatch, runner, session):
+    """
+    Tests building an offline index, and resolving PMIDs through it without network access.
+
+    :param tmp_path:
+    :param monkeypatch:
+    :param runner:
+    :param session:
+    :return:
+    """
+    from bibliomancer import pmcindex
+    from bibliomancer.cli import main
+
+    input_file = tmp_path / "PMC-ids.csv"
+    input_file.write_text(PMC_IDS)
+    index_dir = tmp_path / "index"
+    result = runner.invoke(main, ["index", "build", str(input_file), "-o", str(index_dir)])
+    assert result.exit_code == 0, result.output
+    index = pmcindex.PMCIndex(index_dir)
+    monkeypatch.setattr(eutils, "get_pmc_index", lambda: index)
+    assert eutils.pmids_to_pmcs(["28541415", "30476213", "1"]) == {
+        "28541415": "PMC5860113",
+        "30476213": "PMC6324074",
+        "1": None,
+    }
+    assert session.requests == []
+    assert index.pmc_to_pmid("PMC9999999") is None
+    assert index.doi_to_ids("10.1093/bioinformatics/btx424") == {"pmid": "28541415", "pmcid": "PMC5860113"}
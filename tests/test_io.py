@@ -1,11 +1,23 @@
+import csv
 from io import StringIO
 
 import pytest
 
+import bibliomancer.datamodel.biblio as bibm
+from bibliomancer.datamodel.entry_table import EntryTable
 from bibliomancer.formatter import generate_markdown
-from bibliomancer.io import load_file_iter, write_file
+from bibliomancer.io import (
+    TRACKING_SLOTS,
+    csv_row_to_entry,
+    load_csv_parallel_iter,
+    load_file_iter,
+    load_files_iter,
+    load_paperpile_csv_iter,
+    write_file,
+)
 from bibliomancer.datamodel.enums import BiblioSchemaEnum, BiblioSyntaxEnum
 from bibliomancer.mapper import map_entries
+from bibliomancer.utilities import construct_entry
 from tests import INPUT_DIR, OUTPUT_DIR
 
 
@@ -38,3 +50,339 @@ def test_io(input_file, input_schema, input_syntax, output_schema, output_syntax
     entries2 = load_file_iter(generated_file, schema=output_schema, format=output_syntax)
     entries2 = list(entries2)
     assert len(entries2) == len(entries)
+
+
+def test_write_csv_streaming():
+    """
+    Tests that streamed CSV is written as entries are produced, and can be read back.
+
+    :return:
+    """
+    stream = StringIO()
+
+    def entries():
+        for i in range(3):
+            # the header and all earlier rows are written before the next entry is produced
+            assert stream.getvalue().count("\n") == i + 1
+            if i % 2:
+                # keys that are not columns are left out
+                yield {"title": f"t{i}", "authors": ["A", "B"], "not_a_slot": "x"}
+            else:
+                yield bibm.Entry(title=f"t{i}", doi=f"10.1/{i}")
+
+    write_file(entries(), stream, format=BiblioSyntaxEnum.CSV, streaming=True)
+    lines = stream.getvalue().splitlines()
+    # slots recording where entries came from are left out by default
+    assert lines[0].split(",") == [k for k in bibm.Entry.model_fields if k not in TRACKING_SLOTS]
+    assert len(lines) == 4
+    assert "not_a_slot" not in stream.getvalue()
+    entries2 = list(load_file_iter(StringIO(stream.getvalue()), format="csv", schema=BiblioSchemaEnum.BIBM))
+    assert [e.title for e in entries2] == ["t0", "t1", "t2"]
+    assert entries2[1].authors == ["A", "B"]
+    assert entries2[2].doi == "10.1/2"
+    stream = StringIO()
+    write_file(entries2, stream, format=BiblioSyntaxEnum.CSV, include_slots=["provenance"])
+    header = stream.getvalue().splitlines()[0].split(",")
+    assert "provenance" in header and "source_file" not in header
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_jsonl_roundtrip(streaming):
+    """
+    Tests writing and reading JSON Lines.
+
+    :param streaming:
+    :return:
+    """
+    entries = list(load_file_iter(INPUT_DIR / "test.paperpile.csv"))
+    OUTPUT_DIR.mkdir(exist_ok=True, parents=True)
+    generated_file = OUTPUT_DIR / "test_io.bibm.jsonl"
+    write_file(iter(entries), generated_file, format=BiblioSyntaxEnum.JSONL, streaming=streaming)
+    with open(generated_file) as stream:
+        assert len(stream.readlines()) == len(entries)
+    # format is inferred from the suffix
+    entries2 = list(load_file_iter(generated_file))
+    assert entries2 == entries
+
+
+@pytest.mark.parametrize(
+    "output_syntax",
+    [BiblioSyntaxEnum.CSV, BiblioSyntaxEnum.JSON, BiblioSyntaxEnum.JSONL, BiblioSyntaxEnum.YAML, BiblioSyntaxEnum.RIS],
+)
+def test_entry_table(output_syntax):
+    """
+    Tests that an EntryTable writes and formats the same as a list of entries.
+
+    :param output_syntax:
+    :return:
+    """
+    entries = list(load_file_iter(INPUT_DIR / "test.paperpile.csv"))
+    table = EntryTable.from_entries(entries)
+    assert len(table) == len(entries)
+    assert list(table) == entries
+    assert table.column("title") == [e.title for e in entries]
+    outputs = []
+    for es in [entries, table]:
+        stream = StringIO()
+        write_file(es, stream, format=output_syntax)
+        outputs.append(stream.getvalue())
+    assert outputs[0] == outputs[1]
+    outputs = []
+    for es in [entries, table]:
+        stream = StringIO()
+        generate_markdown(es, stream)
+        outputs.append(stream.getvalue())
+    assert outputs[0] == outputs[1]
+
+
+def test_entry_table_unvalidated():
+    """
+    Tests that an EntryTable converts numeric values of entries constructed without validation.
+
+    :return:
+    """
+    table = EntryTable.from_entries([construct_entry({"title": "t1", "num_authors": "3", "significance": "0.5"})])
+    assert list(table) == [bibm.Entry(title="t1", num_authors=3, significance=0.5)]
+    with pytest.raises(ValueError, match="num_authors"):
+        table.append(construct_entry({"title": "t2", "num_authors": "x"}))
+
+
+@pytest.mark.parametrize("schema,input_file", [(BiblioSchemaEnum.PAPERPILE, "test.paperpile.csv")])
+def test_lazy_load(schema, input_file):
+    """
+    Tests that lazy entries give the same slot values as eager loading, without materializing.
+
+    :param schema:
+    :param input_file:
+    :return:
+    """
+    entries = list(load_file_iter(INPUT_DIR / input_file, schema=schema))
+    lazy_entries = list(load_file_iter(INPUT_DIR / input_file, schema=schema, lazy=True))
+    assert len(lazy_entries) == len(entries)
+    for entry, lazy_entry in zip(entries, lazy_entries):
+        for k in bibm.Entry.model_fields:
+            assert getattr(lazy_entry, k) == getattr(entry, k), f"Mismatch in {k} for {entry.title}"
+        assert not lazy_entry.is_materialized
+    stream = StringIO()
+    write_file(lazy_entries, stream, format=BiblioSyntaxEnum.JSONL)
+    assert all(e.is_materialized for e in lazy_entries)
+    assert lazy_entries == entries
+
+
+@pytest.mark.parametrize("input_file", ["test.paperpile.csv", "hpo.paperpile.csv"])
+def test_mapping_engines(input_file):
+    """
+    Tests that the linkml-transformer spec maps paperpile rows like the hand-coded mappings.
+
+    :param input_file:
+    :return:
+    """
+    entries = list(load_file_iter(INPUT_DIR / input_file))
+    entries2 = list(load_file_iter(INPUT_DIR / input_file, engine="transformer"))
+    assert len(entries2) == len(entries)
+    for e, e2 in zip(entries, entries2):
+        # the spec maps title from the Title column only, and has no keywords slot to map to
+        assert e.title.startswith(e2.title)
+        assert e2.model_dump(exclude={"title"}) == e.model_dump(exclude={"title"})
+
+
+@pytest.mark.parametrize("input_file", ["test.paperpile.csv", "hpo.paperpile.csv", "bbop.paperpile.csv"])
+@pytest.mark.parametrize("block_size", [1, 7, 1000])
+def test_load_paperpile_csv_blocks(input_file, block_size):
+    """
+    Tests that mapping blocks of rows a column at a time gives the same entries as mapping each row.
+
+    :param input_file:
+    :param block_size:
+    :return:
+    """
+    # include a blank line and a short row
+    text = (INPUT_DIR / input_file).read_text().rstrip("\n") + "\n\nJournal Article,Doe J\n"
+    # bbop has types that are not in the schema, so entries are not validated
+    reader = csv.DictReader(StringIO(text))
+    expected = [csv_row_to_entry(row, BiblioSchemaEnum.PAPERPILE, trusted=True) for row in reader]
+    entries = list(load_paperpile_csv_iter(StringIO(text), trusted=True, block_size=block_size))
+    assert entries == expected
+    assert entries[-1].authors == ["Doe J"]
+
+
+LOAD_FILES_INPUTS = [INPUT_DIR / "test.paperpile.csv", INPUT_DIR / "hpo.paperpile.csv"]
+
+
+@pytest.mark.parametrize(
+    "inputs,jobs,ordered",
+    [
+        (LOAD_FILES_INPUTS, None, True),
+        (LOAD_FILES_INPUTS, 2, True),
+        ("glob", 2, True),
+        ("directory", 2, False),
+    ],
+)
+def test_load_files(tmp_path, inputs, jobs, ordered):
+    """
+    Tests loading several files, from a list, glob or directory.
+
+    :param tmp_path:
+    :param inputs:
+    :param jobs:
+    :param ordered:
+    :return:
+    """
+    paths = LOAD_FILES_INPUTS
+    if not isinstance(inputs, list):
+        paths = [tmp_path / p.name for p in paths]
+        for path, src in zip(paths, LOAD_FILES_INPUTS):
+            path.write_text(src.read_text())
+        (tmp_path / "notes.txt").write_text("not a bibliography")
+        # globs and directories are expanded in sorted order
+        paths = sorted(paths)
+        inputs = str(tmp_path / "*.csv") if inputs == "glob" else tmp_path
+    entries = list(load_files_iter(inputs, jobs=jobs, ordered=ordered))
+    expected = []
+    for path in paths:
+        expected.extend(e.model_copy(update={"source_file": str(path)}) for e in load_file_iter(path))
+    if ordered:
+        assert entries == expected
+    else:
+        assert sorted(entries, key=lambda e: (e.source_file, e.title)) == sorted(
+            expected, key=lambda e: (e.source_file, e.title)
+        )
+
+
+@pytest.mark.parametrize("chunk_bytes", [1, 100, 1 << 20])
+def test_load_csv_parallel(tmp_path, chunk_bytes):
+    """
+    Tests parsing byte ranges of a CSV in parallel, including quoted newlines and quotes.
+
+    :param tmp_path:
+    :param chunk_bytes:
+    :return:
+    """
+    text = (INPUT_DIR / "test.paperpile.csv").read_text()
+    header, *rows = text.splitlines(keepends=True)
+    tricky = rows[0].replace("Billion-scale Detection", 'Billion-scale ""quoted""\nDetection', 1)
+    input_file = tmp_path / "big.paperpile.csv"
+    input_file.write_text(header + tricky + "".join(rows * 5))
+    expected = list(load_file_iter(input_file))
+    assert expected[0].title.startswith('Billion-scale "quoted"\nDetection')
+    entries = list(load_csv_parallel_iter(input_file, jobs=2, chunk_bytes=chunk_bytes))
+    assert entries == expected
+
+
+@pytest.mark.parametrize("suffix", ["csv.gz", "jsonl.bz2", "yaml.xz", "jsonl.zst"])
+def test_compressed_roundtrip(tmp_path, suffix):
+    """
+    Tests writing and reading compressed files, with the format inferred past the compression suffix.
+
+    :param tmp_path:
+    :param suffix:
+    :return:
+    """
+    if suffix.endswith(".zst"):
+        pytest.importorskip("zstandard")
+    entries = list(load_file_iter(INPUT_DIR / "test.paperpile.csv"))
+    output_file = tmp_path / f"test.bibm.{suffix}"
+    write_file(entries, output_file)
+    with open(output_file, "rb") as stream:
+        assert b"SPIRES" not in stream.read()
+    entries2 = list(load_file_iter(output_file, schema=BiblioSchemaEnum.BIBM))
+    # reading BIBM CSV also fills the verbatim slots
+    verbatim = {"authors_verbatim", "urls_verbatim"}
+    assert [e.model_dump(exclude=verbatim) for e in entries2] == [e.model_dump(exclude=verbatim) for e in entries]
+
+
+BIBTEX = """
+% a comment line, with an @ sign in it: @
+@comment{ignored {nested} text}
+@preamble{"\\newcommand{\\noop}[1]{}"}
+@String{ bioinf = "Bioinformatics" }
+@ARTICLE{Holmes2017,
+  author = {Holmes, Ian H and Mungall, Christopher J.},
+  title = {{BioMake}: a {GNU} make-compatible utility for declarative workflow management},
+  journal = bioinf,
+  year = 2017,
+  volume = "33",
+  number = "21",
+  pages = {3502--3504},
+  doi = {10.1093/bioinformatics/btx306},
+}
+@inproceedings(Cappelletti2023,
+  author = "Cappelletti, L and {N3C Consortium}",
+  title = "Billion-scale Detection of {"}Isomorphic{"} Nodes",
+  booktitle = "Proc. " # "IPDPSW",
+  year = "2023"
+)
+@misc{arxiv,
+  title = {SPIRES},
+  eprint = {2304.02711},
+  archivePrefix = {arXiv}
+}
+"""
+
+
+@pytest.mark.parametrize("chunk_size", [7, 1 << 20])
+def test_bibtex_parser(chunk_size):
+    """
+    Tests parsing BibTeX, including when entries span buffer refills.
+
+    :param chunk_size:
+    :return:
+    """
+    from bibliomancer.bibtex import bibtex_to_entry, parse_bibtex_iter
+
+    records = list(parse_bibtex_iter(StringIO(BIBTEX), chunk_size=chunk_size))
+    assert [key for _, key, _ in records] == ["Holmes2017", "Cappelletti2023", "arxiv"]
+    entries = [bibm.Entry(**bibtex_to_entry(t, fields)) for t, _, fields in records]
+    e1, e2, e3 = entries
+    assert e1.type == "JournalArticle"
+    assert e1.title == "BioMake: a GNU make-compatible utility for declarative workflow management"
+    assert e1.authors == ["Holmes IH", "Mungall CJ"]
+    assert (e1.journal, e1.year, e1.volume, e1.issue, e1.pages) == ("Bioinformatics", "2017", "33", "21", "3502-3504")
+    assert e2.type == "ConferencePaper"
+    assert e2.title == 'Billion-scale Detection of "Isomorphic" Nodes'
+    assert e2.authors == ["Cappelletti L", "N3C Consortium"]
+    assert e2.conference_proceedings == "Proc. IPDPSW"
+    assert e3.arxiv_id == "2304.02711"
+
+
+@pytest.mark.parametrize("output_syntax", [BiblioSyntaxEnum.BIBTEX, BiblioSyntaxEnum.RIS])
+def test_bibtex_ris_roundtrip(output_syntax):
+    """
+    Tests writing and reading back BibTeX and RIS.
+
+    :param output_syntax:
+    :return:
+    """
+    entries = list(load_file_iter(INPUT_DIR / "test.paperpile.csv"))
+    stream = StringIO()
+    write_file(entries, stream, format=output_syntax)
+    entries2 = list(load_file_iter(StringIO(stream.getvalue()), format=output_syntax))
+    assert len(entries2) == len(entries)
+    for e, e2 in zip(entries, entries2):
+        for slot in ["type", "title", "authors", "year", "pages", "doi", "urls"]:
+            assert getattr(e2, slot) == getattr(e, slot), slot
+    assert [e.arxiv_id for e in entries2] == [e.arxiv_id for e in entries]
+    assert "2304.02711" in [e.arxiv_id for e in entries2]
+
+
+@pytest.mark.parametrize(
+    "text,output_syntax,key",
+    [
+        ("@misc{k1, year={2020}}", BiblioSyntaxEnum.BIBTEX, "'k1'"),
+        ("TY  - JOUR\nID  - r1\nPY  - 2020\nER  - \n", BiblioSyntaxEnum.RIS, "ID r1"),
+    ],
+)
+def test_bibtex_ris_trusted(text, output_syntax, key):
+    """
+    Tests that BibTeX and RIS entries are only validated when not trusted, and errors name the entry.
+
+    :param text: an entry with no title
+    :param output_syntax:
+    :param key: how the error names the entry
+    :return:
+    """
+    entries = list(load_file_iter(StringIO(text), format=output_syntax, trusted=True))
+    assert [e.year for e in entries] == ["2020"]
+    assert "title" not in entries[0].model_fields_set
+    with pytest.raises(ValueError, match=key):
+        list(load_file_iter(StringIO(text), format=output_syntax))
@@ -2,8 +2,8 @@
 
 import pytest
 
-from bibliomancer import repair
-from bibliomancer.enricher import RULES
+from bibliomancer import eutils, repair
+from bibliomancer.enricher import RULES, repair_all_iter
 
 
 @pytest.mark.parametrize("rule", RULES)
@@ -11,3 +11,32 @@ def test_repair(rule):
     for rule_test in rule["tests"]:
         print("TEST", rule_test)
         assert repair(rule_test["input"], rules=[rule["name"]]) == rule_test["output"]
+
+
+def test_repair_all_batched(monkeypatch):
+    """
+    Tests that lookups are made once per batch, and entries keep their order.
+
+    Values missing from a batch result, e.g. after a failed request, are looked up individually.
+
+    :param monkeypatch:
+    :return:
+    """
+    calls = []
+
+    def mock_pmids_to_pmcs(pmids, skip_failed=False):
+        calls.append(pmids)
+        # 3 has no PMC entry; the request for 5 failed
+        return {pmid: None if pmid == "3" else f"PMC{pmid}" for pmid in pmids if pmid != "5"}
+
+    monkeypatch.setattr(eutils, "pmids_to_pmcs", mock_pmids_to_pmcs)
+    monkeypatch.setattr(eutils, "pmid_to_pmc", lambda pmid: f"PMC{pmid}-single")
+    entries = [{"title": f"t{i}", "pmid": str(i)} for i in range(10)]
+    entries.append({"title": "has pmcid", "pmid": "99", "pmcid": "PMC1"})
+    repaired = list(repair_all_iter(entries, batch_size=4, rules=["PMC_from_PMID"]))
+    assert [e["title"] for e in repaired] == [e["title"] for e in entries]
+    assert calls == [["0", "1", "2", "3"], ["4", "5", "6", "7"], ["8", "9"]]
+    assert repaired[0]["pmcid"] == "PMC0"
+    assert repaired[3]["pmcid"] is None
+    assert repaired[5]["pmcid"] == "PMC5-single"
+    assert repaired[-1]["pmcid"] == "PMC1"
@@ -1,10 +1,20 @@
 """Demo version test."""
 
-import pytest
+import pickle
+import re
 
-from bibliomancer.utilities import index_entries, as_entry_objects
-from bibliomancer.validator import validate_entries_iter
+import pytest
+from pydantic import ValidationError
 
+from bibliomancer.mergeutil import merge_entries_from
+from bibliomancer.utilities import (
+    AuthorMatcher,
+    as_entry_objects,
+    author_matches,
+    index_entries,
+    is_author_regex,
+    validate_entry_objects,
+)
 
 DOI1 = "10.48550/2103.00001"
 DOI2 = "10.48550/2103.00002"
@@ -57,3 +67,60 @@ def test_index(entries, index_key, index_val, expected, valid):
         assert v[0].title == expected
     else:
         assert v is None or len(v) == 0
+
+
+@pytest.mark.parametrize("trusted", [False, True])
+def test_trusted_merge(trusted):
+    """
+    Tests that trusted construction and merging gives the same result after batch validation.
+
+    :param trusted:
+    :return:
+    """
+    targets = as_entry_objects([{"title": "t1", "doi": DOI1}, {"title": "t2", "doi": DOI2}], trusted=trusted)
+    sources = as_entry_objects([{"title": "t1", "doi": DOI1, "journal": J1, "num_authors": "3"}], trusted=trusted)
+    merge_entries_from(targets, sources, cols=["journal", "num_authors"], trusted=trusted)
+    # trusted merges copy values without validating them on assignment
+    assert targets[0].num_authors == ("3" if trusted else 3)
+    entries = validate_entry_objects(targets)
+    assert [(e.title, e.journal, e.num_authors) for e in entries] == [("t1", J1, 3), ("t2", None, None)]
+    if trusted:
+        # errors are only found at validation time
+        bad = as_entry_objects([{"title": "t1", "num_authors": "x"}], trusted=True)
+        with pytest.raises(ValidationError):
+            validate_entry_objects(bad)
+    with pytest.raises(ValueError):
+        as_entry_objects([{"title": "t1", "no_such_field": "x"}], trusted=trusted)
+
+
+AUTHORS = ["Mungall CJ", "Mungall C", "Caufield JH", "Caufield J", "Reese JT", "Moxon SAT", "Smith J.", "Other X"]
+
+
+@pytest.mark.parametrize(
+    "queries",
+    [
+        ["Mungall CJ"],
+        ["Mungall C"],
+        ["Mungall CJ", "Caufield JH?", "Reese J.", "Nobody N"],
+        ["Moxon S", "Smith J\\.", "^Other"],
+        ["(Mungall) C\\1?", "(?P<name>Reese) JT", "(?P<name>Moxon) SAT"],
+        [],
+    ],
+)
+@pytest.mark.parametrize("partial", [False, True])
+def test_author_matcher(queries, partial):
+    """
+    Tests that a compiled matcher agrees with matching each query as a regex.
+
+    :param queries:
+    :param partial:
+    :return:
+    """
+    matcher = AuthorMatcher(queries, partial=partial)
+    for author in AUTHORS:
+        expected = any(q == author or re.match(q if partial else f"^(?:{q})$", author) for q in queries)
+        assert matcher.matches(author) == expected, author
+        assert any(author_matches(author, q, partial=partial) for q in queries) == expected, author
+    assert pickle.loads(pickle.dumps(matcher)).queries == matcher.queries
+    if partial:
+        assert set(matcher.prefixes) == {q for q in queries if not is_author_regex(q)}
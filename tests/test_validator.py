@@ -2,6 +2,9 @@
 
 import pytest
 
+from bibliomancer.cli import main
+from bibliomancer.datamodel.entry_table import EntryTable
+from bibliomancer.io import write_file
 from bibliomancer.validator import validate_entries_iter
 
 
@@ -20,3 +23,62 @@ def test_validator(objects, passes):
         assert not results, f"Unexpected validation failure: {results}"
     else:
         assert results, "Unexpected validation pass"
+
+
+def test_validator_entry_table():
+    """
+    Tests validating the rows of an EntryTable.
+
+    :return:
+    """
+    table = EntryTable.from_entries([{"title": "t1", "doi": "10.1/1"}, {"title": "t2", "doi": "10.1/1"}])
+    results = list(validate_entries_iter(table))
+    assert [r.message for r in results] == ["Duplicate entries for ('doi',): ('10.1/1',)"]
+
+
+@pytest.mark.parametrize(
+    "titles,threshold,expected",
+    [
+        (["Structured prompt interrogation (SPIRES)", "Structured Prompt Interrogation (SPIRES)."], 0.8, 1),
+        (["Structured prompt interrogation (SPIRES)", "The FlyBase database"], 0.8, 0),
+        # exact duplicates are only reported once
+        (["The FlyBase database", "The FlyBase database"], 0.8, 0),
+        (["The FlyBase database", "The FlyBase database"], None, 0),
+        # titles without letters or digits are not compared
+        (["?", "...", "Structured prompt interrogation (SPIRES)"], 0.8, 0),
+    ],
+)
+def test_near_duplicates(titles, threshold, expected):
+    """
+    Tests that near-duplicate titles are reported once, and only with a threshold.
+
+    :param titles:
+    :param threshold:
+    :param expected: number of near-duplicate warnings
+    :return:
+    """
+    entries = [{"title": t, "doi": f"10.1/{i}"} for i, t in enumerate(titles)]
+    results = list(validate_entries_iter(entries, near_duplicate_threshold=threshold))
+    near = [r for r in results if r.message.startswith("Near-duplicate")]
+    assert len(near) == expected
+
+
+@pytest.mark.parametrize("fail_on_warnings,exit_code", [(False, 0), (True, 1)])
+def test_cli_near_duplicates(runner, tmp_path, fail_on_warnings, exit_code):
+    """
+    Tests that near-duplicate warnings fail the validate command only with --fail-on-warnings.
+
+    :param runner:
+    :param tmp_path:
+    :param fail_on_warnings:
+    :param exit_code:
+    :return:
+    """
+    input_file = tmp_path / "refs.bibm.jsonl"
+    titles = ["Structured prompt interrogation (SPIRES)", "Structured Prompt Interrogation (SPIRES)."]
+    write_file([{"title": t, "doi": f"10.1/{i}"} for i, t in enumerate(titles)], input_file)
+    args = ["validate", "-i", str(input_file), "-s", "BIBM", "--near-duplicate-threshold", "0.8"]
+    if fail_on_warnings:
+        args.append("--fail-on-warnings")
+    result = runner.invoke(main, args)
+    assert result.exit_code == exit_code, result.output